@@ -0,0 +1,78 @@
+"""
+Bot data layer throughput: the old single blocking psycopg connection vs the async pool from db_conn.
+
+Every simulated update does what a typical handler does: read the state, read the user, update the state.
+Needs a running database with the bot schema and a registered user.
+
+    python benchmarks/db_pool.py --telegram-id 123456789 --updates 2000 --concurrency 200
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'telegram_bot'))
+
+import psycopg
+from loguru import logger
+from psycopg.rows import dict_row
+
+import db_conn
+
+
+def blocking_update(conn, telegram_id):
+    with conn.cursor() as cursor:
+        cursor.execute('select state from telegram_user_data where telegram_id = %s;', (telegram_id,))
+        state = cursor.fetchone().get('state') or {}
+        cursor.execute('select * from telegram_user_data where telegram_id = %s;', (telegram_id,))
+        cursor.fetchone()
+        cursor.execute('update telegram_user_data set state = %s where telegram_id = %s;',
+                       (json.dumps(state), telegram_id))
+    conn.commit()
+
+
+async def pooled_update(telegram_id):
+    db = db_conn.DataBaseState(tg_id=telegram_id)
+    state = await db.get_state()
+    await db_conn.get_user_info(telegram_id)
+    await db.update_state(func_message_id=state.func_message_id)
+
+
+async def run(update, updates, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await update()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(updates)))
+    return updates / (time.perf_counter() - started)
+
+
+async def main(args):
+    conn = psycopg.connect(db_conn.pool().conninfo, row_factory=dict_row)
+
+    async def before():
+        blocking_update(conn, args.telegram_id)
+
+    before_rate = await run(before, args.updates, args.concurrency)
+    conn.close()
+
+    await db_conn.open_pool()
+    after_rate = await run(lambda: pooled_update(args.telegram_id), args.updates, args.concurrency)
+    await db_conn.close_pool()
+
+    logger.info(f'Single blocking connection: {before_rate:.0f} updates/sec')
+    logger.info(f'Async pool ({db_conn.DB_POOL_MIN_SIZE}-{db_conn.DB_POOL_MAX_SIZE}): {after_rate:.0f} updates/sec')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--telegram-id', type=int, required=True)
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    asyncio.run(main(parser.parse_args()))
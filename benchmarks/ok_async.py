@@ -0,0 +1,89 @@
+"""
+OK product reads: the blocking ApiOk one after another vs AsyncApiOk running them concurrently on one pool.
+
+Starts a local mock of api.ok.ru/fb.do (every call answers after --latency ms), no token or network needed.
+
+    python benchmarks/ok_async.py --reads 1000 --latency 20 --limit 30
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+from aiohttp import web
+
+PORT = 8769
+os.environ['OK_API_URL'] = f'http://127.0.0.1:{PORT}/fb.do'
+for key in ('PUBLIC_KEY', 'SECRET_KEY', 'TOKEN_OK', 'GROUP_ID'):
+    os.environ.setdefault(key, 'benchmark')
+os.environ.setdefault('OK_RATE_LIMIT', '100000')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from loguru import logger
+
+from main import ApiOk
+from ok_api_async import AsyncApiOk, AsyncOkSession
+
+
+def mock_app(latency: float):
+    async def fb_do(request):
+        await asyncio.sleep(latency)
+        return web.json_response({'products': [{'id': request.query.get('product_ids'), 'status': 'ACTIVE'}]})
+
+    app = web.Application()
+    app.router.add_route('*', '/fb.do', fb_do)
+    return app
+
+
+def serve(latency: float, started: threading.Event):
+    async def run():
+        runner = web.AppRunner(mock_app(latency))
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', PORT).start()
+        started.set()
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+async def concurrent_reads(reads: int, limit: int):
+    session = AsyncOkSession(limit=limit, limit_per_host=limit)
+    market = AsyncApiOk(session=session).market()
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(market.get_product(str(i)) for i in range(reads)))
+    elapsed = time.perf_counter() - started
+
+    await session.close()
+    assert all(result['products'][0]['id'] == str(i) for i, result in enumerate(results))
+    return elapsed
+
+
+def main(args):
+    started = threading.Event()
+    threading.Thread(target=serve, args=(args.latency / 1000, started), daemon=True).start()
+    started.wait()
+
+    market = ApiOk.Market()
+    start = time.perf_counter()
+    for i in range(args.reads):
+        assert market.get_product(str(i))['products'][0]['id'] == str(i)
+    sequential = time.perf_counter() - start
+
+    concurrent = asyncio.run(concurrent_reads(args.reads, args.limit))
+
+    logger.info(f'Sequential ApiOk: {args.reads} reads in {sequential:.2f}s ({args.reads / sequential:.0f}/s)')
+    logger.info(f'AsyncApiOk (limit {args.limit}): {args.reads} reads in {concurrent:.2f}s '
+                f'({args.reads / concurrent:.0f}/s, {sequential / concurrent:.1f}x)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reads', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=20)
+    parser.add_argument('--limit', type=int, default=30)
+    main(parser.parse_args())
@@ -0,0 +1,82 @@
+"""
+VIN search: the old linear filters from trucks_view_buttons vs the trigram index from vin_index.
+
+Generates random trucks (no database needed) and times partial VIN search, last 6 digits lookup and the favorites
+filter with both approaches.
+
+    python benchmarks/vin_index.py --trucks 100000 --queries 200 --favorites 50
+"""
+
+import argparse
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'telegram_bot'))
+
+from loguru import logger
+
+from vin_index import VinIndex
+
+
+VIN_ALPHABET = 'ABCDEFGHJKLMNPRSTUVWXYZ0123456789'
+MANUFACTURERS = ['XTC', 'YS2', 'WDB', 'XTA', 'Z9M', 'JHM', '1FU', 'LZG']
+
+
+def random_vin(rnd):
+    return rnd.choice(MANUFACTURERS) + ''.join(rnd.choices(VIN_ALPHABET, k=8)) + ''.join(rnd.choices('0123456789', k=6))
+
+
+def timed(func, queries):
+    started = time.perf_counter()
+    for query in queries:
+        func(query)
+    return (time.perf_counter() - started) / len(queries) * 1000
+
+
+def main(args):
+    rnd = random.Random(args.seed)
+    trucks = [SimpleNamespace(id=id_, vin=random_vin(rnd)) for id_ in range(1, args.trucks + 1)]
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    index = VinIndex(trucks)
+    build_time = time.perf_counter() - started
+    index_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    samples = [rnd.choice(trucks).vin for _ in range(args.queries)]
+    partial = [vin[rnd.randint(0, 7):][:rnd.randint(4, 10)] for vin in samples]
+    last_digits = [vin[-6:] for vin in samples]
+    favorites = [[rnd.choice(trucks).vin for _ in range(args.favorites)] for _ in range(args.queries)]
+
+    cases = [
+        ('partial VIN', partial,
+         lambda vin: list(filter(lambda truck_: vin in truck_.vin, trucks)),
+         index.search),
+        ('last 6 digits', last_digits,
+         lambda digits: list(filter(lambda truck_: truck_.vin.endswith(digits), trucks)),
+         index.by_last_digits),
+        (f'favorites ({args.favorites} VINs)', favorites,
+         lambda vins: list(filter(lambda truck_: truck_.vin in vins, trucks)),
+         index.ids_for_vins),
+    ]
+
+    logger.info(f'{args.trucks} trucks, index built in {build_time:.2f}s, {index_memory / 2 ** 20:.0f} MiB')
+    for name, queries, scan, indexed in cases:
+        for query in queries[:20]:
+            assert [truck.id for truck in scan(query)] == indexed(query)
+        scan_ms, index_ms = timed(scan, queries), timed(indexed, queries)
+        logger.info(f'{name}: scan {scan_ms:.3f} ms, index {index_ms:.3f} ms ({scan_ms / index_ms:.0f}x)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--trucks', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--favorites', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    main(parser.parse_args())
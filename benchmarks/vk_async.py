@@ -0,0 +1,89 @@
+"""
+VK wall reads: the blocking ApiVk one after another vs AsyncApiVk running them concurrently on one pool.
+
+Starts a local mock of the VK API (every call answers after --latency ms), no token or network needed.
+
+    python benchmarks/vk_async.py --reads 200 --latency 50 --limit 30
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+from aiohttp import web
+
+PORT = 8765
+os.environ['VK_API_URL'] = f'http://127.0.0.1:{PORT}/method/'
+os.environ.setdefault('TOKEN_VK', 'benchmark')
+os.environ.setdefault('API_VERSION', '5.199')
+os.environ.setdefault('VK_RATE_LIMIT', '100000')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from loguru import logger
+
+from vk_api import ApiVk
+from vk_api_async import AsyncApiVk, AsyncVkSession
+
+
+def mock_app(latency: float):
+    async def method(request):
+        await asyncio.sleep(latency)
+        return web.json_response({'response': {'count': 1, 'items': [{'id': 1, 'text': request.match_info['name']}]}})
+
+    app = web.Application()
+    app.router.add_route('*', '/method/{name}', method)
+    return app
+
+
+def serve(latency: float, started: threading.Event):
+    async def run():
+        runner = web.AppRunner(mock_app(latency))
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', PORT).start()
+        started.set()
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+async def concurrent_reads(reads: int, limit: int):
+    session = AsyncVkSession(limit=limit, limit_per_host=limit)
+    wall = AsyncApiVk(session=session).wall()
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(wall.get(owner_id='-1') for _ in range(reads)))
+    elapsed = time.perf_counter() - started
+
+    await session.close()
+    assert all(result['result'] == 'success' for result in results)
+    return elapsed
+
+
+def main(args):
+    started = threading.Event()
+    threading.Thread(target=serve, args=(args.latency / 1000, started), daemon=True).start()
+    started.wait()
+
+    wall = ApiVk().Wall()
+    start = time.perf_counter()
+    for _ in range(args.reads):
+        assert wall.get(owner_id='-1')['result'] == 'success'
+    sequential = time.perf_counter() - start
+
+    concurrent = asyncio.run(concurrent_reads(args.reads, args.limit))
+
+    logger.info(f'Sequential ApiVk: {args.reads} reads in {sequential:.2f}s ({args.reads / sequential:.0f}/s)')
+    logger.info(f'AsyncApiVk (limit {args.limit}): {args.reads} reads in {concurrent:.2f}s '
+                f'({args.reads / concurrent:.0f}/s, {sequential / concurrent:.1f}x)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reads', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=50)
+    parser.add_argument('--limit', type=int, default=30)
+    main(parser.parse_args())
@@ -0,0 +1,156 @@
+"""
+New wall comments: Bots Long Poll (LongPollConsumer) vs polling wall.getComments every --interval seconds.
+
+Starts a local stand-in of the VK API and its long poll server; a writer adds --events comments at random moments
+during --duration seconds. Reports how many requests each approach made and how late the comments were noticed.
+The stand-in also expires the long poll key once (failed: 2) to exercise the reconnect.
+
+    python benchmarks/vk_longpoll.py --events 50 --duration 10 --interval 2
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from aiohttp import web
+
+PORT = 8766
+os.environ['VK_API_URL'] = f'http://127.0.0.1:{PORT}/method/'
+os.environ.setdefault('TOKEN_VK', 'benchmark')
+os.environ.setdefault('GROUP_TOKENS_VK', 'benchmark-group')
+os.environ.setdefault('API_VERSION', '5.199')
+os.environ.setdefault('VK_RATE_LIMIT', '100000')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from loguru import logger
+
+from vk_api_async import AsyncApiVk, AsyncVkSession
+from vk_events import LongPollConsumer
+
+
+class StandIn:
+    def __init__(self):
+        self.comments: list[dict] = []
+        self.changed = asyncio.Condition()
+        self.key = 'key-1'
+        self.requests = {'longpoll': 0, 'getComments': 0}
+
+    async def add_comment(self, comment_id: int):
+        comment = {'id': comment_id, 'post_id': 1, 'owner_id': -1, 'text': f'comment {comment_id}',
+                   'created': time.perf_counter()}
+        async with self.changed:
+            self.comments.append(comment)
+            self.changed.notify_all()
+
+    async def method(self, request):
+        name = request.match_info['name']
+        if name == 'groups.getLongPollServer':
+            return web.json_response({'response': {
+                'server': f'http://127.0.0.1:{PORT}/longpoll', 'key': self.key, 'ts': str(len(self.comments))
+            }})
+
+        self.requests['getComments'] += 1
+        items = sorted(self.comments, key=lambda comment: -comment['id'])[:100]
+        return web.json_response({'response': {'count': len(self.comments), 'items': items}})
+
+    async def longpoll(self, request):
+        self.requests['longpoll'] += 1
+        if request.query['key'] != self.key:
+            return web.json_response({'failed': 2})
+        if self.requests['longpoll'] == 3:
+            self.key = 'key-2'
+
+        ts, wait = int(request.query['ts']), float(request.query['wait'])
+        async with self.changed:
+            try:
+                await asyncio.wait_for(self.changed.wait_for(lambda: len(self.comments) > ts), wait)
+            except asyncio.TimeoutError:
+                pass
+
+        updates = [{'type': 'wall_reply_new', 'group_id': 1, 'event_id': str(comment['id']), 'object': comment}
+                   for comment in self.comments[ts:]]
+        return web.json_response({'ts': str(len(self.comments)), 'updates': updates})
+
+    async def serve(self) -> web.AppRunner:
+        app = web.Application()
+        app.router.add_route('*', '/method/{name}', self.method)
+        app.router.add_get('/longpoll', self.longpoll)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', PORT).start()
+        return runner
+
+
+async def writer(stand_in: StandIn, events: int, duration: float):
+    moments = sorted(random.uniform(0, duration) for _ in range(events))
+    started = time.perf_counter()
+    for comment_id, moment in enumerate(moments, 1):
+        await asyncio.sleep(max(0.0, moment - (time.perf_counter() - started)))
+        await stand_in.add_comment(comment_id)
+
+
+async def long_poll(stand_in: StandIn, args) -> list[float]:
+    session = AsyncVkSession()
+    consumer = LongPollConsumer(1, session=session, wait=5, state_path=None)
+    consumer.start()
+
+    delays = []
+    write = asyncio.create_task(writer(stand_in, args.events, args.duration))
+    while len(delays) < args.events:
+        event = await consumer.queue.get()
+        delays.append(time.perf_counter() - event.object['created'])
+        consumer.queue.task_done()
+
+    await write
+    await consumer.stop()
+    await session.close()
+    return delays
+
+
+async def polling(stand_in: StandIn, args) -> list[float]:
+    session = AsyncVkSession()
+    wall = AsyncApiVk(session=session).wall()
+
+    delays, seen = [], set()
+    write = asyncio.create_task(writer(stand_in, args.events, args.duration))
+    while len(seen) < args.events:
+        result = await wall.get_comments(owner_id='-1', post_id='1', count=100, sort='desc')
+        now = time.perf_counter()
+        for comment in result['data']['items']:
+            if comment['id'] not in seen:
+                seen.add(comment['id'])
+                delays.append(now - comment['created'])
+        await asyncio.sleep(args.interval)
+
+    await write
+    await session.close()
+    return delays
+
+
+async def main(args):
+    stand_in = StandIn()
+    runner = await stand_in.serve()
+
+    long_poll_delays = await long_poll(stand_in, args)
+    stand_in.comments.clear()
+    polling_delays = await polling(stand_in, args)
+    await runner.cleanup()
+
+    for name, delays, requests in (('Long poll', long_poll_delays, stand_in.requests['longpoll']),
+                                   (f'Polling every {args.interval}s', polling_delays,
+                                    stand_in.requests['getComments'])):
+        logger.info(f'{name}: {len(delays)} comments, {requests} requests, '
+                    f'delay p50 {statistics.median(delays) * 1000:.0f}ms, max {max(delays) * 1000:.0f}ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--interval', type=float, default=2)
+    asyncio.run(main(parser.parse_args()))
@@ -1,16 +1,45 @@
 import json
+import mimetypes
 import os
-from functools import lru_cache
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from functools import lru_cache, wraps
 from pathlib import Path
 
 from loguru import logger
 import dotenv
-import requests
 from pydantic import AliasChoices, Field, BaseModel
+from requests_toolbelt import MultipartEncoder
 from requests_toolbelt.sessions import BaseUrlSession
 
+from ok_upload_cache import file_hash, upload_cache
+from rate_limit import RateLimiter, parse_rates
+
 dotenv.load_dotenv()
 
+OK_API_URL = os.getenv('OK_API_URL', 'https://api.ok.ru/fb.do')
+# requests per second of the application, and of single methods, e.g. "market.add=2,photosV2.commit=5"
+OK_RATE_LIMIT = float(os.getenv('OK_RATE_LIMIT', 10))
+OK_RATE_LIMITS = parse_rates(os.getenv('OK_RATE_LIMITS', ''))
+OK_MAX_RETRIES = int(os.getenv('OK_MAX_RETRIES', 3))
+# 2 - service temporarily unavailable, 8 - flood blocked
+OK_RETRY_CODES = {int(code) for code in os.getenv('OK_RETRY_CODES', '2,8').split(',') if code.strip()}
+# 1 - unknown error, retried for read methods only: a write may have been applied
+OK_READ_RETRY_CODES = {int(code) for code in os.getenv('OK_READ_RETRY_CODES', '1').split(',') if code.strip()}
+OK_READ_PREFIXES = ('get', 'search', 'is')
+OK_UPLOAD_BATCH = int(os.getenv('OK_UPLOAD_BATCH', 20))
+OK_UPLOAD_CONCURRENCY = int(os.getenv('OK_UPLOAD_CONCURRENCY', 4))
+OK_UPLOAD_TIMEOUT = float(os.getenv('OK_UPLOAD_TIMEOUT', 120))
+# calls per batch.executeV2 request
+OK_BATCH_LIMIT = int(os.getenv('OK_BATCH_LIMIT', 10))
+# calls made within this window (from any thread) are sent as one batch, 0 - every call is sent right away
+OK_BATCH_WINDOW_MS = float(os.getenv('OK_BATCH_WINDOW_MS', 0))
+
+ok_limiter = RateLimiter(rate=OK_RATE_LIMIT, rates=OK_RATE_LIMITS, max_retries=OK_MAX_RETRIES)
+
 
 class Credentials(BaseModel):
     application_key: str = Field(..., validation_alias=AliasChoices('PUBLIC_KEY'))
@@ -20,7 +49,7 @@ class Credentials(BaseModel):
 
     def __init__(self):
         dotenv.load_dotenv()
-        super().__init__(**dotenv.dotenv_values())
+        super().__init__(**(dict(os.environ) | dotenv.dotenv_values()))
 
     @property
     def params(self):
@@ -29,12 +58,42 @@ class Credentials(BaseModel):
 
 class OkSession(BaseUrlSession):
     def __init__(self):
-        super().__init__('https://api.ok.ru/fb.do')
+        super().__init__(OK_API_URL)
         self._credentials = Credentials()
 
     def request(self, method, url, **kwargs):
+
+        """
+        API calls get the credentials, wait for the rate limiter of the application and of the method (ok_limiter)
+        and are retried with jittered backoff when OK answers with an error of OK_RETRY_CODES (or of
+        OK_READ_RETRY_CODES for a read method); absolute URLs
+        (upload servers) are requested as they are, on the same pool
+        """
+
+        if url.startswith(('http://', 'https://')):
+            return super().request(method, url, **kwargs)
+
         kwargs['params'] = kwargs.get('params', {}) | self._credentials.params
-        return super().request(method, url, **kwargs)
+        api_method = kwargs['params'].get('method', '')
+        attempt = 0
+
+        while True:
+            for family in ok_limit_families(api_method):
+                ok_limiter.wait(self._credentials.application_key, family)
+            response = super().request(method, url, **kwargs)
+
+            try:
+                code = ok_error_code(response.json())
+            except ValueError:
+                return response
+
+            delay = ok_limiter.retry_delay(attempt) if ok_retryable(api_method, code) else None
+            if delay is None:
+                return response
+
+            logger.warning(f'OK error {code} on {api_method}, retry {attempt + 1} in {delay:.2f}s')
+            time.sleep(delay)
+            attempt += 1
 
 
 @lru_cache
@@ -42,6 +101,313 @@ def ok_session():
     return OkSession()
 
 
+def ok_error_code(response: dict) -> int | None:
+    return response.get('error_code') if isinstance(response, dict) else None
+
+
+def ok_retryable(method: str, code: int | None) -> bool:
+    if code in OK_RETRY_CODES:
+        return True
+    return code in OK_READ_RETRY_CODES and method.split('.')[-1].startswith(OK_READ_PREFIXES)
+
+
+def ok_limit_families(method: str) -> list[str]:
+
+    """
+    Buckets of ok_limiter a request of `method` goes through: the application one ('') and the method one if
+    OK_RATE_LIMITS has it
+    """
+
+    return ['', method] if method in ok_limiter.rates else ['']
+
+
+@lru_cache
+def ok_batcher():
+    return OkBatcher()
+
+
+@lru_cache
+def ok_upload_scope() -> str:
+
+    """
+    Scope of upload_cache() entries: photo ids are only valid for the application and group they were uploaded with
+    """
+
+    credentials = Credentials()
+    return f'{credentials.application_key}:{credentials.group_id}'
+
+
+@lru_cache
+def ok_commit_executor():
+
+    """
+    Threads of the photosV2.commit calls, shared by every upload so at most OK_UPLOAD_CONCURRENCY run at a time
+    """
+
+    return ThreadPoolExecutor(OK_UPLOAD_CONCURRENCY, thread_name_prefix='ok-commit')
+
+
+current_batch: ContextVar['OkBatch | None'] = ContextVar('current_batch', default=None)
+
+
+def batch_params(params: dict) -> dict:
+    return {
+        key: ','.join(map(str, value)) if isinstance(value, (list, tuple)) else str(value)
+        for key, value in params.items() if key != 'method' and value is not None
+    }
+
+
+def execute_batch(calls: list[dict]) -> list[dict]:
+
+    """
+    Sends the calls (params with 'method') with batch.executeV2, OK_BATCH_LIMIT per request, and returns what every
+    call would have returned on its own: its result, or its error ({'error_code': ..., 'error_msg': ...}).
+    Every call waits for the ok_limiter bucket of its method (if OK_RATE_LIMITS has one) and calls failing with a
+    retryable error (ok_retryable) are sent again in the next batch, with backoff.
+    """
+
+    if len(calls) == 1:
+        return [ok_session().post('', params=calls[0]).json()]
+
+    session = ok_session()
+    responses = [None] * len(calls)
+    waiting = list(range(len(calls)))
+    attempt = 0
+
+    while True:
+        retry = []
+        for i in range(0, len(waiting), OK_BATCH_LIMIT):
+            chunk = waiting[i:i + OK_BATCH_LIMIT]
+            for index in chunk:
+                for family in ok_limit_families(calls[index]['method'])[1:]:
+                    ok_limiter.wait(session._credentials.application_key, family)
+
+            methods = [{calls[index]['method']: {'params': batch_params(calls[index])}} for index in chunk]
+            response = session.post('', params={'method': 'batch.executeV2'},
+                                    data={'methods': json.dumps(methods, ensure_ascii=False)}).json()
+
+            if isinstance(response, dict):
+                items = [response] * len(chunk)
+            else:
+                items = [item.get('result') if item.get('ok') else item.get('error', item) for item in response]
+
+            for index, item in zip(chunk, items):
+                responses[index] = item
+                if ok_retryable(calls[index]['method'], ok_error_code(item)):
+                    retry.append(index)
+
+        delay = ok_limiter.retry_delay(attempt) if retry else None
+        if delay is None:
+            return responses
+
+        logger.warning(f'OK batch: {len(retry)} call(s) failed, retry {attempt + 1} in {delay:.2f}s')
+        time.sleep(delay)
+        waiting = retry
+        attempt += 1
+
+
+def run_sync(generator):
+    try:
+        params = next(generator)
+        while True:
+            if OK_BATCH_WINDOW_MS:
+                response = ok_batcher().post(params)
+            else:
+                response = ok_session().post('', params=params).json()
+            params = generator.send(response)
+    except StopIteration as e:
+        return e.value
+
+
+def ok_method(func):
+
+    """
+    API methods are generators: they yield the params of every fb.do request (with 'method') and receive the decoded
+    response. The decorated method runs the generator on ok_session(), or adds it to the current OkBatch and returns
+    its OkResult; the undecorated generator is kept in `.generator`.
+    """
+
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        batch = current_batch.get()
+        if batch is not None:
+            return batch.add(func(self, *args, **kwargs))
+        return run_sync(func(self, *args, **kwargs))
+
+    wrapper.generator = func
+    return wrapper
+
+
+class OkResult:
+
+    """
+    Lazy result of a call made inside ok_batch(): result() sends the pending calls of the batch if needed, and
+    raises the error the call failed with (its own, or the one that stopped the batch from being sent)
+    """
+
+    def __init__(self, batch: 'OkBatch', generator):
+        self.batch = batch
+        self.generator = generator
+        self.params = None
+        self.done = False
+        self.value = None
+        self.error = None
+
+    def advance(self, response=None, first: bool = False):
+        try:
+            self.params = next(self.generator) if first else self.generator.send(response)
+        except StopIteration as e:
+            self.done, self.params, self.value = True, None, e.value
+        except Exception as e:
+            self.fail(e)
+
+    def fail(self, error: BaseException):
+        self.generator.close()
+        self.done, self.params, self.error = True, None, error
+
+    def result(self):
+        if not self.done:
+            self.batch.flush()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class OkBatch:
+
+    """
+    Calls of ApiOk methods made inside `with ok_batch() as batch:` are not sent one by one: they return OkResult and
+    go as batch.executeV2 requests of OK_BATCH_LIMIT calls on leaving the block (or on the first result()).
+    If the block raises, or a request of the batch fails, the pending calls are not sent and their OkResult raise
+    that error.
+    """
+
+    def __init__(self):
+        self.pending: list[OkResult] = []
+        self.requests = 0
+
+    def add(self, generator) -> OkResult:
+        result = OkResult(self, generator)
+        result.advance(first=True)
+        if not result.done:
+            self.pending.append(result)
+        return result
+
+    def fail(self, error: BaseException):
+        pending, self.pending = self.pending, []
+        for result in pending:
+            result.fail(error)
+
+    def flush(self):
+        while self.pending:
+            pending, self.pending = self.pending, []
+            try:
+                responses = execute_batch([result.params for result in pending])
+            except Exception as e:
+                self.pending = pending + self.pending
+                self.fail(e)
+                raise
+            self.requests += (len(pending) + OK_BATCH_LIMIT - 1) // OK_BATCH_LIMIT
+
+            for result, response in zip(pending, responses):
+                result.advance(response)
+                if not result.done:
+                    self.pending.append(result)
+
+
+@contextmanager
+def ok_batch():
+    batch = OkBatch()
+    token = current_batch.set(batch)
+    try:
+        yield batch
+    except BaseException as e:
+        batch.fail(e)
+        raise
+    finally:
+        current_batch.reset(token)
+    batch.flush()
+
+
+class OkBatcher:
+
+    """
+    Window batcher shared by all threads: a call waits up to `window_ms` for other calls and they are sent together
+    with batch.executeV2 (at once when `max_calls` are waiting). Used by every ApiOk method when OK_BATCH_WINDOW_MS
+    is set.
+    :param window_ms: how long to wait for more calls before sending a batch
+    :param max_calls: calls per batch.executeV2 request
+    """
+
+    def __init__(self, window_ms: float = OK_BATCH_WINDOW_MS, max_calls: int = OK_BATCH_LIMIT):
+        self.window = window_ms / 1000
+        self.max_calls = max_calls
+
+        self._pending: list[tuple[dict, Future]] = []
+        self._timer = None
+        self._lock = threading.Lock()
+
+        self.calls = 0
+        self.requests = 0
+
+    def post(self, params: dict) -> dict:
+        future = Future()
+        with self._lock:
+            self._pending.append((params, future))
+            self.calls += 1
+            if len(self._pending) >= self.max_calls:
+                batch = self._take()
+            else:
+                batch = None
+                if self._timer is None:
+                    self._timer = threading.Timer(self.window, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+
+        if batch:
+            self._send(batch)
+        return future.result()
+
+    def _take(self) -> list[tuple[dict, Future]]:
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        return batch
+
+    def flush(self):
+        with self._lock:
+            batch = self._take()
+        if batch:
+            self._send(batch)
+
+    def _send(self, batch: list[tuple[dict, Future]]):
+        self.requests += 1
+        try:
+            responses = execute_batch([params for params, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for (_, future), response in zip(batch, responses):
+            future.set_result(response)
+
+    @property
+    def stats(self) -> dict:
+        return {'calls': self.calls, 'requests': self.requests}
+
+
+def uploaded_id(photo: dict) -> int | str:
+
+    """
+    Image of market.add for a photo of Images.upload_image: the general ID if OK assigned one, else the token
+    """
+
+    assigned = str(photo.get('assigned_photo_id') or '')
+    return int(assigned) if assigned.isdigit() else photo.get('photo_id')
+
+
 class ApiOk:
 
     # def __init__(self, token, app_key, secret_key):
@@ -69,6 +435,24 @@ class ApiOk:
 
     class Market:
 
+        def upload_images(self, images: list) -> list | dict:
+
+            """
+            Uploads the image files (Path) of `images` with Images.upload_image and puts their IDs in their place
+            """
+
+            files = [image for image in images if isinstance(image, Path)]
+            if not files:
+                return images
+
+            uploaded = ApiOk.Images().upload_image(files)
+            if isinstance(uploaded, dict):
+                return uploaded
+
+            uploaded = {Path(photo['file']): photo for photo in uploaded}
+            return [uploaded_id(uploaded[image]) if isinstance(image, Path) else image for image in images]
+
+        @ok_method
         def add_catalog(self, group_id: str, name: str):
 
             """
@@ -81,14 +465,13 @@ class ApiOk:
             if not group_id or not name:
                 return {'result': 'Error', 'data': '"group_id" or "name" is empty"'}
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'market.addCatalog',
-                    'gid': group_id,
-                    'name': name,
-                }).json()
+            return (yield {
+                'method': 'market.addCatalog',
+                'gid': group_id,
+                'name': name,
+            })
 
+        @ok_method
         def edit_catalog(self, group_id: str = None, catalog_id: str = None, name: str = None, photo_id: str = None,
                          admin_restricted: bool = True):
 
@@ -107,20 +490,19 @@ class ApiOk:
             if not group_id or not catalog_id:
                 return {'result': 'Error', 'data': '"group_id" or "catalog_id" is empty"'}
 
-            catalog: dict[str, list[dict[str, str]]] = self.get_catalog(group_id, catalog_id)
+            catalog: dict[str, list[dict[str, str]]] = yield from self.get_catalog.generator(self, group_id, catalog_id)
             old_name = catalog['catalogs'][0].get('name')
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'market.editCatalog',
-                    'gid': group_id,
-                    'catalog_id': catalog_id,
-                    'name': name if name else old_name,
-                    'photo_id': photo_id if photo_id else '',
-                    'admin_restricted': admin_restricted,
-                }).json()
+            return (yield {
+                'method': 'market.editCatalog',
+                'gid': group_id,
+                'catalog_id': catalog_id,
+                'name': name if name else old_name,
+                'photo_id': photo_id if photo_id else '',
+                'admin_restricted': admin_restricted,
+            })
 
+        @ok_method
         def delete_catalog(self, group_id: str, catalog_id: str, delete_products: bool = False):
 
             """
@@ -134,15 +516,14 @@ class ApiOk:
             if not group_id or not catalog_id:
                 return {'result': 'Error', 'data': '"group_id" or "name" is empty"'}
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'market.deleteCatalog',
-                    'gid': group_id,
-                    'catalog_id': catalog_id,
-                    'delete_products': delete_products
-                }).json()
+            return (yield {
+                'method': 'market.deleteCatalog',
+                'gid': group_id,
+                'catalog_id': catalog_id,
+                'delete_products': delete_products
+            })
 
+        @ok_method
         def get_catalog(self, group_id: str = None, catalog_ids: list | str = None, fields: str = '*'):
 
             """
@@ -159,15 +540,14 @@ class ApiOk:
             if isinstance(catalog_ids, str):
                 catalog_ids = [catalog_ids]
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'market.getCatalogsByIds',
-                    'gid': group_id,
-                    'catalog_ids': ','.join(catalog_ids),
-                    'fields': fields
-                }).json()
+            return (yield {
+                'method': 'market.getCatalogsByIds',
+                'gid': group_id,
+                'catalog_ids': ','.join(catalog_ids),
+                'fields': fields
+            })
 
+        @ok_method
         def add_product(self, group_id: str = None, type_product: str = 'GROUP_PRODUCT', catalog_ids: list = None,
                         product_title: str = None, product_description: str = None, images: list = None,
                         price: int = None,
@@ -181,7 +561,8 @@ class ApiOk:
             :param catalog_ids: NOT REQUIRED. The IDs of the catalogs for adding the product
             :param product_title: REQUIRED. Product title
             :param product_description: REQUIRED. Product description
-            :param images: NOT REQUIRED. List of id(int) or token(str) images uploaded to the group.
+            :param images: NOT REQUIRED. List of id(int) or token(str) images uploaded to the group, or image files
+                (Path) to upload with Images.upload_image (unchanged files are not uploaded again).
             :param price: REQUIRED. Price of the product
             :param lifetime: REQUIRED. Lifetime of the product in days (default 30 days)
             :param currency: REQUIRED. Currency of the product (default RUB)
@@ -205,22 +586,25 @@ class ApiOk:
             other = {'type': 'product', 'price': price, 'currency': currency, 'lifetime': lifetime}
 
             if images:
+                images = self.upload_images(images)
+                if isinstance(images, dict):
+                    return images
+
                 for image in images:
                     if isinstance(image, int):
                         images_['list'].append({'existing_photo_id': image})
                     else:
                         images_['list'].append({'id': image})
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'market.add',
-                    'gid': group_id,
-                    'type': type_product,
-                    'attachment': json.dumps({"media": [title, description, images_, other]}),
-                    'catalog_ids': ','.join(catalog_ids) if catalog_ids else ""
-                }).json()
+            return (yield {
+                'method': 'market.add',
+                'gid': group_id,
+                'type': type_product,
+                'attachment': json.dumps({"media": [title, description, images_, other]}),
+                'catalog_ids': ','.join(catalog_ids) if catalog_ids else ""
+            })
 
+        @ok_method
         def edit_product(self, product_id: str = None, catalog_ids: list = None, product_title: str = None,
                          product_description: str = None, images: list = None, price: int = None, lifetime: int = None,
                          currency: str = None):
@@ -231,8 +615,8 @@ class ApiOk:
             :param catalog_ids: NOT REQUIRED. The IDs of the catalogs for adding the product
             :param product_title: NOT REQUIRED. Product title. The past value will be accepted if it was
             :param product_description: NOT REQUIRED. Product description. The past value will be accepted if it was
-            :param images: NOT REQUIRED. List of id(int) or token(str) images uploaded to the group. The past value will
-                be accepted if it was
+            :param images: NOT REQUIRED. List of id(int) or token(str) images uploaded to the group, or image files
+                (Path) like in add_product. The past value will be accepted if it was
             :param price: NOT REQUIRED. Price of the product. The past value will be accepted if it was
             :param lifetime: NOT REQUIRED. Lifetime of the product in days (default 30 days). The past value will be
                 accepted if it was
@@ -244,7 +628,7 @@ class ApiOk:
             if not product_id:
                 return {'result': 'Error', 'data': '"product_id" is empty"'}
 
-            data: dict[str, list[dict[str, list]]] = self.get_product(product_id)
+            data: dict[str, list[dict[str, list]]] = yield from self.get_product.generator(self, product_id)
             old_price = data['products'][0]['media'][0].get('product_price_number')
             old_title = data['products'][0]['media'][0].get('product_title')
             old_currency = data['products'][0]['media'][0].get('product_ccy')
@@ -262,6 +646,10 @@ class ApiOk:
                 'lifetime': lifetime if lifetime else old_lifetime}
 
             if images:
+                images = self.upload_images(images)
+                if isinstance(images, dict):
+                    return images
+
                 for image in images:
                     if isinstance(image, int):
                         images_['list'].append({'existing_photo_id': image})
@@ -270,15 +658,14 @@ class ApiOk:
             else:
                 images_['list'] = [{'existing_photo_id': item.split(':')[1], 'group': True} for item in old_photo]
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'market.edit',
-                    'product_id': product_id,
-                    'attachment': json.dumps({"media": [title, description, images_, other]}),
-                    'catalog_ids': ','.join(catalog_ids) if catalog_ids else ""
-                }).json()
+            return (yield {
+                'method': 'market.edit',
+                'product_id': product_id,
+                'attachment': json.dumps({"media": [title, description, images_, other]}),
+                'catalog_ids': ','.join(catalog_ids) if catalog_ids else ""
+            })
 
+        @ok_method
         def get_product(self, product_id: str | list, fields: str = '*'):
 
             """
@@ -294,14 +681,13 @@ class ApiOk:
             if isinstance(product_id, str):
                 product_id = [product_id]
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'market.getByIds',
-                    'product_ids': ','.join(product_id),
-                    'fields': fields
-                }).json()
+            return (yield {
+                'method': 'market.getByIds',
+                'product_ids': ','.join(product_id),
+                'fields': fields
+            })
 
+        @ok_method
         def delete_product(self, product_id: str):
 
             """
@@ -313,13 +699,12 @@ class ApiOk:
             if not product_id:
                 return {'result': 'Error', 'data': '"product_id" is empty"'}
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'market.delete',
-                    'product_id': product_id,
-                }).json()
+            return (yield {
+                'method': 'market.delete',
+                'product_id': product_id,
+            })
 
+        @ok_method
         def pin_product(self, catalog_id: str = None, product_id: str = None, on: bool = True):
 
             """
@@ -335,15 +720,14 @@ class ApiOk:
             elif not catalog_id:
                 return {'result': 'Error', 'data': '"catalog_id" is empty"'}
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'market.pin',
-                    'catalog_id': catalog_id if catalog_id else '',
-                    'product_id': product_id,
-                    'on': on
-                }).json()
+            return (yield {
+                'method': 'market.pin',
+                'catalog_id': catalog_id if catalog_id else '',
+                'product_id': product_id,
+                'on': on
+            })
 
+        @ok_method
         def reorder_product(self, gid: str = None, catalog_id: str = None, product_id: str = None,
                             after_product_id: str = None):
 
@@ -363,16 +747,15 @@ class ApiOk:
             elif not after_product_id:
                 return {'result': 'Error', 'data': '"after_product_id" is empty"'}
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'market.reorder',
-                    'gid': gid,
-                    'catalog_id': catalog_id if catalog_id else '',
-                    'product_id': product_id,
-                    'after_product_id': after_product_id
-                }).json()
+            return (yield {
+                'method': 'market.reorder',
+                'gid': gid,
+                'catalog_id': catalog_id if catalog_id else '',
+                'product_id': product_id,
+                'after_product_id': after_product_id
+            })
 
+        @ok_method
         def reorder_catalog(self, gid: str = None, catalog_id: str = None, after_catalog_id: str = None):
 
             """
@@ -390,15 +773,14 @@ class ApiOk:
             elif not after_catalog_id:
                 return {'result': 'Error', 'data': '"after_catalog_id" is empty"'}
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'market.reorderCatalogs',
-                    'gid': gid,
-                    'catalog_id': catalog_id,
-                    'after_catalog_id': after_catalog_id
-                }).json()
+            return (yield {
+                'method': 'market.reorderCatalogs',
+                'gid': gid,
+                'catalog_id': catalog_id,
+                'after_catalog_id': after_catalog_id
+            })
 
+        @ok_method
         def set_status_product(self, product_id: str = None, product_status: str = 'ACTIVE'):
 
             """
@@ -414,14 +796,13 @@ class ApiOk:
             elif not product_status:
                 return {'result': 'Error', 'data': '"product_status" is empty"'}
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'market.setStatus',
-                    'product_id': product_id,
-                    'product_status': product_status,
-                }).json()
+            return (yield {
+                'method': 'market.setStatus',
+                'product_id': product_id,
+                'product_status': product_status,
+            })
 
+        @ok_method
         def update_product_catalogs(self, gid: str = None, product_id: str = None, catalog_ids: list | str = None):
 
             """
@@ -442,17 +823,16 @@ class ApiOk:
             if isinstance(catalog_ids, str):
                 catalog_ids = [catalog_ids]
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'market.updateCatalogsList',
-                    'gid': gid,
-                    'product_id': product_id,
-                    'catalog_ids': ','.join(catalog_ids),
-                }).json()
+            return (yield {
+                'method': 'market.updateCatalogsList',
+                'gid': gid,
+                'product_id': product_id,
+                'catalog_ids': ','.join(catalog_ids),
+            })
 
     class Group:
 
+        @ok_method
         def get_counters(self, group_id: str = None, counter_types: list | str = None):
 
             """
@@ -474,14 +854,13 @@ class ApiOk:
             if isinstance(counter_types, str):
                 counter_types = [counter_types]
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'group.getCounters',
-                    'group_id': group_id,
-                    'counterTypes': ','.join(counter_types),
-                }).json()
+            return (yield {
+                'method': 'group.getCounters',
+                'group_id': group_id,
+                'counterTypes': ','.join(counter_types),
+            })
 
+        @ok_method
         def get_info(self, group_ids: str | list = None, counter_types: list | str = None):
 
             """
@@ -529,14 +908,13 @@ class ApiOk:
             if isinstance(group_ids, str):
                 group_ids = [group_ids]
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'group.getInfo',
-                    'uids': ','.join(group_ids),
-                    'fields': ','.join(counter_types),
-                }).json()
+            return (yield {
+                'method': 'group.getInfo',
+                'uids': ','.join(group_ids),
+                'fields': ','.join(counter_types),
+            })
 
+        @ok_method
         def get_members(self, group_id: str = None, statuses: list | str = None, count: int = None):
 
             """
@@ -556,15 +934,14 @@ class ApiOk:
             if isinstance(statuses, str):
                 statuses = [statuses]
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'group.getMembers',
-                    'uid': group_id,
-                    'statuses': ','.join(statuses) if statuses else '',
-                    'count': count,
-                }).json()
+            return (yield {
+                'method': 'group.getMembers',
+                'uid': group_id,
+                'statuses': ','.join(statuses) if statuses else '',
+                'count': count,
+            })
 
+        @ok_method
         def get_stat_overview(self, group_id: str = None, fields: list | str = None, period: int = None):
 
             """
@@ -585,15 +962,14 @@ class ApiOk:
             if isinstance(fields, str):
                 fields = [fields]
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'group.getStatOverview',
-                    'gid': group_id,
-                    'fields': ','.join(fields),
-                    'period': period,
-                }).json()
+            return (yield {
+                'method': 'group.getStatOverview',
+                'gid': group_id,
+                'fields': ','.join(fields),
+                'period': period,
+            })
 
+        @ok_method
         def get_stat_people(self, group_id: str = None, fields: list | str = None, demo_type: list | str = None):
 
             """
@@ -621,15 +997,14 @@ class ApiOk:
             if isinstance(demo_type, str) and demo_type:
                 demo_type = [demo_type]
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'group.getStatPeople',
-                    'gid': group_id,
-                    'demo_type': ','.join(demo_type) if demo_type else '',
-                    'fields': ','.join(fields),
-                }).json()
+            return (yield {
+                'method': 'group.getStatPeople',
+                'gid': group_id,
+                'demo_type': ','.join(demo_type) if demo_type else '',
+                'fields': ','.join(fields),
+            })
 
+        @ok_method
         def get_stat_topic(self, topic_id: str = None, fields: list | str = "*"):
 
             """
@@ -648,14 +1023,13 @@ class ApiOk:
             if isinstance(fields, str):
                 fields = [fields]
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'group.getStatTopic',
-                    'topic_id': topic_id,
-                    'fields': ','.join(fields),
-                }).json()
+            return (yield {
+                'method': 'group.getStatTopic',
+                'topic_id': topic_id,
+                'fields': ','.join(fields),
+            })
 
+        @ok_method
         def get_stat_topics(self, group_id: str = None, fields: list | str = "*", count: int = None, start: int = None,
                             end: int = None):
 
@@ -682,17 +1056,16 @@ class ApiOk:
             if isinstance(fields, str):
                 fields = [fields]
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'group.getStatTopics',
-                    'gid': group_id,
-                    'fields': ','.join(fields),
-                    'start_time': start,
-                    'end_time': end,
-                    'count': count
-                }).json()
+            return (yield {
+                'method': 'group.getStatTopics',
+                'gid': group_id,
+                'fields': ','.join(fields),
+                'start_time': start,
+                'end_time': end,
+                'count': count
+            })
 
+        @ok_method
         def get_stat_trends(self, group_id: str = None, fields: list | str = "*", start: int = None, end: int = None):
 
             """
@@ -717,16 +1090,15 @@ class ApiOk:
             if isinstance(fields, str):
                 fields = [fields]
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'group.getStatTrends',
-                    'gid': group_id,
-                    'fields': ','.join(fields),
-                    'start_time': start,
-                    'end_time': end,
-                }).json()
+            return (yield {
+                'method': 'group.getStatTrends',
+                'gid': group_id,
+                'fields': ','.join(fields),
+                'start_time': start,
+                'end_time': end,
+            })
 
+        @ok_method
         def get_user_groups_by_ids(self, group_id: str = None, user_ids: list | str = None):
 
             """
@@ -745,14 +1117,13 @@ class ApiOk:
             if isinstance(user_ids, str):
                 user_ids = [user_ids]
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'group.getUserGroupsByIds',
-                    'group_id': group_id,
-                    'uids': ','.join(user_ids),
-                }).json()
+            return (yield {
+                'method': 'group.getUserGroupsByIds',
+                'group_id': group_id,
+                'uids': ','.join(user_ids),
+            })
 
+        @ok_method
         def is_messages_allowed(self, group_id: str = None):
 
             """
@@ -763,13 +1134,12 @@ class ApiOk:
             if group_id is None:
                 return {'result': 'Error', 'data': '"group_id" is empty"'}
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'group.isMessagesAllowed',
-                    'gid': group_id,
-                }).json()
+            return (yield {
+                'method': 'group.isMessagesAllowed',
+                'gid': group_id,
+            })
 
+        @ok_method
         def pin_group_feed(self, pin_id: str = None):
 
             """
@@ -780,13 +1150,12 @@ class ApiOk:
             if pin_id is None:
                 return {'result': 'Error', 'data': '"pin_id" is empty"'}
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'group.pinGroupFeed',
-                    'pin_id': pin_id,
-                }).json()
+            return (yield {
+                'method': 'group.pinGroupFeed',
+                'pin_id': pin_id,
+            })
 
+        @ok_method
         def set_group_image(self, group_id: str = None, image_id: str = None):
 
             """
@@ -801,14 +1170,13 @@ class ApiOk:
             elif image_id is None:
                 return {'result': 'Error', 'data': '"image_id" is empty"'}
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'group.setMainPhoto',
-                    'group_id': group_id,
-                    'photo_id': image_id,
-                }).json()
+            return (yield {
+                'method': 'group.setMainPhoto',
+                'group_id': group_id,
+                'photo_id': image_id,
+            })
 
+        @ok_method
         def get_members_from_communities(self, group_id: str = None, start_year: int = 2000, end_year: int = None):
 
             """
@@ -824,14 +1192,12 @@ class ApiOk:
             elif end_year is None:
                 return {'result': 'Error', 'data': '"end_year" is empty"'}
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'communities.getMembers',
-                    'group_id': group_id,
-                    'start_year': start_year,
-                    'end_year': end_year,
-                }).json()
+            return (yield {
+                'method': 'communities.getMembers',
+                'group_id': group_id,
+                'start_year': start_year,
+                'end_year': end_year,
+            })
 
     class Images:
 
@@ -839,6 +1205,12 @@ class ApiOk:
 
             """
             The output shows the download success, the technical ID (photo_id) and the general ID (existing_photo_id)
+            of every file, in the order of the files, with its timing: file, size, upload_ms (the request that carried
+            the file) and commit_ms.
+            Files already uploaded (same content hash in upload_cache()) are not sent again and come with
+            cached=True; the others are sent in batches of OK_UPLOAD_BATCH, streamed from disk on the pooled
+            ok_session(); batches run OK_UPLOAD_CONCURRENCY at a time and the photosV2.commit calls of all uploads
+            share the OK_UPLOAD_CONCURRENCY threads of ok_commit_executor().
             :param path_file: REQUIRED. The expected path to the file (Path) or a list of paths [Path, Path]
             :return:
             """
@@ -846,40 +1218,87 @@ class ApiOk:
             if not path_file:
                 return {'result': 'Error', 'data': '"path_file" is empty"'}
 
-            files, result = {}, []
-            if isinstance(path_file, Path):
-                count = 1
-                files[Path(path_file).name] = open(Path(path_file), 'rb')
-            else:
-                count = len(path_file)
-                for file in path_file:
-                    files[Path(file).name] = open(Path(file), 'rb')
+            paths = [Path(path_file)] if isinstance(path_file, (str, Path)) else [Path(file) for file in path_file]
+            digests = [file_hash(path) for path in paths]
+
+            photos = {}
+            for digest in dict.fromkeys(digests):
+                cached = upload_cache().get(digest, ok_upload_scope())
+                if cached:
+                    photos[digest] = {'photo_id': cached['photo_id'], 'assigned_photo_id': cached['existing_photo_id'],
+                                      'cached': True}
+
+            missing = {digest: path for path, digest in zip(paths, digests) if digest not in photos}
+            missing_paths = list(missing.values())
+            batches = [missing_paths[i:i + OK_UPLOAD_BATCH] for i in range(0, len(missing_paths), OK_UPLOAD_BATCH)]
+
+            with ThreadPoolExecutor(max(1, min(len(batches), OK_UPLOAD_CONCURRENCY))) as executor:
+                uploaded = list(executor.map(self.upload_batch, batches))
+
+            for batch in uploaded:
+                if isinstance(batch, dict):
+                    return batch
+
+            for digest, photo in zip(missing, (photo for batch in uploaded for photo in batch)):
+                photos[digest] = photo
+                if photo.get('assigned_photo_id'):
+                    upload_cache().put(digest, photo.get('photo_id'), photo.get('assigned_photo_id'), photo['size'],
+                                       ok_upload_scope())
 
+            return [
+                photos[digest] | {'file': str(path), 'size': photos[digest].get('size') or path.stat().st_size}
+                for path, digest in zip(paths, digests)
+            ]
+
+        def upload_batch(self, paths: list[Path]) -> list[dict] | dict:
             response = ok_session().post(
                 '', params={
                     'method': 'photosV2.getUploadUrl',
-                    'count': str(count)
+                    'count': str(len(paths))
                 }).json()
 
+            if 'photo_ids' not in response:
+                return {'result': 'Error', 'data': response}
+
             photo_ids = response['photo_ids']
             upload_url = response['upload_url']
 
-            response_get_ids = requests.post(upload_url, files=files).json()
-
-            for photo_id in photo_ids:
+            started = time.perf_counter()
+            with ExitStack() as stack:
+                encoder = MultipartEncoder(fields=[
+                    (f'pic{i}', (path.name, stack.enter_context(open(path, 'rb')),
+                                 mimetypes.guess_type(path.name)[0] or 'application/octet-stream'))
+                    for i, path in enumerate(paths, 1)
+                ])
+                response_get_ids = ok_session().post(upload_url, data=encoder, timeout=OK_UPLOAD_TIMEOUT,
+                                                     headers={'Content-Type': encoder.content_type}).json()
+            upload_ms = round((time.perf_counter() - started) * 1000, 1)
+
+            if 'photos' not in response_get_ids:
+                return {'result': 'Error', 'data': response_get_ids}
+
+            def commit(photo_id: str, path: Path) -> dict:
+                started_ = time.perf_counter()
                 token = response_get_ids['photos'][photo_id].get('token')
-                response = ok_session().post(
+                response_ = ok_session().post(
                     '', params={
                         'method': 'photosV2.commit',
                         'photo_id': photo_id,
                         'token': token
                     }).json()
 
-                result.append(response['photos'][0])
-                logger.info(f'Result: {response["photos"][0]}')
+                photo = response_.get('photos', [response_])[0] | {
+                    'file': str(path),
+                    'size': path.stat().st_size,
+                    'upload_ms': upload_ms,
+                    'commit_ms': round((time.perf_counter() - started_) * 1000, 1),
+                }
+                logger.info(f'Result: {photo}')
+                return photo
 
-            return result
+            return list(ok_commit_executor().map(commit, photo_ids, paths))
 
+        @ok_method
         def create_album(self, user_id: str = None, group_id: str = None, title: str = None, description: str = None,
                          type_album: str | list = None):
 
@@ -902,17 +1321,16 @@ class ApiOk:
             if isinstance(type_album, str):
                 type_album = [type_album]
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'photos.createAlbum',
-                    'gid': group_id,
-                    'uid': user_id,
-                    'title': title,
-                    'description': description,
-                    'type': type_album if type_album else '',
-                }).json()
+            return (yield {
+                'method': 'photos.createAlbum',
+                'gid': group_id,
+                'uid': user_id,
+                'title': title,
+                'description': description,
+                'type': type_album if type_album else '',
+            })
 
+        @ok_method
         def delete_album(self, album_id: str = None, group_id: str = None):
 
             """
@@ -925,18 +1343,17 @@ class ApiOk:
             if album_id is None:
                 return {'result': 'Error', 'data': '"album_id" is empty"'}
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'photos.deleteAlbum',
-                    'gid': group_id,
-                    'aid': album_id,
-                }).json()
+            return (yield {
+                'method': 'photos.deleteAlbum',
+                'gid': group_id,
+                'aid': album_id,
+            })
 
+        @ok_method
         def delete_images(self, image_id: str = None, group_id: str = None):
 
             """
-            Deletes a photo
+            Deletes a photo (and forgets it in upload_cache(), so the same file is uploaded again next time)
             :param image_id: REQUIRED. Image ID (str)
             :param group_id: NOT REQUIRED. If image in group. Group ID (str)
             :return:
@@ -945,14 +1362,17 @@ class ApiOk:
             if image_id is None:
                 return {'result': 'Error', 'data': '"image_id" is empty"'}
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'photos.deletePhoto',
-                    'gid': group_id,
-                    'photo_id': image_id,
-                }).json()
+            response = yield {
+                'method': 'photos.deletePhoto',
+                'gid': group_id,
+                'photo_id': image_id,
+            }
+
+            if ok_error_code(response) is None:
+                upload_cache().forget_photo(str(image_id))
+            return response
 
+        @ok_method
         def delete_tags(self, image_id: str = None, tag_ids: str | list = None):
 
             """
@@ -971,14 +1391,13 @@ class ApiOk:
             if isinstance(tag_ids, str):
                 tag_ids = [tag_ids]
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'photos.deleteTags',
-                    'photo_id': image_id,
-                    'tag_ids': ','.join(tag_ids),
-                }).json()
+            return (yield {
+                'method': 'photos.deleteTags',
+                'photo_id': image_id,
+                'tag_ids': ','.join(tag_ids),
+            })
 
+        @ok_method
         def edit_album(self, album_id: str = None, group_id: str = None, title: str = None, description: str = None,
                        type_album: str | list = None):
 
@@ -997,7 +1416,9 @@ class ApiOk:
                 return {'result': 'Error', 'data': '"album_id" is empty"'}
 
             album_type = 'GROUP' if group_id else 'SHARED'
-            info: dict[str, dict] = self.get_album_info(album_id=album_id, group_id=group_id, album_type=album_type)
+            info: dict[str, dict] = yield from self.get_album_info.generator(
+                self, album_id=album_id, group_id=group_id, album_type=album_type
+            )
             old_title = info.get('album').get('title')
             old_description = info.get('album').get('description')
             old_type = info.get('album').get('author_type')
@@ -1005,17 +1426,16 @@ class ApiOk:
             if isinstance(type_album, str):
                 type_album = [type_album]
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'photos.editAlbum',
-                    'gid': group_id,
-                    'aid': album_id,
-                    'title': title if title else old_title,
-                    'description': description if description else old_description,
-                    'type': type_album if type_album or group_id else old_type,
-                }).json()
+            return (yield {
+                'method': 'photos.editAlbum',
+                'gid': group_id,
+                'aid': album_id,
+                'title': title if title else old_title,
+                'description': description if description else old_description,
+                'type': type_album if type_album or group_id else old_type,
+            })
 
+        @ok_method
         def get_album_info(self, album_id: str = None, friend_id: str = None, group_id: str = None,
                            album_type: str | list = None):
 
@@ -1036,16 +1456,15 @@ class ApiOk:
             if isinstance(album_type, str):
                 album_type = [album_type]
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'photos.getAlbumInfo',
-                    'gid': group_id,
-                    'aid': album_id,
-                    'fid': friend_id,
-                    'album_type': album_type
-                }).json()
+            return (yield {
+                'method': 'photos.getAlbumInfo',
+                'gid': group_id,
+                'aid': album_id,
+                'fid': friend_id,
+                'album_type': album_type
+            })
 
+        @ok_method
         def get_photo_info(self, photo_id: str = None, group_id: str = None):
 
             """
@@ -1058,14 +1477,13 @@ class ApiOk:
             if photo_id is None:
                 return {'result': 'Error', 'data': '"photo_id" is empty"'}
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'photos.getPhotoInfo',
-                    'gid': group_id,
-                    'photo_id': photo_id,
-                }).json()
+            return (yield {
+                'method': 'photos.getPhotoInfo',
+                'gid': group_id,
+                'photo_id': photo_id,
+            })
 
+        @ok_method
         def edit_photo(self, photo_id: str = None, group_id: str = None, description: str = None):
 
             """
@@ -1081,15 +1499,14 @@ class ApiOk:
             elif description is None:
                 return {'result': 'Error', 'data': '"description" is empty"'}
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'photos.editPhoto',
-                    'gid': group_id,
-                    'photo_id': photo_id,
-                    'description': description
-                }).json()
+            return (yield {
+                'method': 'photos.editPhoto',
+                'gid': group_id,
+                'photo_id': photo_id,
+                'description': description
+            })
 
+        @ok_method
         def get_album_likes(self, album_id: str = None, group_id: str = None, count: int = 100):
 
             """
@@ -1103,15 +1520,14 @@ class ApiOk:
             if album_id is None:
                 return {'result': 'Error', 'data': '"album_id" is empty"'}
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'photos.getAlbumLikes',
-                    'gid': group_id,
-                    'aid': album_id,
-                    'count': count,
-                }).json()
+            return (yield {
+                'method': 'photos.getAlbumLikes',
+                'gid': group_id,
+                'aid': album_id,
+                'count': count,
+            })
 
+        @ok_method
         def get_albums(self, user_id: str = None, group_id: str = None, count: int = 100,
                        detect_total_count: bool = False, album_type: str | list = "GROUP"):
 
@@ -1135,17 +1551,16 @@ class ApiOk:
             if isinstance(album_type, str):
                 album_type = [album_type]
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'photos.getAlbums',
-                    'gid': group_id,
-                    'fid': user_id,
-                    'detectTotalCount': detect_total_count,
-                    'count': count,
-                    'album_type': album_type
-                }).json()
+            return (yield {
+                'method': 'photos.getAlbums',
+                'gid': group_id,
+                'fid': user_id,
+                'detectTotalCount': detect_total_count,
+                'count': count,
+                'album_type': album_type
+            })
 
+        @ok_method
         def get_info(self, user_id: str = None, group_id: str = None, album_id: str = None, friend_id: str = None,
                      photo_ids: str | list = None):
 
@@ -1168,17 +1583,16 @@ class ApiOk:
             if len(photo_ids) > 100:
                 return {'result': 'Error', 'data': '"photo_ids" is too long (max 100).'}
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'photos.getInfo',
-                    'gid': group_id,
-                    'fid': friend_id,
-                    'aid': album_id,
-                    'uid': user_id,
-                    'photo_ids': ','.join(photo_ids)
-                }).json()
+            return (yield {
+                'method': 'photos.getInfo',
+                'gid': group_id,
+                'fid': friend_id,
+                'aid': album_id,
+                'uid': user_id,
+                'photo_ids': ','.join(photo_ids)
+            })
 
+        @ok_method
         def get_photo_likes(self, photo_id: str = None, group_id: str = None, count: int = 100):
 
             """
@@ -1192,15 +1606,14 @@ class ApiOk:
             if photo_id is None:
                 return {'result': 'Error', 'data': '"photo_id" is empty"'}
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'photos.getPhotoLikes',
-                    'gid': group_id,
-                    'photo_id': photo_id,
-                    'count': count
-                }).json()
+            return (yield {
+                'method': 'photos.getPhotoLikes',
+                'gid': group_id,
+                'photo_id': photo_id,
+                'count': count
+            })
 
+        @ok_method
         def get_photo_marks(self, count: int = 20, detect_total_count: bool = False):
 
             """
@@ -1211,14 +1624,13 @@ class ApiOk:
             :return:
             """
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'photos.getPhotoMarks',
-                    'count': count,
-                    'detectTotalCount': detect_total_count,
-                }).json()
+            return (yield {
+                'method': 'photos.getPhotoMarks',
+                'count': count,
+                'detectTotalCount': detect_total_count,
+            })
 
+        @ok_method
         def get_photos(self, group_id: str = None, friend_id: str = None, album_id: str = None, count: int = 100,
                        detect_total_count: bool = False):
 
@@ -1241,17 +1653,16 @@ class ApiOk:
             if group_id is not None and friend_id is not None:
                 return {'result': 'Error', 'data': '"group_id" and "friend_id" are not empty. Choose one value"'}
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'photos.getPhotos',
-                    'gid': group_id,
-                    'fid': friend_id,
-                    'aid': album_id,
-                    'count': count,
-                    'detectTotalCount': detect_total_count,
-                }).json()
+            return (yield {
+                'method': 'photos.getPhotos',
+                'gid': group_id,
+                'fid': friend_id,
+                'aid': album_id,
+                'count': count,
+                'detectTotalCount': detect_total_count,
+            })
 
+        @ok_method
         def get_tags(self, photo_id: str = None):
 
             """
@@ -1263,13 +1674,12 @@ class ApiOk:
             if photo_id is None:
                 return {'result': 'Error', 'data': '"photo_id" is empty"'}
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'photos.getTags',
-                    'photo_id': photo_id,
-                }).json()
+            return (yield {
+                'method': 'photos.getTags',
+                'photo_id': photo_id,
+            })
 
+        @ok_method
         def get_user_album_photos(self, album_id: str = None, count: int = 100, detect_total_count: bool = False):
 
             """
@@ -1284,15 +1694,14 @@ class ApiOk:
             if album_id is None:
                 return {'result': 'Error', 'data': '"album_id" is empty"'}
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'photos.getUserAlbumPhotos',
-                    'aid': album_id,
-                    'count': count,
-                    'detectTotalCount': detect_total_count,
-                }).json()
+            return (yield {
+                'method': 'photos.getUserAlbumPhotos',
+                'aid': album_id,
+                'count': count,
+                'detectTotalCount': detect_total_count,
+            })
 
+        @ok_method
         def get_user_photos(self, user_id: str = None, count: int = 100, photo_ids: str | list = '',
                             detect_total_count: bool = False):
 
@@ -1312,16 +1721,15 @@ class ApiOk:
             if isinstance(photo_ids, str):
                 photo_ids = [photo_ids]
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'photos.getUserPhotos',
-                    'fid': user_id,
-                    'count': count,
-                    'detectTotalCount': detect_total_count,
-                    'photos': ','.join(photo_ids)
-                }).json()
+            return (yield {
+                'method': 'photos.getUserPhotos',
+                'fid': user_id,
+                'count': count,
+                'detectTotalCount': detect_total_count,
+                'photos': ','.join(photo_ids)
+            })
 
+        @ok_method
         def set_album_main_photo(self, album_id: str = None, photo_id: str = None, group_id: str = None):
 
             """
@@ -1337,14 +1745,12 @@ class ApiOk:
             if photo_id is None:
                 return {'result': 'Error', 'data': '"photo_id" is empty"'}
 
-            return ok_session().post(
-                '',
-                params={
-                    'method': 'photos.setAlbumMainPhoto',
-                    'aid': album_id,
-                    'gid': group_id,
-                    'photo_id': photo_id,
-                }).json()
+            return (yield {
+                'method': 'photos.setAlbumMainPhoto',
+                'aid': album_id,
+                'gid': group_id,
+                'photo_id': photo_id,
+            })
 
 
 ok_sess = ApiOk()
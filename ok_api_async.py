@@ -0,0 +1,197 @@
+
+import asyncio
+import inspect
+import os
+from functools import lru_cache, wraps
+
+import aiohttp
+import dotenv
+from loguru import logger
+
+from main import ApiOk, Credentials, OK_API_URL, ok_limiter, ok_error_code, ok_limit_families, ok_retryable
+
+dotenv.load_dotenv()
+
+OK_POOL_LIMIT = int(os.getenv('OK_POOL_LIMIT', 100))
+OK_POOL_LIMIT_PER_HOST = int(os.getenv('OK_POOL_LIMIT_PER_HOST', 30))
+OK_KEEPALIVE_TIMEOUT = float(os.getenv('OK_KEEPALIVE_TIMEOUT', 30))
+OK_REQUEST_TIMEOUT = float(os.getenv('OK_REQUEST_TIMEOUT', 30))
+
+
+@lru_cache
+def async_ok_session():
+    return AsyncOkSession()
+
+
+def encode_params(params: dict) -> list[tuple[str, str]]:
+
+    """
+    Encodes params the way requests does for OkSession: None values are dropped, lists become repeated keys and
+    everything else is sent as str()
+    """
+
+    encoded = []
+    for key, value in params.items():
+        if value is None:
+            continue
+        for item in value if isinstance(value, (list, tuple)) else [value]:
+            encoded.append((key, str(item)))
+    return encoded
+
+
+async def run_async(generator, session):
+    try:
+        params = next(generator)
+        while True:
+            params = generator.send(await session.post(params))
+    except StopIteration as e:
+        return e.value
+
+
+def async_ok_method(method):
+    generator = method.generator
+
+    @wraps(generator)
+    async def wrapper(self, *args, **kwargs):
+        return await run_async(generator(self, *args, **kwargs), self.session)
+
+    wrapper.generator = generator
+    return wrapper
+
+
+def async_upload_method(method):
+
+    """
+    async_ok_method for methods taking image files (Market.add_product/edit_product): the files are uploaded by the
+    blocking Market.upload_images in a worker thread first, then the method runs with their IDs
+    """
+
+    generator = method.generator
+    signature = inspect.signature(generator)
+
+    @wraps(generator)
+    async def wrapper(self, *args, **kwargs):
+        bound = signature.bind(self, *args, **kwargs)
+        if bound.arguments.get('images'):
+            images = await asyncio.to_thread(self.upload_images, bound.arguments['images'])
+            if isinstance(images, dict):
+                return images
+            bound.arguments['images'] = images
+        return await run_async(generator(*bound.args, **bound.kwargs), self.session)
+
+    wrapper.generator = generator
+    return wrapper
+
+
+class AsyncOkSession:
+
+    """
+    aiohttp counterpart of OkSession: one keep-alive connection pool shared by every call, with the same rate
+    limiting and retries (ok_limiter is shared with the blocking session)
+    :param limit: maximum number of open connections
+    :param limit_per_host: maximum number of open connections to the API host
+    :param keepalive_timeout: seconds an idle connection is kept open
+    :param timeout: total timeout of one request in seconds
+    """
+
+    def __init__(self, limit: int = OK_POOL_LIMIT, limit_per_host: int = OK_POOL_LIMIT_PER_HOST,
+                 keepalive_timeout: float = OK_KEEPALIVE_TIMEOUT, timeout: float = OK_REQUEST_TIMEOUT):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+
+        self._credentials = Credentials()
+        self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.limit,
+                    limit_per_host=self.limit_per_host,
+                    keepalive_timeout=self.keepalive_timeout
+                ),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    async def post(self, params: dict, data: dict = None) -> dict:
+        request_params = encode_params(params | self._credentials.params)
+        api_method = params.get('method', '')
+        attempt = 0
+
+        while True:
+            for family in ok_limit_families(api_method):
+                await ok_limiter.wait_async(self._credentials.application_key, family)
+            async with self.session.post(OK_API_URL, params=request_params, data=data) as response:
+                result = await response.json(content_type=None)
+
+            code = ok_error_code(result)
+            delay = ok_limiter.retry_delay(attempt) if ok_retryable(api_method, code) else None
+            if delay is None:
+                return result
+
+            logger.warning(f'OK error {code} on {api_method}, retry {attempt + 1} in {delay:.2f}s')
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+            logger.info('Async OK session closed')
+
+
+class AsyncApiOk:
+
+    """
+    Async version of ApiOk with the same methods; every call is a coroutine sharing the pool of `session`.
+    Images.upload_image, and the upload of image files passed to Market.add_product/edit_product, run the blocking
+    upload pipeline of ApiOk in a worker thread.
+    :param session: AsyncOkSession to use (the shared async_ok_session() by default)
+    """
+
+    def __init__(self, session: AsyncOkSession = None):
+        self.session = session or async_ok_session()
+
+    def market(self):
+        return AsyncApiOk.Market(self.session)
+
+    def group(self):
+        return AsyncApiOk.Group(self.session)
+
+    def images(self):
+        return AsyncApiOk.Images(self.session)
+
+    class Market(ApiOk.Market):
+
+        def __init__(self, session: AsyncOkSession = None):
+            self.session = session or async_ok_session()
+
+    class Group(ApiOk.Group):
+
+        def __init__(self, session: AsyncOkSession = None):
+            self.session = session or async_ok_session()
+
+    class Images(ApiOk.Images):
+
+        def __init__(self, session: AsyncOkSession = None):
+            self.session = session or async_ok_session()
+
+        async def upload_image(self, path_file):
+            return await asyncio.to_thread(ApiOk.Images().upload_image, path_file)
+
+
+for sync_class, async_class in ((ApiOk.Market, AsyncApiOk.Market), (ApiOk.Group, AsyncApiOk.Group),
+                                (ApiOk.Images, AsyncApiOk.Images)):
+    for name, member in list(vars(sync_class).items()):
+        if hasattr(member, 'generator'):
+            setattr(async_class, name, async_ok_method(member))
+
+for name in ('add_product', 'edit_product'):
+    setattr(AsyncApiOk.Market, name, async_upload_method(getattr(ApiOk.Market, name)))
+
+
+__all__ = ['AsyncApiOk', 'AsyncOkSession', 'async_ok_session', 'encode_params']
@@ -0,0 +1,132 @@
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+
+import dotenv
+
+dotenv.load_dotenv()
+
+OK_UPLOAD_CACHE = os.getenv('OK_UPLOAD_CACHE', 'ok_upload_cache.sqlite3')
+# images remembered, the least recently used are forgotten first; 0 - no cache
+OK_UPLOAD_CACHE_SIZE = int(os.getenv('OK_UPLOAD_CACHE_SIZE', 10000))
+
+UPLOAD_CACHE_SCHEMA = """
+create table if not exists images (
+    hash text primary key,
+    photo_id text,
+    existing_photo_id text,
+    size integer not null,
+    used real not null
+);
+create index if not exists images_used on images (used);
+"""
+
+
+@lru_cache
+def upload_cache():
+    return UploadCache()
+
+
+def file_hash(path: Path, chunk_size: int = 2 ** 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        while chunk := file.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class UploadCache:
+
+    """
+    Content hash -> (photo_id, existing_photo_id) of the images already uploaded to OK, kept in SQLite, so an
+    unchanged image costs a hash instead of an upload. Photo ids only exist for the application and group they were
+    uploaded with, so every call takes a `scope` (e.g. "application_key:group_id") the hash is looked up in.
+    :param path: SQLite file
+    :param max_entries: images remembered, 0 turns the cache off
+    """
+
+    def __init__(self, path: str = OK_UPLOAD_CACHE, max_entries: int = OK_UPLOAD_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self.db = None
+        if max_entries:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.executescript(UPLOAD_CACHE_SCHEMA)
+
+    @staticmethod
+    def key(digest: str, scope: str) -> str:
+        return f'{scope}/{digest}' if scope else digest
+
+    def get(self, digest: str, scope: str = '') -> dict | None:
+        if self.db is None:
+            return None
+
+        key = self.key(digest, scope)
+        with self._lock:
+            row = self.db.execute(
+                'select photo_id, existing_photo_id from images where hash = ?', (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            with self.db:
+                self.db.execute('update images set used = ? where hash = ?', (time.time(), key))
+            self.hits += 1
+            return {'photo_id': row[0], 'existing_photo_id': row[1]}
+
+    def put(self, digest: str, photo_id: str, existing_photo_id: str, size: int, scope: str = ''):
+        if self.db is None:
+            return
+
+        with self._lock, self.db:
+            self.db.execute(
+                'insert or replace into images (hash, photo_id, existing_photo_id, size, used) values (?, ?, ?, ?, ?)',
+                (self.key(digest, scope), photo_id, existing_photo_id, size, time.time())
+            )
+            self.db.execute(
+                'delete from images where hash in (select hash from images order by used desc limit -1 offset ?)',
+                (self.max_entries,)
+            )
+
+    def forget(self, digest: str, scope: str = ''):
+        if self.db is None:
+            return
+        with self._lock, self.db:
+            self.db.execute('delete from images where hash = ?', (self.key(digest, scope),))
+
+    def forget_photo(self, photo_id: str):
+
+        """
+        Forgets the image uploaded as `photo_id` (technical or general id, both unique on OK), e.g. after the photo
+        is deleted
+        """
+
+        if self.db is None:
+            return
+        with self._lock, self.db:
+            self.db.execute('delete from images where photo_id = ? or existing_photo_id = ?', (photo_id, photo_id))
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            size = self.db.execute('select count(*) from images').fetchone()[0] if self.db else 0
+            hits, misses = self.hits, self.misses
+        requests = hits + misses
+        return {
+            'size': size,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / requests, 3) if requests else 0.0,
+        }
+
+
+__all__ = ['UploadCache', 'file_hash', 'upload_cache']
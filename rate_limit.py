@@ -0,0 +1,123 @@
+
+import asyncio
+import random
+import threading
+import time
+
+
+class TokenBucket:
+
+    """
+    Classic token bucket: `rate` tokens per second, up to `capacity` saved for bursts.
+    `reserve` takes a token right away (the balance may go negative) and returns how long the caller has to wait
+    for it, so waiting can be done with time.sleep or asyncio.sleep.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def peek(self) -> float:
+        tokens = min(self.capacity, self.tokens + (time.monotonic() - self.updated) * self.rate)
+        return (1 - tokens) / self.rate if tokens < 1 else 0.0
+
+    def reserve(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class RateLimiter:
+
+    """
+    Token buckets per (key, family), e.g. per API token and method family, for sync and async clients alike,
+    plus jittered exponential backoff for retries.
+    :param rate: requests per second of a family without its own limit
+    :param rates: requests per second by family, e.g. {'wall': 3, 'photos': 1}
+    :param max_retries: how many times a throttled request is retried
+    :param backoff_base: first backoff in seconds, doubled on every retry
+    :param backoff_cap: maximum backoff in seconds
+    """
+
+    def __init__(self, rate: float, rates: dict[str, float] = None, max_retries: int = 3, backoff_base: float = 0.5,
+                 backoff_cap: float = 10):
+        self.rate = rate
+        self.rates = rates or {}
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+        self._buckets: dict[tuple[str, str], TokenBucket] = {}
+        self._lock = threading.Lock()
+
+        self.throttled = 0
+        self.retried = 0
+        self.failed = 0
+
+    def _bucket(self, key: str, family: str) -> TokenBucket:
+        bucket = self._buckets.get((key, family))
+        if bucket is None:
+            bucket = self._buckets[(key, family)] = TokenBucket(self.rates.get(family, self.rate))
+        return bucket
+
+    def peek(self, key: str, family: str) -> float:
+
+        """
+        How long a request would have to wait right now, without taking a token
+        """
+
+        with self._lock:
+            return self._bucket(key, family).peek()
+
+    def reserve(self, key: str, family: str) -> float:
+        with self._lock:
+            delay = self._bucket(key, family).reserve()
+            if delay:
+                self.throttled += 1
+            return delay
+
+    def wait(self, key: str, family: str):
+        delay = self.reserve(key, family)
+        if delay:
+            time.sleep(delay)
+
+    async def wait_async(self, key: str, family: str):
+        delay = self.reserve(key, family)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def retry_delay(self, attempt: int) -> float | None:
+
+        """
+        Seconds to wait before retry number `attempt` (0-based) or None when the retries are used up
+        """
+
+        if attempt >= self.max_retries:
+            self.failed += 1
+            return None
+        self.retried += 1
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    @property
+    def stats(self) -> dict:
+        return {'throttled': self.throttled, 'retried': self.retried, 'failed': self.failed}
+
+
+def parse_rates(value: str) -> dict[str, float]:
+
+    """
+    Parses "wall=3,photos=1.5" into {'wall': 3.0, 'photos': 1.5}
+    """
+
+    rates = {}
+    for item in filter(None, (value or '').split(',')):
+        family, rate = item.split('=')
+        rates[family.strip()] = float(rate)
+    return rates
+
+
+__all__ = ['TokenBucket', 'RateLimiter', 'parse_rates']
@@ -1,5 +1,6 @@
 from general import *
-from db_conn import get_all_db, set_one_column, get_row_in_db
+from db_conn import set_one_column, get_row_in_db
+from catalog import catalog
 from loguru import logger
 from buttons import button_status_list_admin, button_menu_in_truck_card
 from telegram_bot.text import *
@@ -13,7 +14,7 @@ async def admin_set_new_admin(message):
             return False, None, None
 
         db, db_data, db_func_message = await get_state_from_db(message.from_user.id)
-        db.set_state(key='new_admin', func_message_id=db_func_message[0], is_inline_button_enabled=db_func_message[1])
+        await db.set_state(key='new_admin', func_message_id=db_func_message[0], is_inline_button_enabled=db_func_message[1])
         logger.info(f'User ({message.from_user.id}) try to set new admin(s)')
         return True, change_role_f('Админ'), None
 
@@ -28,7 +29,7 @@ async def admin_set_new_manager(message):
             return False, None, None
 
         db, db_data, db_func_message = await get_state_from_db(message.from_user.id)
-        db.set_state(key='new_manager', func_message_id=db_func_message[0], is_inline_button_enabled=db_func_message[1])
+        await db.set_state(key='new_manager', func_message_id=db_func_message[0], is_inline_button_enabled=db_func_message[1])
         logger.info(f'User ({message.from_user.id}) try to set new manager(s)')
         return True, change_role_f('Менеджер'), None
 
@@ -43,7 +44,7 @@ async def admin_set_new_user(message):
         if is_admin:
             return False, None, None
         db, db_data, db_func_message = await get_state_from_db(message.from_user.id)
-        db.set_state(key='new_user', func_message_id=db_func_message[0], is_inline_button_enabled=db_func_message[1])
+        await db.set_state(key='new_user', func_message_id=db_func_message[0], is_inline_button_enabled=db_func_message[1])
         logger.info(f'User ({message.from_user.id}) try to set new user(s)/remove role')
         return True, change_role_f('Пользователь'), None
 
@@ -61,7 +62,7 @@ async def admin_change_sets_truck(callback_query):
         change = callback_query.data.split(' ')[1]
 
         if change == 'price':
-            db.update_state(
+            await db.update_state(
                 key='change_price',
                 func_message_id=db_func_message[0],
                 is_inline_button_enabled=db_func_message[1]
@@ -73,7 +74,7 @@ async def admin_change_sets_truck(callback_query):
         
         elif change == 'status':
             stat_now = tv.get('status')
-            statuses = await get_all_db(table_name='status', telegram_id=callback_query.from_user.id)
+            statuses = list(catalog.snapshot.status_by_id.values())
             stat_word = list(filter(lambda x: x.id == stat_now, statuses))
             add_word = f'Настоящий статус: {html.bold(stat_word[0].name)} ({tv.get('vin')})\n' if stat_word else ''
             logger.info(f'User ({callback_query.from_user.id}) try to set new status')
@@ -91,13 +92,13 @@ async def admin_change_status_truck(callback_query):
         tv = {key: value for key, value in db_data.timing_values}
         truck_id = tv.get('id')
         telegram_id = callback_query.from_user.id
-        truck = await get_row_in_db('trucks', 'id', truck_id, telegram_id)
+        truck = catalog.snapshot.trucks_by_id.get(int(truck_id))
         user = await get_row_in_db('telegram_user_data', 'telegram_id', telegram_id, telegram_id)
         favorite_trucks = user.selected_trucks if isinstance(user.selected_trucks, list) else []
         buttons = await button_menu_in_truck_card(favorite_trucks, truck, user)
 
         change = callback_query.data.split(' ')[1]
-        status = await get_row_in_db('status', 'id', int(change), telegram_id)
+        status = catalog.snapshot.status_by_id.get(int(change))
         res = await set_one_column(
             table='trucks', 
             column='status', 
@@ -1,8 +1,8 @@
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 from aiogram.types import InlineKeyboardButton
-from db_conn import get_user_info, get_all_db
+from db_conn import get_user_info
+from catalog import catalog
 from loguru import logger
-import math
 
 
 def builder_main_menu(role: int = 3):
@@ -62,42 +62,20 @@ async def settings_inline_button(message):
         return None
 
 
-async def trucks_view_buttons(message, from_, to_, vin: str | list):
+async def trucks_view_buttons(message, vin: str | list, after_id: int = None, before_id: int = None):
     try:
-        statuses = await get_all_db(table_name='status', telegram_id=message.from_user.id)
-        trucks = await get_all_db(table_name='trucks', telegram_id=message.from_user.id)
+        snapshot, trucks, pages = catalog.page(vin, after_id=after_id, before_id=before_id)
         builder = InlineKeyboardBuilder()
 
-        if vin and isinstance(vin, str):
-            old_trucks = trucks
-            trucks = list(filter(lambda truck_: vin in truck_.vin, old_trucks))
-
-        if vin and isinstance(vin, list):
-            old_trucks = trucks
-            trucks = list(filter(lambda truck_: truck_.vin in vin, old_trucks))
-
-        if len(trucks) == 0:
+        if not trucks:
             builder.button(text='Поиск по VIN', callback_data="vin_search")
             builder.button(text='Очистить VIN', callback_data="vin_clear")
-            return builder.as_markup(resize_keyboard=True), ['error', 'no_match']
-
-        for i in range(from_, to_):
-
-            if from_ > i or i > len(trucks) - 1:
-                continue
-
-            truck = trucks[i]
-            status = {'name': 'Unknown'}
+            return builder.as_markup(resize_keyboard=True), pages
 
-            for stats in statuses:
-                if stats.id == truck.status:
-                    status = stats
-
-            txt = (f"{truck.name} | "
-                   f"{str('{:,}'.format(truck.price).replace(',', ' '))}р. | "
-                   f"{status.name}")
-
-            builder.row(InlineKeyboardButton(text=txt, callback_data=f"truck_with_id {str(truck.id)}"))
+        for truck in trucks:
+            builder.row(InlineKeyboardButton(
+                text=snapshot.display[truck.id], callback_data=f"truck_with_id {str(truck.id)}"
+            ))
 
         if not isinstance(vin, list):
             builder.row(
@@ -113,7 +91,6 @@ async def trucks_view_buttons(message, from_, to_, vin: str | list):
                 InlineKeyboardButton(text='След.', callback_data="page_truck_list next selected")
             )
 
-        pages = [int(to_ / (to_ - from_)), math.ceil(len(trucks) / (to_ - from_))]
         logger.info(f'Button "Trucks view" create: Success')
         return builder.as_markup(resize_keyboard=True), pages
 
@@ -172,6 +149,12 @@ async def button_menu_in_truck_card(favorite_trucks, truck, user):
         return None
 
 
+def button_load_history(chat_id, last_id):
+    builder = InlineKeyboardBuilder()
+    builder.button(text="Загрузить ещё", callback_data=f"load_history {chat_id} {last_id}")
+    return builder.as_markup()
+
+
 async def button_status_list_admin(statuses):
     try:
         builder = InlineKeyboardBuilder()
@@ -215,6 +198,6 @@ button_global_cancel_q = button_global_cancel_q.as_markup()
 
 
 __all__ = ['builder_main_menu', 'settings_inline_button', 'trucks_view_buttons', 'button_questions_list',
-           'button_open_question_manager', 'button_menu_in_truck_card', 'button_status_list_admin',
+           'button_open_question_manager', 'button_menu_in_truck_card', 'button_status_list_admin', 'button_load_history',
            'button_remove_from_favorite', 'button_add_to_favorite', 'button_get_manager_question', 'button_cancel_q',
            'button_action_with_user', 'button_global_cancel_q']
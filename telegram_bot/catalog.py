@@ -0,0 +1,297 @@
+import asyncio
+import copy
+import json
+import math
+
+import psycopg
+
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from types import MappingProxyType
+from loguru import logger
+from db_conn import connect, pool
+from db_pydantic import Trucks, Status, Images
+from vin_index import VinIndex, normalize_vin, LAST_DIGITS
+
+
+CATALOG_CHANNEL = 'catalog_changed'
+PAGE_SIZE = 7
+FILTER_CACHE_SIZE = 256
+
+CATALOG_TRIGGERS_SQL = f"""
+    create or replace function notify_catalog_changed() returns trigger as $$
+    declare
+        old_row jsonb := to_jsonb(OLD);
+        new_row jsonb := to_jsonb(NEW);
+    begin
+        perform pg_notify('{CATALOG_CHANNEL}', json_build_object(
+            'table', TG_TABLE_NAME,
+            'op', TG_OP,
+            'id', coalesce(new_row -> 'id', old_row -> 'id'),
+            'trucks_ids', json_build_array(old_row -> 'trucks_id', new_row -> 'trucks_id')
+        )::text);
+        return null;
+    end;
+    $$ language plpgsql;
+
+    drop trigger if exists catalog_changed on trucks;
+    create trigger catalog_changed after insert or update or delete on trucks
+        for each row execute function notify_catalog_changed();
+
+    drop trigger if exists catalog_changed on status;
+    create trigger catalog_changed after insert or update or delete on status
+        for each row execute function notify_catalog_changed();
+
+    drop trigger if exists catalog_changed on images;
+    create trigger catalog_changed after insert or update or delete on images
+        for each row execute function notify_catalog_changed();
+"""
+
+
+def truck_display(truck: Trucks, status: Status | None) -> str:
+    return (f"{truck.name} | "
+            f"{str('{:,}'.format(truck.price).replace(',', ' '))}р. | "
+            f"{status.name if status else 'Unknown'}")
+
+
+class CatalogSnapshot:
+
+    """
+    Immutable view of the trucks, status and images tables with precomputed truck list strings.
+    A refresh never changes a snapshot, it makes a new one sharing the unchanged mappings, so handlers can keep using
+    the one they took and a row change costs that row instead of a rebuild.
+    `ids` are the truck ids in ascending order (the paging key), `filtered` memoizes the ids matching a VIN filter for
+    the lifetime of the snapshot.
+    """
+
+    def __init__(self, trucks: dict[int, Trucks], statuses: dict[int, Status], images: dict[int, tuple[Images, ...]]):
+        self.trucks_by_id = MappingProxyType(trucks)
+        self.ids = tuple(sorted(trucks))
+        self.filtered: OrderedDict[str | tuple, tuple[int, ...]] = OrderedDict()
+        self.status_by_id = MappingProxyType(statuses)
+        self.images_by_truck = MappingProxyType(images)
+        self.display = MappingProxyType({
+            truck_id: truck_display(truck, statuses.get(truck.status)) for truck_id, truck in trucks.items()
+        })
+
+    @property
+    def trucks(self) -> tuple[Trucks, ...]:
+        return tuple(self.trucks_by_id[truck_id] for truck_id in self.ids)
+
+    def _replace(self, **fields) -> 'CatalogSnapshot':
+        snapshot = copy.copy(self)
+        snapshot.__dict__.update(fields)
+        return snapshot
+
+    def with_truck(self, truck_id: int, truck: Trucks | None):
+        trucks = dict(self.trucks_by_id)
+        display = dict(self.display)
+        ids = self.ids
+        index = bisect_left(ids, truck_id)
+        known = index < len(ids) and ids[index] == truck_id
+
+        if truck:
+            trucks[truck_id] = truck
+            display[truck_id] = truck_display(truck, self.status_by_id.get(truck.status))
+            if not known:
+                ids = ids[:index] + (truck_id,) + ids[index:]
+        elif known:
+            del trucks[truck_id]
+            del display[truck_id]
+            ids = ids[:index] + ids[index + 1:]
+
+        return self._replace(trucks_by_id=MappingProxyType(trucks), ids=ids, display=MappingProxyType(display),
+                             filtered=OrderedDict())
+
+    def with_status(self, status_id: int, status: Status | None):
+        statuses = dict(self.status_by_id)
+        if status:
+            statuses[status_id] = status
+        else:
+            statuses.pop(status_id, None)
+
+        display = dict(self.display)
+        for truck_id, truck in self.trucks_by_id.items():
+            if truck.status == status_id:
+                display[truck_id] = truck_display(truck, status)
+
+        return self._replace(status_by_id=MappingProxyType(statuses), display=MappingProxyType(display))
+
+    def with_images(self, truck_id: int, images: tuple[Images, ...]):
+        images_by_truck = dict(self.images_by_truck)
+        if images:
+            images_by_truck[truck_id] = images
+        else:
+            images_by_truck.pop(truck_id, None)
+
+        return self._replace(images_by_truck=MappingProxyType(images_by_truck))
+
+
+class Catalog:
+
+    """
+    Process-wide trucks catalog. Loaded once on startup and refreshed row by row from NOTIFY events sent by the
+    triggers on trucks/status/images (CATALOG_TRIGGERS_SQL), so reading the catalog never touches the database.
+    `vin_index` is updated together with the snapshot; it may be newer than a snapshot a handler still holds, so ids
+    it returns are resolved through that snapshot.
+    """
+
+    def __init__(self):
+        self.snapshot = CatalogSnapshot({}, {}, {})
+        self.vin_index = VinIndex()
+        self._task = None
+
+    def filtered_ids(self, snapshot: CatalogSnapshot, vin: str | list) -> tuple[int, ...]:
+        if not vin:
+            return snapshot.ids
+
+        key = normalize_vin(vin) if isinstance(vin, str) else tuple(sorted(vin))
+        if key in snapshot.filtered:
+            snapshot.filtered.move_to_end(key)
+            return snapshot.filtered[key]
+
+        if isinstance(vin, str):
+            found = self.vin_index.by_last_digits(key) if len(key) == LAST_DIGITS and key.isdigit() else []
+            found = found or self.vin_index.search(key)
+        else:
+            found = self.vin_index.ids_for_vins(vin)
+        ids = tuple(id_ for id_ in found if id_ in snapshot.trucks_by_id)
+        snapshot.filtered[key] = ids
+        if len(snapshot.filtered) > FILTER_CACHE_SIZE:
+            snapshot.filtered.popitem(last=False)
+        return ids
+
+    def page(self, vin: str | list = None, after_id: int = None, before_id: int = None, size: int = PAGE_SIZE):
+        """
+        Keyset paging over the trucks matching `vin` (a partial VIN or a list of favorite VINs), ordered by id.
+        A query of 6 digits is looked up as the last digits of the VIN first, then as a part of it.
+        Returns the snapshot used, the page trucks and [page, pages, first_id, last_id] (['error', 'no_match'] if
+        nothing matches). Paging past the last page starts from the first one and vice versa.
+        :param after_id: last id of the current page, returns the next page
+        :param before_id: first id of the current page, returns the previous page
+        """
+
+        snapshot = self.snapshot
+        ids = self.filtered_ids(snapshot, vin)
+        if not ids:
+            return snapshot, [], ['error', 'no_match']
+
+        pages = math.ceil(len(ids) / size)
+        start = 0
+
+        if after_id is not None:
+            start = bisect_right(ids, after_id)
+            if start >= len(ids):
+                start = 0
+
+        elif before_id is not None:
+            end = bisect_left(ids, before_id)
+            start = max(end - size, 0) if end > 0 else (pages - 1) * size
+
+        trucks = [snapshot.trucks_by_id[id_] for id_ in ids[start:start + size]]
+        return snapshot, trucks, [start // size + 1, pages, trucks[0].id, trucks[-1].id]
+
+    async def install_triggers(self):
+        async with connect() as (cursor, conn):
+            await cursor.execute(CATALOG_TRIGGERS_SQL)
+            await conn.commit()
+        logger.info('Catalog triggers installed')
+
+    async def load(self):
+        async with connect() as (cursor, conn):
+            await cursor.execute('select * from trucks;')
+            trucks = {row['id']: Trucks(**row) for row in await cursor.fetchall()}
+
+            await cursor.execute('select * from status;')
+            statuses = {row['id']: Status(**row) for row in await cursor.fetchall()}
+
+            await cursor.execute('select * from images order by id;')
+            images = {}
+            for row in await cursor.fetchall():
+                images.setdefault(row['trucks_id'], []).append(Images(**row))
+
+            await conn.commit()
+
+        self.snapshot = CatalogSnapshot(trucks, statuses, {key: tuple(value) for key, value in images.items()})
+        self.vin_index = VinIndex(self.snapshot.trucks)
+        logger.info(f'Catalog loaded: {len(trucks)} trucks, {len(statuses)} statuses')
+
+    async def _fetch(self, query: str, value):
+        async with connect() as (cursor, conn):
+            await cursor.execute(query, (value,))
+            await conn.commit()
+            return await cursor.fetchall()
+
+    async def apply(self, event: dict):
+        table, row_id = event.get('table'), event.get('id')
+
+        match table:
+            case 'trucks':
+                rows = await self._fetch('select * from trucks where id = %s;', row_id)
+                truck = Trucks(**rows[0]) if rows else None
+                self.snapshot = self.snapshot.with_truck(row_id, truck)
+                if truck:
+                    self.vin_index.add(row_id, truck.vin)
+                else:
+                    self.vin_index.remove(row_id)
+
+            case 'status':
+                rows = await self._fetch('select * from status where id = %s;', row_id)
+                self.snapshot = self.snapshot.with_status(row_id, Status(**rows[0]) if rows else None)
+
+            case 'images':
+                for truck_id in set(event.get('trucks_ids') or []) - {None}:
+                    rows = await self._fetch('select * from images where trucks_id = %s order by id;', truck_id)
+                    self.snapshot = self.snapshot.with_images(truck_id, tuple(Images(**row) for row in rows))
+
+        logger.info(f'Catalog refreshed ({table} {event.get("op")} id {row_id})')
+
+    async def subscribe(self) -> psycopg.AsyncConnection:
+
+        """
+        Opens the LISTEN connection and loads the catalog after it, so no change between the two is missed
+        """
+
+        conn = await psycopg.AsyncConnection.connect(pool().conninfo, autocommit=True)
+        try:
+            await conn.execute(f'listen {CATALOG_CHANNEL};')
+            await self.load()
+        except BaseException:
+            await conn.close()
+            raise
+        return conn
+
+    async def listen(self, conn: psycopg.AsyncConnection = None):
+        while True:
+            try:
+                if conn is None:
+                    conn = await self.subscribe()
+
+                async with conn:
+                    async for notify in conn.notifies():
+                        await self.apply(json.loads(notify.payload))
+
+            except asyncio.CancelledError:
+                raise
+
+            except Exception as e:
+                logger.error(f'Catalog listener error: {e}')
+                await asyncio.sleep(5)
+
+            finally:
+                conn = None
+
+    async def start(self):
+        await self.install_triggers()
+        self._task = asyncio.create_task(self.listen(await self.subscribe()))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+
+catalog = Catalog()
+
+
+__all__ = ['Catalog', 'CatalogSnapshot', 'catalog', 'truck_display', 'CATALOG_TRIGGERS_SQL', 'PAGE_SIZE']
@@ -1,61 +1,265 @@
 import json
+import os
 
-import psycopg2
+import dotenv
 
 from loguru import logger
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from functools import lru_cache
-from psycopg2.extras import RealDictCursor
+from psycopg import AsyncCursor
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
 from uuid import uuid4
 from db_pydantic import *
+from state_cache import StateCache
+from history_writer import HistoryWriter
+
+dotenv.load_dotenv()
+
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', 2))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 10))
+STATE_CACHE_SIZE = int(os.getenv('STATE_CACHE_SIZE', 10000))
+STATE_CACHE_FLUSH_INTERVAL = float(os.getenv('STATE_CACHE_FLUSH_INTERVAL', 1.0))
+STATE_CACHE_WRITE_THROUGH = os.getenv('STATE_CACHE_WRITE_THROUGH', 'False').lower() in ('1', 'true', 'yes')
+HISTORY_FLUSH_INTERVAL_MS = int(os.getenv('HISTORY_FLUSH_INTERVAL_MS', 200))
+HISTORY_FLUSH_ROWS = int(os.getenv('HISTORY_FLUSH_ROWS', 500))
+
+
+class RequestContext:
+
+    """
+    Data of one telegram update: the telegram_user_data row of the sender (user + state) loaded once, the state
+    changes made while handling the update and the number of queries it issued.
+    """
+
+    def __init__(self, telegram_id: int):
+        self.telegram_id = telegram_id
+        self.user = None
+        self.user_loaded = False
+        self.state = None
+        self.state_replaced = False
+        self.state_patch = {}
+        self.queries = 0
+
+
+request_context: ContextVar[RequestContext | None] = ContextVar('request_context', default=None)
+queries_total = 0
+
+
+def current_context(telegram_id: int) -> RequestContext | None:
+    ctx = request_context.get()
+    return ctx if ctx and ctx.telegram_id == telegram_id else None
+
+
+class CountingCursor(AsyncCursor):
+
+    async def execute(self, query, params=None, **kwargs):
+        count_query()
+        return await super().execute(query, params, **kwargs)
+
+    async def executemany(self, query, params_seq, **kwargs):
+        count_query()
+        return await super().executemany(query, params_seq, **kwargs)
+
+
+def count_query():
+    global queries_total
+    queries_total += 1
+
+    ctx = request_context.get()
+    if ctx:
+        ctx.queries += 1
 
 
 @lru_cache()
-def connect():
-    conn = psycopg2.connect(dbname='postgres', user='postgres', password='1337', host='localhost')
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    return cursor, conn
+def pool():
+    return AsyncConnectionPool(
+        conninfo=(f"dbname={os.getenv('DB_NAME', 'postgres')} user={os.getenv('DB_USER', 'postgres')} "
+                  f"password={os.getenv('DB_PASSWORD', '1337')} host={os.getenv('DB_HOST', 'localhost')}"),
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        kwargs={'row_factory': dict_row, 'cursor_factory': CountingCursor},
+        open=False
+    )
+
+
+async def open_pool():
+    await pool().open(wait=True)
+    logger.info(f'DB pool opened (min: {DB_POOL_MIN_SIZE}, max: {DB_POOL_MAX_SIZE})')
+
+
+async def close_pool():
+    await pool().close()
+    logger.info('DB pool closed')
+
+
+@asynccontextmanager
+async def connect():
+    async with pool().connection() as conn:
+        async with conn.cursor() as cursor:
+            yield cursor, conn
+
+
+async def write_states(states: dict[int, dict]):
+    logger.info(f'Write {len(states)} state(s) (telegram_user_data)')
+
+    async with connect() as (cursor, conn):
+        await cursor.execute("""
+                            update telegram_user_data as t
+                            set state = v.state
+                            from unnest(%s::bigint[], %s::jsonb[]) as v(telegram_id, state)
+                            where t.telegram_id = v.telegram_id;
+                            """, (list(states), [json.dumps(state) for state in states.values()]))
+
+        await conn.commit()
+
+
+async def merge_states(patches: dict[int, dict]):
+    logger.info(f'Merge {len(patches)} state patch(es) (telegram_user_data)')
+
+    async with connect() as (cursor, conn):
+        await cursor.execute("""
+                            update telegram_user_data as t
+                            set state = coalesce(t.state, '{}'::jsonb) || v.patch
+                            from unnest(%s::bigint[], %s::jsonb[]) as v(telegram_id, patch)
+                            where t.telegram_id = v.telegram_id;
+                            """, (list(patches), [json.dumps(patch) for patch in patches.values()]))
+
+        await conn.commit()
+
+
+# write-back needs this bot to be the only writer of telegram_user_data.state (STATE_CACHE_WRITE_THROUGH otherwise)
+state_cache = StateCache(
+    writer=write_states,
+    merger=merge_states,
+    max_size=STATE_CACHE_SIZE,
+    flush_interval=STATE_CACHE_FLUSH_INTERVAL,
+    write_through=STATE_CACHE_WRITE_THROUGH
+)
+
+
+async def copy_history(rows: list[tuple]):
+    logger.info(f'Write {len(rows)} history row(s) (chats_with_managers_history)')
+
+    async with connect() as (cursor, conn):
+        count_query()
+        async with cursor.copy("""
+                            copy chats_with_managers_history (user_message, manager_message, chat_id) from stdin
+                            """) as copy:
+            for row in rows:
+                await copy.write_row(row)
+
+        await conn.commit()
+
+
+history_writer = HistoryWriter(
+    writer=copy_history,
+    flush_interval=HISTORY_FLUSH_INTERVAL_MS / 1000,
+    max_rows=HISTORY_FLUSH_ROWS
+)
 
 
 class DataBaseState:
 
     def __init__(self, tg_id):
         self.validate_id = DataBaseStateModelTgId(tg_id=tg_id)
-        self.cursor, self.conn = connect()
 
-    def get_state(self):
+    def _context(self):
+        ctx = current_context(self.validate_id.tg_id)
+        return ctx if ctx and ctx.state is not None else None
+
+    async def get_state(self):
+        if ctx := self._context():
+            return get_pydantic_table_class(ctx.state, 'state')
+
+        result = state_cache.get(self.validate_id.tg_id)
+        if result is not None:
+            return get_pydantic_table_class(result, 'state')
+
         logger.info(f'User {str(self.validate_id.tg_id)} get state (telegram_user_data)')
 
-        self.cursor.execute(f"""
-                            select state
-                            from telegram_user_data
-                            where telegram_id = %s;
-                            """, (self.validate_id.tg_id,))
+        async with connect() as (cursor, conn):
+            await cursor.execute(f"""
+                                select state
+                                from telegram_user_data
+                                where telegram_id = %s;
+                                """, (self.validate_id.tg_id,))
+
+            await conn.commit()
+            result = (await cursor.fetchone()).get('state') or {}
 
-        self.conn.commit()
-        result = self.cursor.fetchone().get('state') or {}
-        # print(result)
-        # print(get_pydantic_table_class(result, 'state'))
+        state_cache.load(self.validate_id.tg_id, result)
         return get_pydantic_table_class(result, 'state')
 
-    def set_state(self, **args):
+    async def set_state(self, **args):
         data = DataBaseStateModel(**args).model_dump()
         logger.info(f'User {str(self.validate_id.tg_id)} set state (telegram_user_data)')
-        self.cursor.execute(f"""
-                            update telegram_user_data
-                            set state = %s
-                            where telegram_id = %s;
-                            """, (json.dumps(data), self.validate_id.tg_id,))
 
-        self.conn.commit()
+        if ctx := self._context():
+            ctx.state, ctx.state_replaced, ctx.state_patch = data, True, {}
+            return True
+
+        await state_cache.put(self.validate_id.tg_id, data)
         return True
 
-    def update_state(self, **args):
-        data = DataBaseStateModel(**args).model_dump()
-        state = self.get_state().model_dump()
-        for k, v in data.items():
-            if k in args:
-                state[k] = v
-        return self.set_state(**state)
+    async def update_state(self, **args):
+        data = DataBaseStateModel(**args).model_dump(include=set(args))
+        logger.info(f'User {str(self.validate_id.tg_id)} update state (telegram_user_data)')
+
+        if ctx := self._context():
+            ctx.state = ctx.state | data
+            ctx.state_patch |= data
+            return True
+
+        await state_cache.update(self.validate_id.tg_id, data)
+        return True
+
+    @staticmethod
+    async def update_states(states: dict[int, dict]):
+        patches = {
+            DataBaseStateModelTgId(tg_id=tg_id).tg_id: DataBaseStateModel(**args).model_dump(include=set(args))
+            for tg_id, args in states.items()
+        }
+        logger.info(f'Update state of {len(patches)} user(s) (telegram_user_data)')
+        await state_cache.update_many(patches)
+        return True
+
+
+async def load_request_context(ctx: RequestContext):
+    logger.info(f'User {str(ctx.telegram_id)} load request context (telegram_user_data)')
+
+    async with connect() as (cursor, conn):
+        await cursor.execute("""
+            select *
+            from telegram_user_data
+            where telegram_id=%s;
+            """, (ctx.telegram_id,))
+
+        await conn.commit()
+        result = (await cursor.fetchone()) or None
+
+    ctx.user = User(**result) if result else None
+    ctx.user_loaded = True
+
+    if result:
+        state = state_cache.get(ctx.telegram_id)
+        ctx.state = state_cache.load(ctx.telegram_id, result.get('state') or {}) if state is None else state
+
+    return ctx
+
+
+async def commit_request_context(ctx: RequestContext):
+    if ctx.state_replaced:
+        await state_cache.put(ctx.telegram_id, ctx.state)
+    elif ctx.state_patch:
+        await state_cache.update(ctx.telegram_id, ctx.state_patch)
+
+
+def invalidate_user(telegram_id: int = None):
+    ctx = request_context.get()
+    if ctx and (telegram_id is None or ctx.telegram_id == telegram_id):
+        ctx.user_loaded = False
 
 
 async def check_correct_telegram_id(telegram_id):
@@ -75,18 +279,25 @@ async def get_user_info(telegram_id: int):
     if res:
         return ans
 
-    cursor, conn = connect()
+    ctx = current_context(telegram_id)
+    if ctx and ctx.user_loaded:
+        return ctx.user
 
-    cursor.execute("""
-        select *
-        from telegram_user_data
-        where telegram_id=%s;
-        """, (telegram_id,))
+    async with connect() as (cursor, conn):
+        await cursor.execute("""
+            select *
+            from telegram_user_data
+            where telegram_id=%s;
+            """, (telegram_id,))
 
-    conn.commit()
-    result = cursor.fetchone() or None
+        await conn.commit()
+        result = (await cursor.fetchone()) or None
 
-    return User(**result) if result else None
+    user = User(**result) if result else None
+    if ctx:
+        ctx.user, ctx.user_loaded = user, True
+
+    return user
 
 
 async def register_new_user(telegram_id: int, name: str | None):
@@ -94,46 +305,46 @@ async def register_new_user(telegram_id: int, name: str | None):
     if res:
         return ans
 
-    cursor, conn = connect()
-
     user = await get_user_info(telegram_id)
 
     if not user:
-        cursor.execute("""
-            insert into telegram_user_data(telegram_id, name)
-            values (%s, %s);
-            """, (telegram_id, name))
-
-        conn.commit()
+        async with connect() as (cursor, conn):
+            await cursor.execute("""
+                insert into telegram_user_data(telegram_id, name)
+                values (%s, %s);
+                """, (telegram_id, name))
+
+            await conn.commit()
+        invalidate_user(telegram_id)
         logger.info(f'Register new user with id {str(telegram_id)}')
 
     return await get_user_info(telegram_id)
 
 
 async def delete_all_selected_trucks(telegram_id: int):
-    cursor, conn = connect()
-
-    logger.info(f'Remove all selected trucks from TG ID: {str(telegram_id)}')
-    cursor.execute("""
-            update telegram_user_data
-            set selected_trucks = null
-            where telegram_id = %s;
-            """, (telegram_id,))
+    async with connect() as (cursor, conn):
+        logger.info(f'Remove all selected trucks from TG ID: {str(telegram_id)}')
+        await cursor.execute("""
+                update telegram_user_data
+                set selected_trucks = null
+                where telegram_id = %s;
+                """, (telegram_id,))
 
-    conn.commit()
+        await conn.commit()
+    invalidate_user(telegram_id)
 
 
 async def change_settings_in_db(telegram_id: int, column_name: str, value: bool | int):
-    cursor, conn = connect()
+    async with connect() as (cursor, conn):
+        logger.info(f'Change user settings. TG ID: {str(telegram_id)}')
+        await cursor.execute(f"""
+                    update telegram_user_data
+                    set {column_name} = %s
+                    where telegram_id = %s;
+                    """, (value, telegram_id))
 
-    logger.info(f'Change user settings. TG ID: {str(telegram_id)}')
-    cursor.execute(f"""
-                update telegram_user_data
-                set {column_name} = %s
-                where telegram_id = %s;
-                """, (value, telegram_id))
-
-    conn.commit()
+        await conn.commit()
+    invalidate_user(telegram_id)
 
 
 async def get_row_in_db(table_name: str, column_name: str, value: any, telegram_id: int):
@@ -142,17 +353,20 @@ async def get_row_in_db(table_name: str, column_name: str, value: any, telegram_
 
 
 async def get_rows_in_db(table_name: str, column_name: str, value: any, telegram_id: int):
-    cursor, conn = connect()
+    if table_name == 'telegram_user_data' and column_name == 'telegram_id' and current_context(value):
+        user = await get_user_info(value)
+        return [user] if user else None
 
-    logger.info(f'User {str(telegram_id)} get all rows in DB ({table_name})')
-    cursor.execute(f"""
-                    select *
-                    from {table_name}
-                    where {column_name} = %s;
-                    """, (value,))
+    async with connect() as (cursor, conn):
+        logger.info(f'User {str(telegram_id)} get all rows in DB ({table_name})')
+        await cursor.execute(f"""
+                        select *
+                        from {table_name}
+                        where {column_name} = %s;
+                        """, (value,))
 
-    conn.commit()
-    result = cursor.fetchall() or []
+        await conn.commit()
+        result = (await cursor.fetchall()) or []
 
     return get_pydantic_table_class(result, table_name) if result else None
 
@@ -160,49 +374,63 @@ async def get_rows_in_db(table_name: str, column_name: str, value: any, telegram
 async def update_history_chat_with_manager(chat_id: str, telegram_id: int, user_message: str = None,
                                            manager_message: str = None):
     try:
-        cursor, conn = connect()
-
         logger.info(f'Update history chat with manager. TG ID: {str(telegram_id)}')
-        cursor.execute("""
-                            insert into chats_with_managers_history (user_message, manager_message, chat_id)
-                            values (%s, %s, %s)
-                            """, (user_message, manager_message, chat_id))
-
-        conn.commit()
-
+        await history_writer.add(chat_id, user_message, manager_message)
         return {'ans': True}
     except Exception as e:
         logger.error(e)
         return {'ans': False, 'data': e}
 
 
-async def get_all_db(table_name: str, telegram_id: int):
-    cursor, conn = connect()
+async def iter_chat_history(chat_id: str, after_id: int = 0, batch_size: int = 100):
+    """
+    Streams the history of a chat (ordered by id, starting after `after_id`) through a server-side cursor, so only
+    `batch_size` rows are in memory at a time. The pool connection is held until the generator is closed.
+    """
+
+    async with pool().connection() as conn:
+        async with conn.cursor(name=f'chat_history_{uuid4().hex}') as cursor:
+            cursor.itersize = batch_size
+            count_query()
+            await cursor.execute("""
+                            select *
+                            from chats_with_managers_history
+                            where chat_id = %s and id > %s
+                            order by id;
+                            """, (chat_id, after_id))
+
+            async for row in cursor:
+                yield ChatWithManagerHistory(**row)
+
+        await conn.commit()
+
 
-    logger.info(f'User {str(telegram_id)} get all information DB ({table_name})')
-    cursor.execute(f"""
-                    select *
-                    from {table_name}
-                    """)
+async def get_all_db(table_name: str, telegram_id: int):
+    async with connect() as (cursor, conn):
+        logger.info(f'User {str(telegram_id)} get all information DB ({table_name})')
+        await cursor.execute(f"""
+                        select *
+                        from {table_name}
+                        """)
 
-    conn.commit()
-    result = cursor.fetchall() or []
+        await conn.commit()
+        result = (await cursor.fetchall()) or []
 
     return get_pydantic_table_class(result, table_name) if result else None
 
 
 async def add_to_favorite(vin: str, telegram_id: int):
     try:
-        cursor, conn = connect()
-
-        logger.info(f'Add favorite truck into DB. TG ID: {str(telegram_id)}')
-        cursor.execute("""
-                        UPDATE telegram_user_data
-                        SET selected_trucks = array_append(selected_trucks, %s)
-                        WHERE telegram_id = %s;
-                        """, (vin, telegram_id))
+        async with connect() as (cursor, conn):
+            logger.info(f'Add favorite truck into DB. TG ID: {str(telegram_id)}')
+            await cursor.execute("""
+                            UPDATE telegram_user_data
+                            SET selected_trucks = array_append(selected_trucks, %s)
+                            WHERE telegram_id = %s;
+                            """, (vin, telegram_id))
 
-        conn.commit()
+            await conn.commit()
+        invalidate_user(telegram_id)
 
         return {'ans': 'success', 'data': 'success'}
 
@@ -212,16 +440,16 @@ async def add_to_favorite(vin: str, telegram_id: int):
 
 async def remove_from_favorite(vin: str, telegram_id: int):
     try:
-        cursor, conn = connect()
-
-        logger.info(f'Remove favorite truck from DB. TG ID: {str(telegram_id)}')
-        cursor.execute("""
-                        UPDATE telegram_user_data
-                        SET selected_trucks = array_remove(selected_trucks, %s)
-                        WHERE telegram_id = %s;
-                        """, (vin, telegram_id))
+        async with connect() as (cursor, conn):
+            logger.info(f'Remove favorite truck from DB. TG ID: {str(telegram_id)}')
+            await cursor.execute("""
+                            UPDATE telegram_user_data
+                            SET selected_trucks = array_remove(selected_trucks, %s)
+                            WHERE telegram_id = %s;
+                            """, (vin, telegram_id))
 
-        conn.commit()
+            await conn.commit()
+        invalidate_user(telegram_id)
 
         return {'ans': 'success', 'data': 'success'}
 
@@ -231,16 +459,18 @@ async def remove_from_favorite(vin: str, telegram_id: int):
 
 async def set_one_column(table: str, column: str, value: any, where_column: str, where_value: any, telegram_id: int):
     try:
-        cursor, conn = connect()
+        async with connect() as (cursor, conn):
+            logger.info(f'User {str(telegram_id)} update column ({column}) with value: {value} in table ({table})')
+            await cursor.execute(f"""
+                            UPDATE {table}
+                            SET {column} = %s
+                            WHERE {where_column} = %s;
+                            """, (value, where_value))
 
-        logger.info(f'User {str(telegram_id)} update column ({column}) with value: {value} in table ({table})')
-        cursor.execute(f"""
-                        UPDATE {table}
-                        SET {column} = %s
-                        WHERE {where_column} = %s;
-                        """, (value, where_value))
+            await conn.commit()
 
-        conn.commit()
+        if table == 'telegram_user_data' and column in User.model_fields:
+            invalidate_user(where_value if where_column == 'telegram_id' else None)
 
         return {'ans': 'success', 'data': 'success'}
 
@@ -250,17 +480,17 @@ async def set_one_column(table: str, column: str, value: any, where_column: str,
 
 async def open_connect_with_manager(data: dict, telegram_id: int):
     try:
-        cursor, conn = connect()
-        chat_id = str(uuid4().hex)
+        async with connect() as (cursor, conn):
+            chat_id = str(uuid4().hex)
 
-        logger.info(f'User {str(telegram_id)} open connect with manager')
-        cursor.execute(f"""
-                        insert into chats_with_managers(user_tg_id, user_name, question, unique_chat_id)
-                        values (%s, %s, %s, %s)
-                        """, (int(telegram_id), data.get('name'), data.get('question'), chat_id)
-                       )
+            logger.info(f'User {str(telegram_id)} open connect with manager')
+            await cursor.execute(f"""
+                            insert into chats_with_managers(user_tg_id, user_name, question, unique_chat_id)
+                            values (%s, %s, %s, %s)
+                            """, (int(telegram_id), data.get('name'), data.get('question'), chat_id)
+                           )
 
-        conn.commit()
+            await conn.commit()
 
         return {'ans': 'success', 'data': chat_id}
 
@@ -270,17 +500,16 @@ async def open_connect_with_manager(data: dict, telegram_id: int):
 
 async def close_connect_with_manager(chat_id: str, telegram_id: int):
     try:
-        cursor, conn = connect()
+        async with connect() as (cursor, conn):
+            logger.info(f'User {str(telegram_id)} close connect with manager')
+            await cursor.execute("""
+                            update chats_with_managers
+                            set status = 3
+                            where unique_chat_id = %s;
+                            """, (chat_id,)
+                           )
 
-        logger.info(f'User {str(telegram_id)} close connect with manager')
-        cursor.execute("""
-                        update chats_with_managers
-                        set status = 3
-                        where unique_chat_id = %s;
-                        """, (chat_id,)
-                       )
-
-        conn.commit()
+            await conn.commit()
 
         return {'ans': 'success', 'data': 'success'}
 
@@ -290,12 +519,11 @@ async def close_connect_with_manager(chat_id: str, telegram_id: int):
 
 async def get_online_managers(telegram_id: int):
     try:
-        cursor, conn = connect()
-
-        logger.info(f'User {str(telegram_id)} get all online managers')
-        cursor.execute(f"""select * from telegram_user_data where role_id = 2 and on_line=True;""")
-        conn.commit()
-        result = cursor.fetchall() or []
+        async with connect() as (cursor, conn):
+            logger.info(f'User {str(telegram_id)} get all online managers')
+            await cursor.execute(f"""select * from telegram_user_data where role_id = 2 and on_line=True;""")
+            await conn.commit()
+            result = (await cursor.fetchall()) or []
 
         return get_pydantic_table_class(result, 'telegram_user_data') if result else None
 
@@ -368,5 +596,7 @@ __all__ = [
     'check_correct_telegram_id', 'get_user_info', 'register_new_user', 'delete_all_selected_trucks',
     'change_settings_in_db', 'get_row_in_db', 'get_rows_in_db', 'get_all_db', 'add_to_favorite', 'remove_from_favorite',
     'set_one_column', 'open_connect_with_manager', 'close_connect_with_manager', 'update_history_chat_with_manager',
-    'get_online_managers', 'DataBaseState'
+    'iter_chat_history', 'history_writer',
+    'get_online_managers', 'DataBaseState', 'open_pool', 'close_pool', 'state_cache', 'RequestContext',
+    'request_context', 'load_request_context', 'commit_request_context'
 ]
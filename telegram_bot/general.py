@@ -5,7 +5,7 @@ from loguru import logger
 
 async def get_state_from_db(tg_id):
     db = DataBaseState(tg_id=tg_id)
-    db_data = db.get_state()
+    db_data = await db.get_state()
     db_func_message = db_data.func_message_id if db_data.func_message_id else None
     db_is_inline_button = db_data.is_inline_button_enabled if db_data.is_inline_button_enabled else None
     return db, db_data, [db_func_message, db_is_inline_button]
@@ -63,7 +63,7 @@ async def profile_create(message) -> str:
 async def update_state(message, new_message, bot):
     try:
         db, db_data, db_func_message = await get_state_from_db(message.from_user.id)
-        db.update_state(
+        await db.update_state(
             func_message_id=new_message.message_id,
             is_inline_button_enabled=True if new_message.reply_markup else False
         )
@@ -0,0 +1,147 @@
+import asyncio
+import time
+
+import psycopg
+
+from loguru import logger
+
+
+# errors of the rows themselves: retrying cannot help, so these rows are dropped (and logged)
+DATA_ERRORS = (psycopg.DataError, psycopg.IntegrityError)
+
+
+class HistoryWriter:
+
+    """
+    Write-behind buffer for chats_with_managers_history rows.
+    `add` only appends the row; `writer` stores the buffered rows in one batch every `flush_interval` seconds or as
+    soon as `max_rows` rows are waiting, and on stop(). Rows are written in the order they were added, so ids keep
+    the message order. A failed batch is put back in front of the buffer and retried with backoff of up to
+    `max_backoff` seconds (add() does not flush meanwhile) for as long as the database is unavailable. After a data
+    error, or `max_retries` failures, the batch is written row by row: rows rejected for their data (DATA_ERRORS) are
+    logged and dropped, any other error keeps the rest for the next flush. Past `max_buffer` waiting rows add() waits
+    for a flush. stop() raises if rows are left unwritten.
+    :param writer: coroutine function taking a list of (user_message, manager_message, chat_id) rows
+    :param flush_interval: seconds between background flushes
+    :param max_rows: buffered rows that trigger an immediate flush
+    :param max_retries: failed flushes of a batch before it is written row by row
+    :param max_backoff: maximum seconds between retries of a failed batch
+    :param max_buffer: buffered rows past which add() waits, max_rows * 20 by default
+    """
+
+    def __init__(self, writer, flush_interval: float = 0.2, max_rows: int = 500, max_retries: int = 3,
+                 max_backoff: float = 30, max_buffer: int = None):
+        self.writer = writer
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self.max_buffer = max_buffer or max_rows * 20
+
+        self._rows: list[tuple] = []
+        self._lock = asyncio.Lock()
+        self._task = None
+        self._failures = 0
+        self._retry_at = 0.0
+
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.failed_flushes = 0
+        self.dead_lettered = 0
+
+    def _flush_due(self) -> bool:
+        return not self._lock.locked() and time.monotonic() >= self._retry_at
+
+    async def add(self, chat_id: str, user_message: str = None, manager_message: str = None):
+        while len(self._rows) >= self.max_buffer:
+            if self._flush_due():
+                await self.flush()
+            else:
+                await asyncio.sleep(self.flush_interval)
+
+        self._rows.append((user_message, manager_message, chat_id))
+        if len(self._rows) >= self.max_rows and self._flush_due():
+            await self.flush()
+
+    async def _write_one_by_one(self, rows: list[tuple]):
+
+        """
+        Writes and removes the rows from the front of `rows`; an error other than DATA_ERRORS is raised with the
+        unwritten rows left in `rows`
+        """
+
+        while rows:
+            try:
+                await self.writer(rows[:1])
+                self.flushed_rows += 1
+            except DATA_ERRORS as e:
+                self.dead_lettered += 1
+                logger.error(f'History row dropped, rejected by the database: {rows[0]}: {e}')
+            del rows[0]
+
+    async def flush(self):
+        async with self._lock:
+            if not self._rows:
+                return
+
+            rows, self._rows = self._rows, []
+            started = time.perf_counter()
+
+            try:
+                if self._failures >= self.max_retries:
+                    await self._write_one_by_one(rows)
+                else:
+                    await self.writer(rows)
+                    self.flushed_rows += len(rows)
+                self.flushes += 1
+                self._failures = 0
+                self._retry_at = 0.0
+
+            except Exception as e:
+                self._failures = self.max_retries if isinstance(e, DATA_ERRORS) else self._failures + 1
+                self.failed_flushes += 1
+                self._retry_at = time.monotonic() + min(self.max_backoff, self.flush_interval * 2 ** self._failures)
+                logger.error(f'History flush failed ({len(rows)} rows, failure {self._failures}): {e}')
+                self._rows = rows + self._rows
+
+            finally:
+                self.last_flush_ms = (time.perf_counter() - started) * 1000
+                self.max_flush_ms = max(self.max_flush_ms, self.last_flush_ms)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self._flush_due():
+                await asyncio.shield(self.flush())
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        logger.info(f'History writer started (interval: {self.flush_interval}s, rows: {self.max_rows})')
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        logger.info(f'History writer stopped. Stats: {self.stats}')
+
+        if self._rows:
+            raise RuntimeError(f'History writer stopped with {len(self._rows)} unwritten row(s)')
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'queue_depth': len(self._rows),
+            'flushes': self.flushes,
+            'flushed_rows': self.flushed_rows,
+            'failed_flushes': self.failed_flushes,
+            'dead_lettered': self.dead_lettered,
+            'last_flush_ms': round(self.last_flush_ms, 1),
+            'max_flush_ms': round(self.max_flush_ms, 1),
+        }
+
+
+__all__ = ['HistoryWriter']
@@ -11,16 +11,23 @@ from manager import *
 from admin import *
 from state_message import *
 from general import update_state, get_state_from_db
+from db_conn import open_pool, close_pool, state_cache, history_writer
+from middleware import request_context_middleware
+from catalog import catalog
+from notifier import notifier
 
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.enums import ParseMode
 from aiogram.filters import CommandStart
 from aiogram.types import Message
+from loguru import logger
 
 dotenv.load_dotenv()
 TOKEN = os.getenv('token_tg')
 CHANNEL = os.getenv('channel_id')
 dp = Dispatcher()
+dp.message.middleware(request_context_middleware)
+dp.callback_query.middleware(request_context_middleware)
 bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 
 
@@ -200,7 +207,7 @@ async def other_message(message: types.Message):
                         await message.answer(text=text, reply_markup=buttons)
 
         case 'chat_with_manager':
-            db.set_state(
+            await db.set_state(
                 key='chat_with_manager',
                 chat_id=db_data.chat_id,
                 func_message_id=db_func_message[0],
@@ -209,7 +216,7 @@ async def other_message(message: types.Message):
             await send_message_to_manager(message, bot)
 
         case 'chat_with_user':
-            db.set_state(
+            await db.set_state(
                 key='chat_with_user',
                 chat_id=db_data.chat_id,
                 func_message_id=db_func_message[0],
@@ -344,7 +351,35 @@ async def start_discussion(callback_query: types.callback_query):
         await callback_query.message.answer(text=text, reply_markup=buttons)
 
 
+@dp.callback_query(F.data.contains('load_history'))
+async def load_history(callback_query: types.callback_query):
+    await manager_load_history(callback_query)
+
+
+async def on_startup() -> None:
+    await open_pool()
+    state_cache.start()
+    history_writer.start()
+    await catalog.start()
+    notifier.start()
+
+
+async def on_shutdown() -> None:
+    logger.info(f'Queries per handler: {request_context_middleware.stats}')
+    await notifier.stop()
+    await catalog.stop()
+    try:
+        await history_writer.stop()
+    finally:
+        try:
+            await state_cache.stop()
+        finally:
+            await close_pool()
+
+
 async def main() -> None:
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
     await dp.start_polling(bot)
 
 
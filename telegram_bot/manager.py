@@ -1,11 +1,78 @@
 from buttons import *
 from general import *
 from loguru import logger
-from db_conn import get_rows_in_db, get_user_info, get_row_in_db, set_one_column, update_history_chat_with_manager
+from contextlib import aclosing
+from db_conn import (get_rows_in_db, get_user_info, get_row_in_db, set_one_column, update_history_chat_with_manager,
+                     iter_chat_history, history_writer)
 from telegram_bot.text import *
 from aiogram import html
 
 
+TELEGRAM_MESSAGE_LIMIT = 4096
+HISTORY_PAGE_MESSAGES = 5
+
+
+def history_lines(message, user_name: str) -> list[tuple[int, str]]:
+    text = (message.user_message if message.user_message else message.manager_message) or ''
+    role = 'Менеджер' if message.manager_message else user_name
+    width = TELEGRAM_MESSAGE_LIMIT - len(f'{role}: ')
+    pieces = [text[i:i + width] for i in range(0, len(text), width)] or ['']
+    return [(len(f'{role}: {piece}'), f'{html.bold(role)}: {html.quote(piece)}') for piece in pieces]
+
+
+def closed_chunks(lines: list[tuple[int, str]], size: int) -> int:
+    """
+    Number of messages `lines` fill up when appended to a message of `size` characters (0 - an empty one)
+    """
+
+    closed = 0
+    for length, _ in lines:
+        if size and size + 1 + length > TELEGRAM_MESSAGE_LIMIT:
+            closed += 1
+            size = 0
+        size += length + (1 if size else 0)
+    return closed
+
+
+async def history_page(chat_id: str, user_name: str, after_id: int = 0):
+    """
+    Packs the chat history after `after_id` into at most HISTORY_PAGE_MESSAGES messages of up to 4096 characters,
+    counting every part of a split long message (only a first message longer than the whole page may exceed it).
+    Returns the messages, the id of the last packed row and whether there is more history after it.
+    """
+
+    await history_writer.flush()
+    chunks, current, size, last_id, more = [], [], 0, after_id, False
+
+    async with aclosing(iter_chat_history(chat_id, after_id)) as rows:
+        async for message in rows:
+            lines = history_lines(message, user_name)
+
+            if current and len(chunks) + closed_chunks(lines, size) + 1 > HISTORY_PAGE_MESSAGES:
+                more = True
+                break
+
+            for length, line in lines:
+                if current and size + 1 + length > TELEGRAM_MESSAGE_LIMIT:
+                    chunks.append('\n'.join(current))
+                    current, size = [], 0
+                size += length + (1 if current else 0)
+                current.append(line)
+
+            last_id = message.id
+
+    if current:
+        chunks.append('\n'.join(current))
+
+    return chunks, last_id, more
+
+
+async def send_history(message, chunks: list[str], chat_id: str, last_id: int, more: bool):
+    for i, chunk in enumerate(chunks):
+        buttons = button_load_history(chat_id, last_id) if more and i == len(chunks) - 1 else None
+        await message.answer(text=chunk, reply_markup=buttons)
+
+
 async def manager_on_off_line(message, online):
     try:
         if await check_manager(message):
@@ -13,7 +80,7 @@ async def manager_on_off_line(message, online):
 
         db, db_data, db_func_message = await get_state_from_db(tg_id=message.from_user.id)
         key = 'on_line' if online else ''
-        db.set_state(key=key, func_message_id=db_func_message[0], is_inline_button_enabled=db_func_message[1])
+        await db.set_state(key=key, func_message_id=db_func_message[0], is_inline_button_enabled=db_func_message[1])
 
         user = await get_user_info(message.from_user.id)
         buttons = button_get_manager_question if online else builder_main_menu(user.role_id)
@@ -94,7 +161,7 @@ async def close_question(chat_id, telegram_id, bot):
         )
 
         user_db, user_db_data, user_db_func_message = await get_state_from_db(data.user_tg_id)
-        user_db_data.set_state(
+        await user_db.set_state(
             func_message_id=user_db_func_message[0],
             is_inline_button_enabled=user_db_func_message[1]
         )
@@ -167,7 +234,7 @@ async def manager_start_discussion(callback_query, bot):
         self_tg_id = callback_query.from_user.id
 
         db, db_data, db_func_message = await get_state_from_db(callback_query.from_user.id)
-        db.set_state(
+        await db.set_state(
             key='chat_with_user',
             chat_id=chat_id,
             func_message_id=db_func_message[0],
@@ -193,17 +260,14 @@ async def manager_start_discussion(callback_query, bot):
         )
 
         res = await get_row_in_db('chats_with_managers', 'unique_chat_id', chat_id, self_tg_id)
-        all_message = await get_rows_in_db('chats_with_managers_history', 'chat_id', chat_id, self_tg_id)
 
         if res:
             text = start_chat_with_user(res.user_name, res.user_tg_id)
             await bot.send_message(chat_id=res.user_tg_id, text='🟢 К вам подключился менеджер 🟢')
             await callback_query.message.edit_text(text=text)
 
-            for message in all_message:
-                text = message.user_message if message.user_message else message.manager_message
-                role = 'Менеджер' if message.manager_message else res.user_name
-                await callback_query.message.answer(text=f'{html.bold(role)}: {text}')
+            chunks, last_id, more = await history_page(chat_id, res.user_name)
+            await send_history(callback_query.message, chunks, chat_id, last_id, more)
             logger.info(f'Manager with id {callback_query.from_user.id} open discussion with user id {res.user_tg_id}')
             return True, "🟢 Вы успешно подключились к чату 🟢", button_action_with_user
         else:
@@ -214,6 +278,29 @@ async def manager_start_discussion(callback_query, bot):
         return False, None, None
 
 
+async def manager_load_history(callback_query):
+    try:
+        if await check_manager(callback_query):
+            return False
+
+        await callback_query.answer()
+        _, chat_id, after_id = callback_query.data.split(' ')
+        res = await get_row_in_db('chats_with_managers', 'unique_chat_id', chat_id, callback_query.from_user.id)
+
+        if not res:
+            return False
+
+        chunks, last_id, more = await history_page(chat_id, res.user_name, int(after_id))
+        await callback_query.message.edit_reply_markup(reply_markup=None)
+        await send_history(callback_query.message, chunks, chat_id, last_id, more)
+        logger.info(f'Manager with id {callback_query.from_user.id} load history of chat {chat_id} after {after_id}')
+        return True
+
+    except Exception as e:
+        logger.error(e)
+        return False
+
+
 async def manager_stop_discussion(message, bot):
     try:
         if await check_manager(message):
@@ -221,7 +308,7 @@ async def manager_stop_discussion(message, bot):
 
         db, db_data, db_func_message = await get_state_from_db(message.from_user.id)
         chat_id = db_data.chat_id
-        db.set_state(
+        await db.set_state(
             key='on_line',
             func_message_id=db_func_message[0],
             is_inline_button_enabled=db_func_message[1]
@@ -290,7 +377,7 @@ async def send_message_to_user(message, bot):
         if info.status == 3:
             ms = await message.answer(text=f'Вопрос был закрыт', reply_markup=button_get_manager_question)
             await update_state(message, ms, bot)
-            db.set_state(
+            await db.set_state(
                 key='on_line',
                 func_message_id=db_func_message[0],
                 is_inline_button_enabled=db_func_message[1]
@@ -316,6 +403,6 @@ async def send_message_to_user(message, bot):
         return False
 
 
-__all__ = ['send_message_to_user', 'manager_stop_discussion', 'manager_start_discussion',
+__all__ = ['send_message_to_user', 'manager_stop_discussion', 'manager_start_discussion', 'manager_load_history',
            'manager_back_to_questions_list', 'manager_close_question_m', 'manager_close_question',
            'manager_open_question', 'manager_get_open_question', 'manager_on_off_line']
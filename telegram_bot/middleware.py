@@ -0,0 +1,47 @@
+from aiogram import BaseMiddleware
+from loguru import logger
+from db_conn import RequestContext, request_context, load_request_context, commit_request_context
+
+
+class RequestContextMiddleware(BaseMiddleware):
+
+    """
+    Loads the sender's telegram_user_data row (user + state) once per update, makes it available to db_conn and to
+    the handler (as `request_context`) and writes the accumulated state changes once the handler is done.
+    Counts the queries issued by every handler (see `stats`).
+    """
+
+    def __init__(self):
+        self.stats: dict[str, dict[str, int]] = {}
+
+    async def __call__(self, handler, event, data):
+        user = data.get('event_from_user')
+        if not user:
+            return await handler(event, data)
+
+        ctx = RequestContext(telegram_id=user.id)
+        token = request_context.set(ctx)
+
+        try:
+            await load_request_context(ctx)
+            data['request_context'] = ctx
+            return await handler(event, data)
+
+        finally:
+            await commit_request_context(ctx)
+            request_context.reset(token)
+            self.record(data.get('handler'), ctx)
+
+    def record(self, handler, ctx: RequestContext):
+        name = handler.callback.__name__ if handler else 'unknown'
+        stats = self.stats.setdefault(name, {'calls': 0, 'queries': 0, 'max_queries': 0})
+        stats['calls'] += 1
+        stats['queries'] += ctx.queries
+        stats['max_queries'] = max(stats['max_queries'], ctx.queries)
+        logger.info(f'Handler "{name}" for user {ctx.telegram_id}: {ctx.queries} queries')
+
+
+request_context_middleware = RequestContextMiddleware()
+
+
+__all__ = ['RequestContextMiddleware', 'request_context_middleware']
@@ -0,0 +1,165 @@
+import asyncio
+import os
+import time
+
+from collections import deque
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError, TelegramAPIError
+from loguru import logger
+
+
+NOTIFY_WORKERS = int(os.getenv('NOTIFY_WORKERS', 8))
+NOTIFY_GLOBAL_RATE = float(os.getenv('NOTIFY_GLOBAL_RATE', 25))
+NOTIFY_CHAT_INTERVAL = float(os.getenv('NOTIFY_CHAT_INTERVAL', 1.0))
+NOTIFY_MAX_RETRIES = int(os.getenv('NOTIFY_MAX_RETRIES', 3))
+
+
+def percentile_ms(values: list[float], p: float) -> int | None:
+    if not values:
+        return None
+    return round(values[min(int(len(values) * p), len(values) - 1)] * 1000)
+
+
+class Notifier:
+
+    """
+    Background fan-out of bot messages (e.g. a new question to every online manager).
+    `send` / `send_many` only enqueue, `workers` tasks deliver concurrently while keeping to Telegram's limits:
+    at most `global_rate` messages per second overall and one message per `chat_interval` seconds per chat.
+    A message for a chat that is not due yet is re-scheduled for its slot instead of holding a worker.
+    RetryAfter pauses the chat for the requested time and network errors back off; both re-schedule the message and
+    count as an attempt, up to `max_retries` retries. Delivery latency (enqueue -> sent) and counters are available in
+    `stats`.
+    """
+
+    def __init__(self, workers: int = NOTIFY_WORKERS, global_rate: float = NOTIFY_GLOBAL_RATE,
+                 chat_interval: float = NOTIFY_CHAT_INTERVAL, max_retries: int = NOTIFY_MAX_RETRIES):
+        self.workers = workers
+        self.global_interval = 1 / global_rate
+        self.chat_interval = chat_interval
+        self.max_retries = max_retries
+
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+        self._scheduled: set[asyncio.TimerHandle] = set()
+        self._next_global = 0.0
+        self._next_chat: dict[int, float] = {}
+        self._latency = deque(maxlen=1000)
+
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    def send(self, bot, chat_id: int, text: str, **kwargs):
+        self._queue.put_nowait((bot, chat_id, text, kwargs, time.monotonic(), 0))
+
+    def send_many(self, bot, chat_ids, text: str, **kwargs):
+        for chat_id in chat_ids:
+            self.send(bot, chat_id, text, **kwargs)
+
+    def _schedule(self, delay: float, item: tuple):
+        handle = None
+
+        def put():
+            self._scheduled.discard(handle)
+            self._queue.put_nowait(item)
+
+        handle = asyncio.get_running_loop().call_later(delay, put)
+        self._scheduled.add(handle)
+
+    async def _wait_for_slot(self, chat_id: int):
+        now = time.monotonic()
+        slot = max(now, self._next_global, self._next_chat.get(chat_id, 0.0))
+        self._next_global = max(self._next_global, now) + self.global_interval
+        self._next_chat[chat_id] = slot + self.chat_interval
+
+        if len(self._next_chat) > 10000:
+            self._next_chat = {key: value for key, value in self._next_chat.items() if value > now}
+
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _deliver(self, bot, chat_id, text, kwargs, queued_at, attempt):
+        due = self._next_chat.get(chat_id, 0.0) - time.monotonic()
+        if due > 0:
+            self._schedule(due, (bot, chat_id, text, kwargs, queued_at, attempt))
+            return
+
+        await self._wait_for_slot(chat_id)
+
+        try:
+            await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+            self.sent += 1
+            self._latency.append(time.monotonic() - queued_at)
+
+        except (TelegramRetryAfter, TelegramNetworkError) as e:
+            if attempt >= self.max_retries:
+                self.failed += 1
+                logger.error(f'Notification to {chat_id} failed after {attempt} retries: {e}')
+                return
+
+            delay = e.retry_after if isinstance(e, TelegramRetryAfter) else 2 ** attempt
+            logger.warning(f'Notification to {chat_id}: retry {attempt + 1} in {delay}s ({e})')
+            self._next_chat[chat_id] = time.monotonic() + delay
+            self.retried += 1
+            self._schedule(delay, (bot, chat_id, text, kwargs, queued_at, attempt + 1))
+
+        except TelegramAPIError as e:
+            self.failed += 1
+            logger.error(f'Notification to {chat_id} failed: {e}')
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            try:
+                await self._deliver(*item)
+            except Exception as e:
+                self.failed += 1
+                logger.error(e)
+            finally:
+                self._queue.task_done()
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+        logger.info(f'Notifier started (workers: {self.workers})')
+
+    async def _drain(self):
+        while True:
+            await self._queue.join()
+            if not self._scheduled:
+                return
+            await asyncio.sleep(0.1)
+
+    async def stop(self, timeout: float = 10):
+        try:
+            await asyncio.wait_for(self._drain(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f'Notifier stopped with {self._queue.qsize() + len(self._scheduled)} undelivered messages')
+
+        for handle in self._scheduled:
+            handle.cancel()
+        self._scheduled = set()
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        logger.info(f'Notifier stopped. Stats: {self.stats}')
+
+    @property
+    def stats(self) -> dict:
+        latency = sorted(self._latency)
+        return {
+            'queued': self._queue.qsize(),
+            'scheduled': len(self._scheduled),
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'latency_p50_ms': percentile_ms(latency, 0.5),
+            'latency_p95_ms': percentile_ms(latency, 0.95),
+            'latency_max_ms': percentile_ms(latency, 1),
+        }
+
+
+notifier = Notifier()
+
+
+__all__ = ['Notifier', 'notifier']
@@ -0,0 +1,215 @@
+import asyncio
+
+from collections import OrderedDict
+from loguru import logger
+
+
+class StateCache:
+
+    """
+    LRU-bounded per-user cache of telegram_user_data.state.
+    In write-back mode changed states are only marked dirty and written by `writer` in one batch every
+    `flush_interval` seconds, on eviction and on stop(). In write-through mode every change is written at once and
+    the cache only saves the reads.
+    Partial updates are kept as patches and written by `merger` (jsonb merge in the database), so they never need the
+    current state to be read first and concurrent partial updates of different keys do not overwrite each other.
+    Write-back assumes this process is the only writer of the states: a state changed elsewhere is overwritten by the
+    next flush of a cached one, so use write-through when other processes write them too.
+    A failed flush keeps the states for the next one; evicted states waiting for it are bounded by `max_pending` and
+    the oldest are dropped (and logged) past it. stop() raises if states are still unwritten after the final flush.
+    :param writer: coroutine function taking {telegram_id: state} and replacing the stored states
+    :param merger: coroutine function taking {telegram_id: patch} and merging the patches into the stored states
+    :param max_size: maximum number of cached users
+    :param flush_interval: seconds between background flushes (write-back mode)
+    :param write_through: write every change immediately (crash-safe)
+    :param max_pending: maximum number of evicted states waiting to be written, max_size by default
+    """
+
+    def __init__(self, writer, merger, max_size: int = 10000, flush_interval: float = 1.0,
+                 write_through: bool = False, max_pending: int = None):
+        self.writer = writer
+        self.merger = merger
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.write_through = write_through
+        self.max_pending = max_size if max_pending is None else max_pending
+
+        self._states: OrderedDict[int, dict] = OrderedDict()
+        self._dirty: set[int] = set()
+        self._evicted: dict[int, dict] = {}
+        self._patches: dict[int, dict] = {}
+        self._flushing_patches: dict[int, dict] = {}
+        self._lock = asyncio.Lock()
+        self._task = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.flushes = 0
+        self.flushed_states = 0
+        self.failed_flushes = 0
+        self.dropped = 0
+        self.last_error = None
+
+    def get(self, tg_id: int) -> dict | None:
+        if tg_id in self._states:
+            self._states.move_to_end(tg_id)
+            self.hits += 1
+            return self._states[tg_id]
+
+        if tg_id in self._evicted:
+            self.hits += 1
+            return self._evicted[tg_id]
+
+        self.misses += 1
+        return None
+
+    def load(self, tg_id: int, state: dict) -> dict:
+
+        """
+        Caches the state read from the database (with the patches not written yet) and returns the cached state;
+        a dirty state is kept as it is newer than the database
+        """
+
+        if tg_id in self._dirty or tg_id in self._evicted:
+            return self._states.get(tg_id, self._evicted.get(tg_id))
+        self._states[tg_id] = state | self._flushing_patches.get(tg_id, {}) | self._patches.get(tg_id, {})
+        self._states.move_to_end(tg_id)
+        self._evict()
+        return self._states.get(tg_id, state)
+
+    async def put(self, tg_id: int, state: dict):
+        self._states[tg_id] = state
+        self._states.move_to_end(tg_id)
+        self._evicted.pop(tg_id, None)
+        self._patches.pop(tg_id, None)
+
+        if self.write_through:
+            await self.writer({tg_id: state})
+        else:
+            self._dirty.add(tg_id)
+
+        if self._evict():
+            await self.flush()
+
+    async def update(self, tg_id: int, patch: dict):
+        await self.update_many({tg_id: patch})
+
+    async def update_many(self, patches: dict[int, dict]):
+        for tg_id, patch in patches.items():
+            if tg_id in self._dirty:
+                self._states[tg_id] = self._states[tg_id] | patch
+                continue
+
+            if tg_id in self._evicted:
+                self._evicted[tg_id] = self._evicted[tg_id] | patch
+                continue
+
+            if tg_id in self._states:
+                self._states[tg_id] = self._states[tg_id] | patch
+
+            if not self.write_through:
+                self._patches[tg_id] = self._patches.get(tg_id, {}) | patch
+
+        if self.write_through:
+            await self.merger(patches)
+
+        elif len(self._patches) > self.max_size:
+            await self.flush()
+
+    def _evict(self) -> bool:
+        dirty_evicted = False
+        while len(self._states) > self.max_size:
+            tg_id, state = self._states.popitem(last=False)
+            self.evictions += 1
+            if tg_id in self._dirty:
+                self._dirty.discard(tg_id)
+                self._evicted[tg_id] = state
+                dirty_evicted = True
+        self._drop_pending()
+        return dirty_evicted
+
+    def _drop_pending(self):
+        while len(self._evicted) > self.max_pending:
+            tg_id = next(iter(self._evicted))
+            state = self._evicted.pop(tg_id)
+            self.dropped += 1
+            logger.error(f'State cache dropped the unwritten state of user {tg_id}: {state}')
+
+    async def flush(self):
+        async with self._lock:
+            if not self._dirty and not self._evicted and not self._patches:
+                return
+
+            states = self._evicted | {tg_id: self._states[tg_id] for tg_id in self._dirty}
+            patches = self._patches
+            self._dirty.clear()
+            self._evicted = {}
+            self._patches = {}
+            self._flushing_patches = patches
+
+            try:
+                if states:
+                    await self.writer(states)
+                if patches:
+                    await self.merger(patches)
+                self.flushes += 1
+                self.flushed_states += len(states) + len(patches)
+
+            except Exception as e:
+                self.failed_flushes += 1
+                self.last_error = repr(e)
+                logger.error(f'State cache flush failed ({len(states) + len(patches)} states): {e}')
+                for tg_id, state in states.items():
+                    if tg_id in self._dirty or tg_id in self._evicted:
+                        continue
+                    if tg_id in self._states:
+                        self._dirty.add(tg_id)
+                    else:
+                        self._evicted[tg_id] = state
+                for tg_id, patch in patches.items():
+                    if tg_id not in self._dirty and tg_id not in self._evicted:
+                        self._patches[tg_id] = patch | self._patches.get(tg_id, {})
+                self._drop_pending()
+
+            finally:
+                self._flushing_patches = {}
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await asyncio.shield(self.flush())
+
+    def start(self):
+        if not self.write_through and self._task is None:
+            self._task = asyncio.create_task(self._run())
+        logger.info(f'State cache started (size: {self.max_size}, write through: {self.write_through})')
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        logger.info(f'State cache stopped. Stats: {self.stats}')
+
+        pending = len(self._dirty) + len(self._evicted) + len(self._patches)
+        if pending:
+            raise RuntimeError(f'State cache stopped with {pending} unwritten state(s): {self.last_error}')
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'size': len(self._states),
+            'dirty': len(self._dirty) + len(self._evicted) + len(self._patches),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'flushes': self.flushes,
+            'flushed_states': self.flushed_states,
+            'failed_flushes': self.failed_flushes,
+            'dropped': self.dropped,
+            'last_error': self.last_error,
+        }
+
+
+__all__ = ['StateCache']
@@ -3,6 +3,8 @@ import re
 from db_conn import *
 from aiogram import html
 from buttons import trucks_view_buttons, button_cancel_q
+from vin_index import normalize_vin
+from notifier import notifier
 from telegram_bot.general import get_state_from_db
 from text import *
 from loguru import logger
@@ -43,17 +45,17 @@ async def vin_search_by_state(message):
 
     try:
         db, db_data, db_func_message = await get_state_from_db(message.from_user.id)
-        vin = message.text
+        vin = normalize_vin(message.text)
 
         text = f'🚚 {html.bold(html.italic("Trucks"))} 🚚\n' + ('-' * 50) + '\n'
-        buttons, pages = await trucks_view_buttons(message, 0, 7, message.text)
+        buttons, pages = await trucks_view_buttons(message, vin)
 
         if pages[1] == 'no_match':
             return True, no_found_by_vin_t + vin_f(vin), buttons
 
         text += pages_f(pages) + vin_f(vin)
 
-        db.update_state(
+        await db.update_state(
             key='trucks_list',
             vin=vin,
             func_message_id=db_func_message[0],
@@ -86,7 +88,7 @@ async def change_price_by_state(message):
             telegram_id=message.from_user.id
         )
 
-        db.set_state(
+        await db.set_state(
             func_message_id=db_func_message[0],
             is_inline_button_enabled=db_func_message[1],
         )
@@ -126,7 +128,7 @@ async def contact_with_manager_first_step_by_state(message):
                 telegram_id=message.from_user.id
             )
 
-            db.set_state(
+            await db.set_state(
                 func_message_id=db_func_message[0],
                 is_inline_button_enabled=db_func_message[1],
                 name=message.text,
@@ -158,7 +160,7 @@ async def contact_with_manager_second_step_by_state(message, data, bot):
                 user_message=message.text
             )
             db, db_data, db_func_message = await get_state_from_db(message.from_user.id)
-            db.set_state(
+            await db.set_state(
                 func_message_id=db_func_message[0],
                 is_inline_button_enabled=db_func_message[1],
                 key='chat_with_manager',
@@ -166,11 +168,13 @@ async def contact_with_manager_second_step_by_state(message, data, bot):
             )
             online_managers = await get_online_managers(telegram_id=message.from_user.id)
 
-            if online_managers:
+            if isinstance(online_managers, dict):
+                logger.error(online_managers.get('data'))
+
+            elif online_managers:
                 text = (f'Пользователь {html.bold(data.name)} задаёт вопрос: {message.text}.\n'
                         f'Что-бы ответить, зайдите в "Получить открытые вопросы"')
-                for manager in online_managers:
-                    await bot.send_message(chat_id=manager.get('telegram_id'), text=text)
+                notifier.send_many(bot, [manager.telegram_id for manager in online_managers], text)
 
             logger.info(f'User ({message.from_user.id}) ask a question for managers')
             return True, q_in_processing, button_cancel_q
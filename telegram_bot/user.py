@@ -2,6 +2,7 @@ import re
 
 from general import *
 from db_conn import *
+from catalog import catalog
 from random import randint
 from text import *
 from loguru import logger
@@ -56,8 +57,8 @@ async def user_trucks(message):
         dep = await user_dependence(message, db_data)
 
         if dep:
-            buttons, pages = await trucks_view_buttons(message=message, from_=0, to_=7, vin='')
-            db.update_state(
+            buttons, pages = await trucks_view_buttons(message=message, vin='')
+            await db.update_state(
                 func_message_id=db_func_message[0],
                 is_inline_button_enabled=db_func_message[1],
                 key='trucks_list',
@@ -82,7 +83,7 @@ async def user_profile(message):
         dep = await user_dependence(message, db_data)
 
         if dep:
-            db.set_state(func_message_id=db_func_message[0], is_inline_button_enabled=db_func_message[1])
+            await db.set_state(func_message_id=db_func_message[0], is_inline_button_enabled=db_func_message[1])
             logger.info(f'User ({message.from_user.id}) get profile')
             return True, await profile_create(message), None
 
@@ -99,7 +100,7 @@ async def user_settings(message):
         dep = await user_dependence(message, db_data)
 
         if dep:
-            db.set_state(func_message_id=db_func_message[0], is_inline_button_enabled=db_func_message[1])
+            await db.set_state(func_message_id=db_func_message[0], is_inline_button_enabled=db_func_message[1])
             logger.info(f'User ({message.from_user.id}) open settings')
             return True, set_title_t, await settings_inline_button(message)
 
@@ -114,7 +115,7 @@ async def user_settings(message):
 async def global_cancel(message):
     try:
         db, db_data, db_func_message = await get_state_from_db(message.from_user.id)
-        db.set_state(
+        await db.set_state(
             func_message_id=db_func_message[0],
             is_inline_button_enabled=db_func_message[1]
         )
@@ -129,7 +130,7 @@ async def global_cancel(message):
 async def user_change_name(message):
     try:
         db, db_data, db_func_message = await get_state_from_db(message.from_user.id)
-        db.set_state(
+        await db.set_state(
             key='change_name',
             func_message_id=db_func_message[0],
             is_inline_button_enabled=db_func_message[1]
@@ -159,7 +160,7 @@ async def user_update_name(message):
                 telegram_id=message.from_user.id
             )
 
-            db.set_state(
+            await db.set_state(
                 func_message_id=db_func_message[0],
                 is_inline_button_enabled=db_func_message[1]
             )
@@ -188,9 +189,9 @@ async def user_selected(message):
             if not vins:
                 return True, no_favorite_t, None
 
-            buttons, pages = await trucks_view_buttons(message=message, from_=0, to_=7, vin=vins)
+            buttons, pages = await trucks_view_buttons(message=message, vin=vins)
 
-            db.update_state(
+            await db.update_state(
                 func_message_id=db_func_message[0],
                 is_inline_button_enabled=db_func_message[1],
                 key='trucks_list',
@@ -215,7 +216,7 @@ async def user_connect_with_manager(message):
         if dep:
             user = await get_user_info(message.from_user.id)
             if user.name:
-                db.set_state(
+                await db.set_state(
                     func_message_id=db_func_message[0],
                     is_inline_button_enabled=db_func_message[1],
                     name=user.name,
@@ -224,7 +225,7 @@ async def user_connect_with_manager(message):
                 )
                 return True, what_q_t, None
 
-            db.set_state(
+            await db.set_state(
                 func_message_id=db_func_message[0],
                 is_inline_button_enabled=db_func_message[1],
                 key='contact_with_manager',
@@ -256,7 +257,7 @@ async def user_close_chat_with_manager(message, bot):
 
         if data_row.manager_tg_id:
             manager_db, manager_db_data, manager_db_func_message = await get_state_from_db(data_row.manager_tg_id)
-            manager_db_data.set_state(
+            await manager_db.set_state(
                 key='on_line',
                 func_message_id=manager_db_func_message[0],
                 is_inline_button_enabled=manager_db_func_message[1]
@@ -270,7 +271,7 @@ async def user_close_chat_with_manager(message, bot):
 
         if res.get('ans') == 'success':
             logger.info(f'User ({message.from_user.id}) close connect with manager')
-            db.set_state(func_message_id=db_func_message[0], is_inline_button_enabled=db_func_message[1])
+            await db.set_state(func_message_id=db_func_message[0], is_inline_button_enabled=db_func_message[1])
             return True, q_cancel_t, builder_main_menu()
     
         else:
@@ -318,18 +319,7 @@ async def user_change_page(callback_query):
         if str(pages[0]) == "1" and str(pages[1]) == "1":
             return False, None, None
 
-        if turn == 'prev':
-            pages[0] = pages[0] - 1
-
-            if pages[0] <= 0:
-                pages[0] = pages[1]
-
-        elif turn == 'next':
-            pages[0] = pages[0] + 1
-
-            if pages[0] > pages[1]:
-                pages[0] = 1
-
+        first_id, last_id = pages[2:4] if len(pages) == 4 else (None, None)
         vin = db_data.vin if db_data.vin else None
 
         if 'selected' in data_get:
@@ -339,15 +329,15 @@ async def user_change_page(callback_query):
 
         buttons, pages = await trucks_view_buttons(
             message=callback_query,
-            from_=(pages[0] * 7) - 7,
-            to_=pages[0] * 7,
-            vin=vin
+            vin=vin,
+            after_id=last_id if turn == 'next' else None,
+            before_id=first_id if turn == 'prev' else None
         )
 
         if pages[1] == 'no_match':
             return True, no_found_by_vin_t + vin_f(vin), buttons
 
-        db.update_state(func_message_id=db_func_message[0], is_inline_button_enabled=db_func_message[1], value=pages)
+        await db.update_state(func_message_id=db_func_message[0], is_inline_button_enabled=db_func_message[1], value=pages)
         text += pages_f(pages)
 
         if 'selected' not in data_get:
@@ -369,9 +359,9 @@ async def user_clear_vin(callback_query):
 
         trucks = db_data.trucks_list if db_data.trucks_list else None
         statuses = db_data.statuses if db_data.statuses else None
-        buttons, pages = await trucks_view_buttons(message=callback_query, from_=0, to_=7, vin='')
+        buttons, pages = await trucks_view_buttons(message=callback_query, vin='')
 
-        db.set_state(
+        await db.set_state(
             func_message_id=db_func_message[0],
             is_inline_button_enabled=db_func_message[1],
             key='trucks_list',
@@ -392,7 +382,7 @@ async def user_clear_vin(callback_query):
 async def user_vin_search(callback_query):
     try:
         db, db_data, db_func_message = await get_state_from_db(callback_query.from_user.id)
-        db.update_state(
+        await db.update_state(
             func_message_id=db_func_message[0],
             is_inline_button_enabled=db_func_message[1],
             key='vin_search'
@@ -411,14 +401,15 @@ async def user_truck_search(callback_query):
         truck_id = callback_query.data.split(' ')[1]
         telegram_id = callback_query.from_user.id
 
-        truck = await get_row_in_db('trucks', 'id', truck_id, telegram_id)
-        status = await get_row_in_db('status', 'id', truck.status, telegram_id)
-        images = await get_rows_in_db('images', 'trucks_id', truck_id, telegram_id)
+        snapshot = catalog.snapshot
+        truck = snapshot.trucks_by_id.get(int(truck_id))
+        status = snapshot.status_by_id.get(truck.status)
+        images = snapshot.images_by_truck.get(truck.id)
         user = await get_row_in_db('telegram_user_data', 'telegram_id', telegram_id, telegram_id)
         favorite_trucks = user.selected_trucks if isinstance(user.selected_trucks, list) else []
 
         db, db_data, db_func_message = await get_state_from_db(callback_query.from_user.id)
-        db.update_state(
+        await db.update_state(
             timing_values=truck,
             name=truck_id,
             func_message_id=db_func_message[0],
@@ -459,7 +450,7 @@ async def user_add_to_favorite(callback_query):
             truck_id = db_data.name
             telegram_id = callback_query.from_user.id
 
-            truck = await get_row_in_db('trucks', 'id', truck_id, telegram_id)
+            truck = catalog.snapshot.trucks_by_id.get(int(truck_id))
             user = await get_row_in_db('telegram_user_data', 'telegram_id', telegram_id, telegram_id)
             favorite_trucks = user.selected_trucks if isinstance(user.selected_trucks, list) else []
 
@@ -486,7 +477,7 @@ async def user_remove_from_favorite(callback_query):
 
         if result.get('ans') == 'success':
 
-            truck = await get_row_in_db('trucks', 'id', truck_id, telegram_id)
+            truck = catalog.snapshot.trucks_by_id.get(int(truck_id))
             user = await get_row_in_db('telegram_user_data', 'telegram_id', telegram_id, telegram_id)
             favorite_trucks = user.selected_trucks if isinstance(user.selected_trucks, list) else []
 
@@ -516,7 +507,7 @@ async def send_message_to_manager(message, bot):
     if info.status == 3:
         ms = await message.answer(text=f'Ваш вопрос был закрыт. \nНадеюсь мы смогли вам помочь! 👨‍🔧')
         await update_state(message, ms, bot)
-        db.set_state(func_message_id=db_func_message[0], is_inline_button_enabled=db_func_message[1])
+        await db.set_state(func_message_id=db_func_message[0], is_inline_button_enabled=db_func_message[1])
         return
 
     await update_history_chat_with_manager(
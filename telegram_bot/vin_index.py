@@ -0,0 +1,95 @@
+from typing import Iterable
+
+
+GRAM_SIZE = 3
+LAST_DIGITS = 6
+
+
+def normalize_vin(vin: str) -> str:
+    return vin.strip().upper() if vin else ''
+
+
+class VinIndex:
+
+    """
+    In-memory trigram index over truck VINs.
+    `search` answers substring queries by checking only the trucks having every trigram of the query (shorter
+    queries fall back to a scan), `by_last_digits` is a dict lookup on the last 6 characters and `ids_for_vins` turns
+    a favorites list into truck ids with dict lookups. Results are truck ids in ascending order, like the catalog.
+    Postings are sets, so catalog updates add and remove ids in constant time.
+    """
+
+    def __init__(self, trucks: Iterable = ()):
+        self._vins: dict[int, str] = {}
+        self._ids_by_vin: dict[str, set[int]] = {}
+        self._grams: dict[str, set[int]] = {}
+        self._last_digits: dict[str, set[int]] = {}
+
+        for truck in trucks:
+            self.add(truck.id, truck.vin)
+
+    def __len__(self):
+        return len(self._vins)
+
+    @staticmethod
+    def _grams_of(vin: str) -> set[str]:
+        return {vin[i:i + GRAM_SIZE] for i in range(len(vin) - GRAM_SIZE + 1)}
+
+    def add(self, truck_id: int, vin: str):
+        if truck_id in self._vins:
+            self.remove(truck_id)
+
+        vin = normalize_vin(vin)
+        self._vins[truck_id] = vin
+        self._ids_by_vin.setdefault(vin, set()).add(truck_id)
+        self._last_digits.setdefault(vin[-LAST_DIGITS:], set()).add(truck_id)
+        for gram in self._grams_of(vin):
+            self._grams.setdefault(gram, set()).add(truck_id)
+
+    def remove(self, truck_id: int):
+        vin = self._vins.pop(truck_id, None)
+        if vin is None:
+            return
+
+        self._discard(self._ids_by_vin, vin, truck_id)
+        self._discard(self._last_digits, vin[-LAST_DIGITS:], truck_id)
+        for gram in self._grams_of(vin):
+            self._discard(self._grams, gram, truck_id)
+
+    @staticmethod
+    def _discard(index: dict[str, set[int]], key: str, truck_id: int):
+        ids = index.get(key)
+        if ids is not None:
+            ids.discard(truck_id)
+            if not ids:
+                del index[key]
+
+    def search(self, query: str) -> list[int]:
+        query = normalize_vin(query)
+        if not query:
+            return sorted(self._vins)
+
+        if len(query) < GRAM_SIZE:
+            candidates = self._vins
+        else:
+            postings = [self._grams.get(gram) for gram in self._grams_of(query)]
+            if not all(postings):
+                return []
+            candidates = set.intersection(*sorted(postings, key=len))
+
+        return sorted(truck_id for truck_id in candidates if query in self._vins[truck_id])
+
+    def by_last_digits(self, digits: str) -> list[int]:
+        digits = normalize_vin(digits)
+        if len(digits) != LAST_DIGITS:
+            return [truck_id for truck_id in self.search(digits) if self._vins[truck_id].endswith(digits)]
+        return sorted(self._last_digits.get(digits, ()))
+
+    def ids_for_vins(self, vins: Iterable[str]) -> list[int]:
+        ids = set()
+        for vin in vins:
+            ids.update(self._ids_by_vin.get(normalize_vin(vin), ()))
+        return sorted(ids)
+
+
+__all__ = ['VinIndex', 'normalize_vin', 'LAST_DIGITS']
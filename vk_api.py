@@ -1,48 +1,399 @@
 
-from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, wraps
+from itertools import islice
 from pathlib import Path
 
 from loguru import logger
 import os
+import threading
+import time
 import dotenv
 from pydantic import AliasChoices, Field, BaseModel
 from requests_toolbelt.sessions import BaseUrlSession
 from datetime import datetime
+from rate_limit import RateLimiter, parse_rates
+from vk_cache import ResponseCache
 
 dotenv.load_dotenv()
 
+VK_API_URL = os.getenv('VK_API_URL', 'https://api.vk.ru/method/')
+VK_RATE_LIMIT = float(os.getenv('VK_RATE_LIMIT', 3))
+VK_RATE_LIMITS = parse_rates(os.getenv('VK_RATE_LIMITS', ''))
+VK_MAX_RETRIES = int(os.getenv('VK_MAX_RETRIES', 3))
+
+VK_TOKEN_QUARANTINE = float(os.getenv('VK_TOKEN_QUARANTINE', 600))
+VK_PARALLEL_REQUESTS = int(os.getenv('VK_PARALLEL_REQUESTS', 4))
+VK_MAX_POST_IDS = 100
+
+# responses of wall.get, wall.getById, wall.getComment and wall.parseAttachedLink kept in memory, 0 - no cache
+VK_CACHE_SIZE = int(os.getenv('VK_CACHE_SIZE', 0))
+# seconds to keep them, e.g. "wall.get=30,wall.getById=120"
+VK_CACHE_TTLS = parse_rates(os.getenv('VK_CACHE_TTLS', ''))
+
+# 6 - too many requests per second, 9 - flood control
+VK_RETRY_CODES = {6, 9}
+# 10 - internal server error, retried for read methods only: a write may have been applied
+VK_READ_RETRY_CODES = {10}
+VK_READ_PREFIXES = ('get', 'search', 'is', 'parse')
+# 5 - user authorization failed, 28 - application authorization failed
+VK_AUTH_CODES = {5, 28}
+# the method is unavailable with a group token: the token is fine, the method needs another type
+VK_TOKEN_TYPE_CODES = {27}
+# token type a method (or a whole method family) needs, the other methods take user tokens
+VK_TOKEN_TYPES = {
+    'groups.getLongPollServer': 'group',
+    'groups.getLongPollSettings': 'group',
+    'groups.setLongPollSettings': 'group',
+    'groups.getCallbackConfirmationCode': 'group',
+    'messages': 'group',
+}
+
+vk_limiter = RateLimiter(rate=VK_RATE_LIMIT, rates=VK_RATE_LIMITS, max_retries=VK_MAX_RETRIES)
+vk_cache = ResponseCache(max_size=VK_CACHE_SIZE, ttls=VK_CACHE_TTLS)
+
+
 @lru_cache
 def vk_session():
     return VkSession()
 
 
+@lru_cache
+def vk_token_pool():
+    credentials = Credentials()
+    return TokenPool(dict.fromkeys(credentials.tokens, 'user') | dict.fromkeys(credentials.group_tokens, 'group'))
+
+
+def token_type(method: str) -> str:
+    return VK_TOKEN_TYPES.get(method) or VK_TOKEN_TYPES.get(method_family(method), 'user')
+
+
+class TokenPool:
+
+    """
+    Several user/group tokens used as one: every request takes the least loaded token of the type its method needs
+    (token_type, VK_TOKEN_TYPES) - shortest wait in vk_limiter, then fewest requests in flight - so throughput grows
+    with the number of tokens.
+    A token that fails authorization is quarantined for `quarantine` seconds and skipped meanwhile; if every token
+    of the type is quarantined the one released first is used.
+    :param tokens: access tokens with their type, {token: 'user' | 'group'}; a list is taken as user tokens
+    :param quarantine: seconds a token stays out of rotation after an authorization error
+    """
+
+    def __init__(self, tokens: dict[str, str] | list[str], quarantine: float = VK_TOKEN_QUARANTINE):
+        self.types = dict(tokens) if isinstance(tokens, dict) else dict.fromkeys(tokens, 'user')
+        self.tokens = list(self.types)
+        self.quarantine_time = quarantine
+
+        self._in_flight = {token: 0 for token in self.tokens}
+        self._requests = {token: 0 for token in self.tokens}
+        self._quarantined: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def of_type(self, type_: str) -> list[str]:
+        return [token for token in self.tokens if self.types[token] == type_]
+
+    def available(self, type_: str) -> list[str]:
+        now = time.monotonic()
+        return [token for token in self.of_type(type_) if self._quarantined.get(token, 0) <= now]
+
+    def acquire(self, method: str) -> str:
+        family, type_ = method_family(method), token_type(method)
+        with self._lock:
+            if not self.of_type(type_):
+                raise VkError(f'{method} needs a {type_} token, none is configured')
+
+            tokens = self.available(type_)
+            if tokens:
+                token = min(tokens, key=lambda token_: (
+                    max(vk_limiter.peek(token_, bucket) for bucket in vk_limit_families(family)),
+                    self._in_flight[token_]
+                ))
+            else:
+                token = min(self.of_type(type_), key=lambda token_: self._quarantined[token_])
+            self._in_flight[token] += 1
+            self._requests[token] += 1
+            return token
+
+    def release(self, token: str):
+        with self._lock:
+            self._in_flight[token] -= 1
+
+    def quarantine(self, token: str, code: int) -> bool:
+
+        """
+        Takes the token out of rotation. Returns whether another token of its type is left to retry with
+        """
+
+        with self._lock:
+            self._quarantined[token] = time.monotonic() + self.quarantine_time
+            logger.error(f'VK {self.types[token]} token ...{token[-4:]} quarantined for {self.quarantine_time:.0f}s '
+                         f'(error {code})')
+            return bool(self.available(self.types[token]))
+
+    @property
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            f'...{token[-4:]}': {
+                'type': self.types[token],
+                'requests': self._requests[token],
+                'in_flight': self._in_flight[token],
+                'quarantined': max(0, round(self._quarantined.get(token, 0) - now)),
+            }
+            for token in self.tokens
+        }
+
+
+def vk_error_code(response: dict) -> int | None:
+    error = response.get('error') if isinstance(response, dict) else None
+    return error.get('error_code') if isinstance(error, dict) else None
+
+
+def method_family(method: str) -> str:
+    return method.split('.')[0]
+
+
+def vk_limit_families(family: str) -> list[str]:
+
+    """
+    Buckets of vk_limiter a request of a method family goes through: the token one ('', VK_RATE_LIMIT for all the
+    methods) and the family one if VK_RATE_LIMITS has it
+    """
+
+    return ['', family] if family in vk_limiter.rates else ['']
+
+
+def vk_retryable(method: str, code: int | None) -> bool:
+    if code in VK_RETRY_CODES:
+        return True
+    return code in VK_READ_RETRY_CODES and method.split('.')[-1].startswith(VK_READ_PREFIXES)
+
+
+def run_sync(generator, session):
+    try:
+        request = next(generator)
+        while True:
+            if isinstance(request, list):
+                request = generator.send(run_parallel(request, session))
+            else:
+                method, params = request
+                request = generator.send(send_sync(method, params, session))
+    except StopIteration as e:
+        return e.value
+
+
+def send_sync(method: str, params: dict, session) -> dict:
+    return vk_cache.fetch(method, params, lambda: session.post(method, params=params).json())
+
+
+def run_parallel(calls: list[tuple[str, dict]], session) -> list[dict]:
+    with ThreadPoolExecutor(max(1, min(len(calls), VK_PARALLEL_REQUESTS))) as executor:
+        return list(executor.map(lambda call: send_sync(*call, session), calls))
+
+
+def chunked(items, size: int):
+    items = iter(items)
+    while chunk := list(islice(items, size)):
+        yield chunk
+
+
+def post_ids(posts_ids: str | list | dict) -> list[str]:
+
+    """
+    Brings the posts_ids forms of get_by_ids to a list of "owner_id_post_id" strings without duplicates
+    """
+
+    if isinstance(posts_ids, str):
+        posts_ids = posts_ids.split(',')
+    elif isinstance(posts_ids, dict):
+        posts_ids = [f'{key}_{item}' for key, item in posts_ids.items()]
+    return list(dict.fromkeys(str(post_id).strip() for post_id in posts_ids))
+
+
+def merge_posts(ids: list[str], pages: list) -> list | dict:
+
+    """
+    Merges the wall.getById responses of several chunks into one, with the posts in the order of `ids`.
+    Extended responses ({'items', 'profiles', 'groups'}) keep their profiles and groups, without repeats.
+    """
+
+    posts = {}
+    merged = {}
+    for page in pages:
+        items = page.get('items', []) if isinstance(page, dict) else page or []
+        posts.update((f'{post.get("owner_id")}_{post.get("id")}', post) for post in items)
+
+        if isinstance(page, dict):
+            for key, values in page.items():
+                if key != 'items' and isinstance(values, list):
+                    merged.setdefault(key, {}).update((value.get('id'), value) for value in values)
+
+    items = [posts[post_id] for post_id in ids if post_id in posts]
+    if not any(isinstance(page, dict) for page in pages):
+        return items
+    return {'items': items} | {key: list(values.values()) for key, values in merged.items()}
+
+
+def vk_method(func):
+
+    """
+    API methods are generators: they yield (vk method, params) for every request and receive the decoded response,
+    or a list of them to be sent in parallel (at most VK_PARALLEL_REQUESTS at a time) and receive the list of
+    responses.
+    The decorated method runs the generator on the blocking vk_session(); the undecorated generator is kept in
+    `.generator` so other clients (vk_api_async) can run the same method on their own transport.
+    """
+
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        return run_sync(func(self, *args, **kwargs), vk_session())
+
+    wrapper.generator = func
+    return wrapper
+
+
+class VkError(Exception):
+    pass
+
+
+class Paginator:
+
+    """
+    Bookkeeping of the wall iterators (iter_posts, iter_comments, iter_reposts): walks a method page by page with
+    `offset`, drops the items repeated because new ones shifted the offsets and tells when to stop: after a short
+    page or at the first item (pinned posts aside) older than `until`, with id <= `until_id` or matching `stop`.
+    In `ascending` order (oldest first) the items older than `until` / with id <= `until_id` come first, so they are
+    skipped instead and only `stop` ends the walk early.
+    """
+
+    def __init__(self, page_size: int = 100, until: datetime = None, until_id: int = None, stop=None,
+                 ascending: bool = False):
+        self.page_size = page_size
+        self.until = until.timestamp() if until else None
+        self.until_id = until_id
+        self.stop = stop
+        self.ascending = ascending
+
+        self.offset = 0
+        self._previous: set = set()
+
+    def is_old(self, item: dict) -> bool:
+        return ((self.until is not None and item.get('date', 0) < self.until)
+                or (self.until_id is not None and item.get('id', 0) <= self.until_id))
+
+    def is_end(self, item: dict) -> bool:
+        if item.get('is_pinned'):
+            return False
+        return (not self.ascending and self.is_old(item)) or (self.stop is not None and self.stop(item))
+
+    def page(self, result: dict) -> tuple[list[dict], bool]:
+
+        """
+        Takes the result of one page ({'result': ..., 'data': ...}) and returns the new items and whether it was the
+        last page. Moves `offset` to the next page.
+        """
+
+        if result.get('result') != 'success':
+            raise VkError(result.get('data'))
+
+        data = result.get('data') or {}
+        items = data.get('items', []) if isinstance(data, dict) else data
+        self.offset += self.page_size
+
+        new_items = []
+        for item in items:
+            if item.get('id') in self._previous:
+                continue
+            if self.is_end(item):
+                return new_items, True
+            if self.ascending and self.is_old(item):
+                continue
+            new_items.append(item)
+
+        self._previous = {item.get('id') for item in items}
+        return new_items, len(items) < self.page_size
+
+
 class Credentials(BaseModel):
     access_token: str = Field(..., validation_alias=AliasChoices('TOKEN_VK'))
+    extra_tokens: str = Field('', validation_alias=AliasChoices('TOKENS_VK'))
+    group_token_list: str = Field('', validation_alias=AliasChoices('GROUP_TOKENS_VK'))
     v: str = Field(..., validation_alias=AliasChoices('API_VERSION'))
 
     def __init__(self):
         dotenv.load_dotenv()
-        super().__init__(**dotenv.dotenv_values())
+        super().__init__(**(dict(os.environ) | dotenv.dotenv_values()))
 
     @property
     def params(self):
-        return self.model_dump(exclude={'group_id'})
+        return self.model_dump(exclude={'group_id', 'extra_tokens', 'group_token_list'})
+
+    @property
+    def tokens(self) -> list[str]:
+        return [self.access_token] + [token.strip() for token in self.extra_tokens.split(',') if token.strip()]
+
+    @property
+    def group_tokens(self) -> list[str]:
+        return [token.strip() for token in self.group_token_list.split(',') if token.strip()]
 
 
 class VkSession(BaseUrlSession):
     def __init__(self):
-        super().__init__('https://api.vk.ru/method/')
+        super().__init__(VK_API_URL)
 
         self._credentials = Credentials()
+        self._tokens = vk_token_pool()
+
+    def request(self, method, url, token: str = None, **kwargs):
+
+        """
+        Every request takes the least loaded token of the type the method needs (user: TOKEN_VK + TOKENS_VK,
+        group: GROUP_TOKENS_VK), waits for the rate limiter of that token and of its method family if limited
+        separately (vk_limiter) and is retried with jittered backoff when VK answers with error 6 or 9 (or 10 for
+        a read method), or with another token after an authorization error.
+        `token` pins a token of the pool instead, for calls that must share one (e.g. an upload and its save)
+        """
 
-    def request(self, method, url, **kwargs):
-        kwargs['params'] = kwargs.get('params', {}) | self._credentials.params
-        return super().request(method, url, **kwargs)
+        params = kwargs.get('params', {}) | self._credentials.params
+        family = method_family(url)
+        attempt = 0
+
+        while True:
+            current = token or self._tokens.acquire(url)
+            kwargs['params'] = params | {'access_token': current}
+
+            try:
+                for bucket in vk_limit_families(family):
+                    vk_limiter.wait(current, bucket)
+                response = super().request(method, url, **kwargs)
+            finally:
+                if token is None:
+                    self._tokens.release(current)
+
+            try:
+                code = vk_error_code(response.json())
+            except ValueError:
+                return response
+
+            if code in VK_AUTH_CODES and self._tokens.quarantine(current, code) and token is None:
+                continue
+            if code in VK_TOKEN_TYPE_CODES:
+                logger.error(f'VK error {code} on {url}: not available with a {self._tokens.types[current]} token '
+                             f'(VK_TOKEN_TYPES)')
+
+            delay = vk_limiter.retry_delay(attempt) if vk_retryable(url, code) else None
+            if delay is None:
+                return response
+
+            logger.warning(f'VK error {code} on {url}, retry {attempt + 1} in {delay:.2f}s')
+            time.sleep(delay)
+            attempt += 1
 
 
 class ApiVk:
 
-    def __init__(self, token):
+    def __init__(self, token=None):
 
         """
         StarveR api to connect vk.ru
@@ -52,6 +403,7 @@ class ApiVk:
         self.token = token
         # self.api_url = 'https://api.vk.com/method'
 
+    @vk_method
     def add(self, group_id: str = None, name: str = None, description: str = None, category_id: str = None,
             price: int = None, old_price: int = None, deleted: bool = False, main_photo_id: str = None,
             photo_ids: list | str = None, video_ids: list | str = None, url: str = '', is_main_variant: bool = False,
@@ -104,29 +456,27 @@ class ApiVk:
         if isinstance(video_ids, str):
             video_ids = [video_ids]
 
-        return vk_session().post(
-            'market.add',
-            params={
-                'owner_id': group_id,
-                'name': name,
-                'description': description,
-                'category_id': category_id,
-                'price': price,
-                'old_price': old_price,
-                'deleted': deleted,
-                'main_photo_id': main_photo_id,
-                'photo_ids': photo_ids,
-                'video_ids': video_ids,
-                'url': url,
-                'is_main_variant': is_main_variant,
-                'dimension_width': dimension_width,
-                'dimension_height': dimension_height,
-                'dimension_length': dimension_length,
-                'weight': weight,
-                'sku': sku,
-                'stock_amount': stock_amount,
-                'v': api_version
-            }).json()
+        return (yield 'market.add', {
+            'owner_id': group_id,
+            'name': name,
+            'description': description,
+            'category_id': category_id,
+            'price': price,
+            'old_price': old_price,
+            'deleted': deleted,
+            'main_photo_id': main_photo_id,
+            'photo_ids': photo_ids,
+            'video_ids': video_ids,
+            'url': url,
+            'is_main_variant': is_main_variant,
+            'dimension_width': dimension_width,
+            'dimension_height': dimension_height,
+            'dimension_length': dimension_length,
+            'weight': weight,
+            'sku': sku,
+            'stock_amount': stock_amount,
+            'v': api_version
+        })
 
     class Wall:
 
@@ -150,6 +500,7 @@ class ApiVk:
             else:
                 return 'Error. Elem error (not "list" or "dict")'
 
+        @vk_method
         def post(self, owner_id: str = None, friends_only: bool = False, from_group: bool = False, message: str = None,
                  services: str = None, signed: bool = False, publish_date: datetime = None, lat: int = None,
                  long: int = None, place_id: str = None, post_id: str = None, guid: str = None,
@@ -258,30 +609,28 @@ class ApiVk:
             if publish_date:
                 publish_date = publish_date.timestamp()
 
-            response = vk_session().post(
-                'wall.post',
-                params={
-                    'owner_id': owner_id,
-                    'friends_only': 1 if friends_only else 0,
-                    'from_group': 1 if from_group else 0,
-                    'message': message,
-                    'services': services,
-                    'signed': 1 if signed else 0,
-                    'publish_date': publish_date,
-                    'lat': lat,
-                    'long': long,
-                    'place_id': place_id,
-                    'post_id': post_id,
-                    'guid': guid,
-                    'mark_as_ads': 1 if mark_as_ads else 0,
-                    'link_title': link_title,
-                    'link_photo_id': link_photo_id,
-                    'close_comments': 1 if close_comments else 0,
-                    'donut_paid_duration': donut_paid_duration,
-                    'mute_notifications': 1 if mute_notifications else 0,
-                    'copyright': copyright,
-                    'attachments': attachments,
-                }).json()
+            response = yield 'wall.post', {
+                'owner_id': owner_id,
+                'friends_only': 1 if friends_only else 0,
+                'from_group': 1 if from_group else 0,
+                'message': message,
+                'services': services,
+                'signed': 1 if signed else 0,
+                'publish_date': publish_date,
+                'lat': lat,
+                'long': long,
+                'place_id': place_id,
+                'post_id': post_id,
+                'guid': guid,
+                'mark_as_ads': 1 if mark_as_ads else 0,
+                'link_title': link_title,
+                'link_photo_id': link_photo_id,
+                'close_comments': 1 if close_comments else 0,
+                'donut_paid_duration': donut_paid_duration,
+                'mute_notifications': 1 if mute_notifications else 0,
+                'copyright': copyright,
+                'attachments': attachments,
+            }
 
             if 'error' in response:
                 return {
@@ -292,6 +641,7 @@ class ApiVk:
             else:
                 return {'result': 'success', 'data': response.get('response')}
 
+        @vk_method
         def pin(self, owner_id: str = None, post_id: str = None) -> dict:
 
             """
@@ -308,18 +658,17 @@ class ApiVk:
             elif post_id is None:
                 return {'result': 'error', 'data': '"post_id" is empty"'}
 
-            response = vk_session().post(
-                'wall.pin',
-                params={
-                    'owner_id': owner_id,
-                    'post_id': post_id,
-                }).json()
+            response = yield 'wall.pin', {
+                'owner_id': owner_id,
+                'post_id': post_id,
+            }
 
             if not response.get('response'):
                 return {'result': 'error', 'data': f'The post failed to pinned'}
             else:
                 return {'result': 'success', 'data': 'The post has been successfully pinned'}
 
+        @vk_method
         def unpin(self, owner_id: str = None, post_id: str = None) -> dict:
 
             """
@@ -335,18 +684,17 @@ class ApiVk:
             elif post_id is None:
                 return {'result': 'error', 'data': '"post_id" is empty"'}
 
-            response = vk_session().post(
-                'wall.unpin',
-                params={
-                    'owner_id': owner_id,
-                    'post_id': post_id,
-                }).json()
+            response = yield 'wall.unpin', {
+                'owner_id': owner_id,
+                'post_id': post_id,
+            }
 
             if not response.get('response'):
                 return {'result': 'error', 'data': f'The post failed to unpinned'}
             else:
                 return {'result': 'success', 'data': 'The post has been successfully unpinned'}
 
+        @vk_method
         def report_comment(self, owner_id: str = None, comment_id: str = None, reason: int = None) -> dict:
 
             """
@@ -377,19 +725,18 @@ class ApiVk:
             if 8 < reason < 0:
                 return {'result': 'error', 'data': '"reason" must be between 0 and 8'}
 
-            response = vk_session().post(
-                'wall.reportComment',
-                params={
-                    'owner_id': owner_id,
-                    'comment_id': comment_id,
-                    'reason': reason
-                }).json()
+            response = yield 'wall.reportComment', {
+                'owner_id': owner_id,
+                'comment_id': comment_id,
+                'reason': reason
+            }
 
             if not response.get('response'):
                 return {'result': 'error', 'data': f'The complaint has not been successfully sent'}
             else:
                 return {'result': 'success', 'data': 'The complaint has been successfully sent'}
 
+        @vk_method
         def report_post(self, owner_id: str = None, post_id: str = None, reason: int = None) -> dict:
 
             """
@@ -420,19 +767,18 @@ class ApiVk:
             if 8 < reason < 0:
                 return {'result': 'error', 'data': '"reason" must be between 0 and 8'}
 
-            response = vk_session().post(
-                'wall.reportPost',
-                params={
-                    'owner_id': owner_id,
-                    'post_id': post_id,
-                    'reason': reason
-                }).json()
+            response = yield 'wall.reportPost', {
+                'owner_id': owner_id,
+                'post_id': post_id,
+                'reason': reason
+            }
 
             if not response.get('response'):
                 return {'result': 'error', 'data': f'The complaint has not been successfully sent'}
             else:
                 return {'result': 'success', 'data': 'The complaint has been successfully sent'}
 
+        @vk_method
         def repost(self, object_id: str = None, message: str = None, group_id: str = None, mark_as_ads: bool = False,
                    mute_notifications: bool = False) -> dict:
 
@@ -456,15 +802,13 @@ class ApiVk:
             if object_id is None:
                 return {'result': 'error', 'data': '"object_id" is empty"'}
 
-            response = vk_session().post(
-                'wall.repost',
-                params={
-                    'object': object_id,
-                    'message': message,
-                    'group_id': group_id if "-" not in group_id else group_id.replace('-', ''),
-                    'mark_as_ads': 1 if mark_as_ads else 0,
-                    'mute_notifications': 1 if mute_notifications else 0,
-                }).json()
+            response = yield 'wall.repost', {
+                'object': object_id,
+                'message': message,
+                'group_id': group_id if "-" not in group_id else group_id.replace('-', ''),
+                'mark_as_ads': 1 if mark_as_ads else 0,
+                'mute_notifications': 1 if mute_notifications else 0,
+            }
 
             if 'error' in response:
                 return {
@@ -474,6 +818,7 @@ class ApiVk:
             else:
                 return {'result': 'success', 'data': response.get('response')}
 
+        @vk_method
         def restore_post(self, owner_id: str = None, post_id: str = None) -> dict:
 
             """
@@ -490,18 +835,17 @@ class ApiVk:
             elif post_id is None:
                 return {'result': 'error', 'data': '"post_id" is empty"'}
 
-            response = vk_session().post(
-                'wall.restore',
-                params={
-                    'owner_id': owner_id,
-                    'post_id': post_id,
-                }).json()
+            response = yield 'wall.restore', {
+                'owner_id': owner_id,
+                'post_id': post_id,
+            }
 
             if not response.get('response'):
                 return {'result': 'error', 'data': f'The record has not been restored'}
             else:
                 return {'result': 'success', 'data': 'The record has been successfully restored'}
 
+        @vk_method
         def restore_comment(self, owner_id: str = None, comment_id: str = None) -> dict:
 
             """
@@ -517,18 +861,17 @@ class ApiVk:
             elif comment_id is None:
                 return {'result': 'error', 'data': '"comment_id" is empty"'}
 
-            response = vk_session().post(
-                'wall.restoreComment',
-                params={
-                    'owner_id': owner_id,
-                    'comment_id': comment_id,
-                }).json()
+            response = yield 'wall.restoreComment', {
+                'owner_id': owner_id,
+                'comment_id': comment_id,
+            }
 
             if not response.get('response'):
                 return {'result': 'error', 'data': f'The comment has not been restored'}
             else:
                 return {'result': 'success', 'data': 'The comment has been successfully restored'}
 
+        @vk_method
         def check_copyright_link(self, link: str = None) -> dict:
 
             """
@@ -541,17 +884,16 @@ class ApiVk:
             if link is None:
                 return {'result': 'error', 'data': '"link" is empty"'}
 
-            response = vk_session().post(
-                'wall.checkCopyrightLink',
-                params={
-                    'link': link,
-                }).json()
+            response = yield 'wall.checkCopyrightLink', {
+                'link': link,
+            }
 
             if not response.get('response'):
                 return {'result': 'error', 'data': f'The link is correct'}
             else:
                 return {'result': 'success', 'data': 'The link is incorrect'}
 
+        @vk_method
         def close_comment_on_post(self, owner_id: str = None, post_id: str = None) -> dict:
 
             """
@@ -567,18 +909,17 @@ class ApiVk:
             elif post_id is None:
                 return {'result': 'error', 'data': '"post_id" is empty"'}
 
-            response = vk_session().post(
-                'wall.closeComments',
-                params={
-                    'owner_id': owner_id,
-                    'post_id': post_id
-                }).json()
+            response = yield 'wall.closeComments', {
+                'owner_id': owner_id,
+                'post_id': post_id
+            }
 
             if not response.get('response'):
                 return {'result': 'error', 'data': f'Comments have not been disabled'}
             else:
                 return {'result': 'success', 'data': 'Comments have been successfully disabled'}
 
+        @vk_method
         def open_comment_on_post(self, owner_id: str = None, post_id: str = None) -> dict:
 
             """
@@ -594,18 +935,17 @@ class ApiVk:
             elif post_id is None:
                 return {'result': 'error', 'data': '"post_id" is empty"'}
 
-            response = vk_session().post(
-                'wall.openComments',
-                params={
-                    'owner_id': owner_id,
-                    'post_id': post_id
-                }).json()
+            response = yield 'wall.openComments', {
+                'owner_id': owner_id,
+                'post_id': post_id
+            }
 
             if not response.get('response'):
                 return {'result': 'error', 'data': f'Comments have not been enabled'}
             else:
                 return {'result': 'success', 'data': 'Comments have been successfully enabled'}
 
+        @vk_method
         def create_comment(self, owner_id: str = None, post_id: str = None, from_group: bool = False,
                            message: str = None, reply_to_comment: str = None, sticker_id: str = None, guid: str = None,
                            photos: dict | list[dict] = None, videos: dict | list[dict] = None,
@@ -653,18 +993,16 @@ class ApiVk:
             if attachments is None and message is None:
                 return {'result': 'error', 'data': '"attachments" and "message" are empty'}
 
-            response = vk_session().post(
-                'wall.createComment',
-                params={
-                    'owner_id': owner_id,
-                    'post_id': post_id,
-                    'from_group': 1 if from_group else 0,
-                    'message': message,
-                    'reply_to_comment': reply_to_comment,
-                    'sticker_id': sticker_id,
-                    'guid': guid,
-                    'attachments': attachments,
-                }).json()
+            response = yield 'wall.createComment', {
+                'owner_id': owner_id,
+                'post_id': post_id,
+                'from_group': 1 if from_group else 0,
+                'message': message,
+                'reply_to_comment': reply_to_comment,
+                'sticker_id': sticker_id,
+                'guid': guid,
+                'attachments': attachments,
+            }
 
             if 'error' in response:
                 return {
@@ -674,6 +1012,7 @@ class ApiVk:
             else:
                 return {'result': 'success', 'data': response.get('response')}
 
+        @vk_method
         def delete_post(self, owner_id: str = None, post_id: str = None) -> dict:
 
             """
@@ -689,18 +1028,17 @@ class ApiVk:
             elif post_id is None:
                 return {'result': 'error', 'data': '"post_id" is empty"'}
 
-            response = vk_session().post(
-                'wall.delete',
-                params={
-                    'owner_id': owner_id,
-                    'post_id': post_id
-                }).json()
+            response = yield 'wall.delete', {
+                'owner_id': owner_id,
+                'post_id': post_id
+            }
 
             if not response.get('response'):
                 return {'result': 'error', 'data': f'The post has not been deleted'}
             else:
                 return {'result': 'success', 'data': 'Post was successfully deleted'}
 
+        @vk_method
         def delete_comment(self, owner_id: str = None, comment_id: str = None) -> dict:
 
             """
@@ -716,18 +1054,17 @@ class ApiVk:
             elif comment_id is None:
                 return {'result': 'error', 'data': '"comment_id" is empty"'}
 
-            response = vk_session().post(
-                'wall.deleteComment',
-                params={
-                    'owner_id': owner_id,
-                    'comment_id': comment_id
-                }).json()
+            response = yield 'wall.deleteComment', {
+                'owner_id': owner_id,
+                'comment_id': comment_id
+            }
 
             if not response.get('response'):
                 return {'result': 'error', 'data': f'Comment has not been deleted'}
             else:
                 return {'result': 'success', 'data': 'Comment was successfully deleted'}
 
+        @vk_method
         def edit(self, owner_id: str = None, post_id: str = None, friends_only: bool = False, message: str = None,
                  services: str = None, signed: bool = False, publish_date: datetime = None, lat: int = None,
                  long: int = None, place_id: str = None, guid: str = None, mark_as_ads: bool = False,
@@ -826,27 +1163,25 @@ class ApiVk:
             if publish_date:
                 publish_date = publish_date.timestamp()
 
-            response = vk_session().post(
-                'wall.edit',
-                params={
-                    'owner_id': owner_id,
-                    'post_id': post_id,
-                    'friends_only': 1 if friends_only else 0,
-                    'message': message,
-                    'services': services,
-                    'signed': 1 if signed else 0,
-                    'publish_date': publish_date,
-                    'lat': lat,
-                    'long': long,
-                    'place_id': place_id,
-                    'guid': guid,
-                    'mark_as_ads': 1 if mark_as_ads else 0,
-                    'close_comments': 1 if close_comments else 0,
-                    'donut_paid_duration': donut_paid_duration,
-                    'mute_notifications': 1 if mute_notifications else 0,
-                    'copyright': copyright,
-                    'attachments': attachments,
-                }).json()
+            response = yield 'wall.edit', {
+                'owner_id': owner_id,
+                'post_id': post_id,
+                'friends_only': 1 if friends_only else 0,
+                'message': message,
+                'services': services,
+                'signed': 1 if signed else 0,
+                'publish_date': publish_date,
+                'lat': lat,
+                'long': long,
+                'place_id': place_id,
+                'guid': guid,
+                'mark_as_ads': 1 if mark_as_ads else 0,
+                'close_comments': 1 if close_comments else 0,
+                'donut_paid_duration': donut_paid_duration,
+                'mute_notifications': 1 if mute_notifications else 0,
+                'copyright': copyright,
+                'attachments': attachments,
+            }
 
             if 'error' in response:
                 return {
@@ -856,6 +1191,7 @@ class ApiVk:
             else:
                 return {'result': 'success', 'data': response.get('response')}
 
+        @vk_method
         def edit_comment(self, owner_id: str = None, comment_id: str = None, message: str = None,
                          photos: dict | list[dict] = None, videos: dict | list[dict] = None,
                          audios: dict | list[dict] = None, docs: dict | list[dict] = None) -> dict:
@@ -894,27 +1230,27 @@ class ApiVk:
             if attachments is None and message is None:
                 return {'result': 'error', 'data': '"attachments" and "message" are empty'}
 
-            response = vk_session().post(
-                'wall.editComment',
-                params={
-                    'owner_id': owner_id,
-                    'comment_id': comment_id,
-                    'message': message,
-                    'attachments': attachments,
-                }).json()
+            response = yield 'wall.editComment', {
+                'owner_id': owner_id,
+                'comment_id': comment_id,
+                'message': message,
+                'attachments': attachments,
+            }
 
             if not response.get('response'):
                 return {'result': 'error', 'data': f'Comment has not been edited'}
             else:
                 return {'result': 'success', 'data': 'Comment was successfully edited'}
 
-        def get(self, owner_id: str = None, count: int = 20, filter_: str = 'all', extended: bool = False) -> dict:
+        @vk_method
+        def get(self, owner_id: str = None, count: int = 20, filter_: str = 'all', extended: bool = False,
+                offset: int = None) -> dict:
 
             """
             Getting user or group records
             https://dev.vk.com/ru/method/wall.get
             :param owner_id: REQUIRED. The ID of the user or community. The community ID must start with a "-" (str)
-            :param count: Count of records (int) default 20
+            :param count: Count of records (int) default 20, maximum 100
             :param filter_: Determines which types of wall entries need to be retrieved. Possible values:
                 suggests — suggested entries on the community wall (available only when calling with the transfer of access_token);
                 postponed — deferred entries (available only when calling with the transfer of access_token);
@@ -925,20 +1261,20 @@ class ApiVk:
                 By default: all.
             :param extended: True — additional profiles and groups fields containing information about users and
                 communities will be returned in the response. By default: False.
+            :param offset: The offset needed to select a specific subset of records (int)
             :return:
             """
 
             if owner_id is None:
                 return {'result': 'error', 'data': '"owner_id" is empty"'}
 
-            response = vk_session().post(
-                'wall.get',
-                params={
-                    'owner_id': owner_id,
-                    'count': count,
-                    'filter': filter_,
-                    'extended': 1 if extended else 0,
-                }).json()
+            response = yield 'wall.get', {
+                'owner_id': owner_id,
+                'count': count,
+                'offset': offset,
+                'filter': filter_,
+                'extended': 1 if extended else 0,
+            }
 
             if 'error' in response:
                 return {
@@ -948,6 +1284,7 @@ class ApiVk:
             else:
                 return {'result': 'success', 'data': response.get('response')}
 
+        @vk_method
         def get_by_ids(self, posts_ids: str | list | dict = None, extended: bool = False,
                        copy_history_depth: int = None) -> dict:
 
@@ -955,7 +1292,8 @@ class ApiVk:
             Getting posts by ids
             https://dev.vk.com/ru/method/wall.getById
             :param posts_ids: Comma-separated identifiers that represent the IDs of the wall owners and the IDs of the
-                wall entries themselves, which are underlined. Maximum of 100 IDs. Examples:
+                wall entries themselves, which are underlined. Repeated IDs are requested once, more than 100 IDs are
+                split into requests of 100 sent in parallel and the posts come back in the order of the IDs. Examples:
                 1) dict: {group_id/user_id: post_id, group_id2/user_id3: post_id2...}
                 2) list: [-123456_123456, 123456_123456... / (group_id/user_id)_(post_id)]
                 3) str: -123456_123456 / (group_id/user_id)_(post_id)
@@ -973,27 +1311,53 @@ class ApiVk:
             if posts_ids is None:
                 return {'result': 'error', 'data': '"posts_ids" is empty"'}
 
-            if isinstance(posts_ids, str):
-                posts_ids = [posts_ids]
-            elif isinstance(posts_ids, dict):
-                posts_ids = [f'{key}_{item}' for key, item in posts_ids.items()]
+            posts_ids = post_ids(posts_ids)
 
-            response = vk_session().post(
-                'wall.getById',
-                params={
-                    'posts': ','.join(posts_ids),
+            responses = yield [
+                ('wall.getById', {
+                    'posts': ','.join(chunk),
                     'extended': 1 if extended else 0,
                     'copy_history_depth': copy_history_depth
-                }).json()
+                })
+                for chunk in chunked(posts_ids, VK_MAX_POST_IDS)
+            ]
 
-            if 'error' in response:
-                return {
-                    'result': 'error',
-                    'data': f'Code: {response.get("error").get("error_code")}. {response.get("error").get("error_msg")}'
-                }
-            else:
-                return {'result': 'success', 'data': response.get('response')}
+            for response in responses:
+                if 'error' in response:
+                    return {
+                        'result': 'error',
+                        'data': f'Code: {response.get("error").get("error_code")}. {response.get("error").get("error_msg")}'
+                    }
 
+            data = merge_posts(posts_ids, [response.get('response') for response in responses])
+            return {'result': 'success', 'data': data}
+
+        def iter_by_ids(self, posts_ids, extended: bool = False, copy_history_depth: int = None,
+                        chunk_size: int = VK_MAX_POST_IDS * VK_PARALLEL_REQUESTS):
+
+            """
+            Iterates over the posts of a huge or lazy collection of IDs, reading `chunk_size` IDs at a time
+            :param posts_ids: Iterable of "owner_id_post_id" IDs, repeated IDs are skipped
+            :param extended: Like in get_by_ids, profiles and groups are dropped
+            :param copy_history_depth: Like in get_by_ids
+            :param chunk_size: IDs per get_by_ids call, which sends them as parallel requests of 100
+            :return: Generator of posts. Raises VkError if a request fails
+            """
+
+            seen = set()
+            for chunk in chunked(posts_ids, chunk_size):
+                chunk = [post_id for post_id in post_ids(chunk) if post_id not in seen]
+                seen.update(chunk)
+                if not chunk:
+                    continue
+
+                result = self.get_by_ids(posts_ids=chunk, extended=extended, copy_history_depth=copy_history_depth)
+                if result.get('result') != 'success':
+                    raise VkError(result.get('data'))
+                data = result.get('data')
+                yield from data.get('items', []) if isinstance(data, dict) else data
+
+        @vk_method
         def get_comment(self, owner_id: str = None, comment_id: str = None, extended: bool = False) -> dict:
 
             """
@@ -1011,13 +1375,11 @@ class ApiVk:
             elif comment_id is None:
                 return {'result': 'error', 'data': '"comment_id" is empty"'}
 
-            response = vk_session().post(
-                'wall.getComment',
-                params={
-                    'owner_id': owner_id,
-                    'comment_id': comment_id,
-                    'extended': 1 if extended else 0,
-                }).json()
+            response = yield 'wall.getComment', {
+                'owner_id': owner_id,
+                'comment_id': comment_id,
+                'extended': 1 if extended else 0,
+            }
 
             if 'error' in response:
                 return {
@@ -1027,9 +1389,10 @@ class ApiVk:
             else:
                 return {'result': 'success', 'data': response.get('response')}
 
+        @vk_method
         def get_comments(self, owner_id: str = None, post_id: str = None, need_likes: bool = False,
                          start_comment_id: str = None, count: int = 10, sort: str = None, preview_length: int = None,
-                         extended: bool = False, comment_id: str = None) -> dict:
+                         extended: bool = False, comment_id: str = None, offset: int = None) -> dict:
 
             """
             Getting comments in post
@@ -1047,6 +1410,7 @@ class ApiVk:
             :param extended: True — additional profiles and groups fields containing information about users and
                 communities will be returned in the response. By default: False.
             :param comment_id: Id of the comment whose branch you want to get.
+            :param offset: The offset needed to select a specific subset of comments (int)
             :return:
             """
 
@@ -1055,19 +1419,18 @@ class ApiVk:
             elif post_id is None:
                 return {'result': 'error', 'data': '"post_id" is empty"'}
 
-            response = vk_session().post(
-                'wall.getComments',
-                params={
-                    'owner_id': owner_id,
-                    'post_id': post_id,
-                    'need_likes': 1 if need_likes else 0,
-                    'start_comment_id': start_comment_id,
-                    'count': count,
-                    'sort': sort,
-                    'preview_length': preview_length,
-                    'comment_id': comment_id,
-                    'extended': 1 if extended else 0,
-                }).json()
+            response = yield 'wall.getComments', {
+                'owner_id': owner_id,
+                'post_id': post_id,
+                'need_likes': 1 if need_likes else 0,
+                'start_comment_id': start_comment_id,
+                'count': count,
+                'offset': offset,
+                'sort': sort,
+                'preview_length': preview_length,
+                'comment_id': comment_id,
+                'extended': 1 if extended else 0,
+            }
 
             if 'error' in response:
                 return {
@@ -1077,7 +1440,8 @@ class ApiVk:
             else:
                 return {'result': 'success', 'data': response.get('response')}
 
-        def get_reposts(self, owner_id: str = None, post_id: str = None, count: int = 10) -> dict:
+        @vk_method
+        def get_reposts(self, owner_id: str = None, post_id: str = None, count: int = 10, offset: int = None) -> dict:
 
             """
             Getting comments in post
@@ -1085,6 +1449,7 @@ class ApiVk:
             :param owner_id: REQUIRED. The ID of the user or community. The community ID must start with a "-" (str)
             :param post_id: REQUIRED. Post ID (str)
             :param count: The number of comments to receive. Default: 10, maximum value: 100.
+            :param offset: The offset needed to select a specific subset of reposts (int)
             :return:
             """
 
@@ -1093,13 +1458,12 @@ class ApiVk:
             elif post_id is None:
                 return {'result': 'error', 'data': '"post_id" is empty"'}
 
-            response = vk_session().post(
-                'wall.getReposts',
-                params={
-                    'owner_id': owner_id,
-                    'post_id': post_id,
-                    'count': count,
-                }).json()
+            response = yield 'wall.getReposts', {
+                'owner_id': owner_id,
+                'post_id': post_id,
+                'count': count,
+                'offset': offset,
+            }
 
             if 'error' in response:
                 return {
@@ -1109,6 +1473,83 @@ class ApiVk:
             else:
                 return {'result': 'success', 'data': response.get('response')}
 
+        def iter_posts(self, owner_id: str = None, filter_: str = 'all', extended: bool = False, page_size: int = 100,
+                       until: datetime = None, until_id: int = None, stop=None):
+
+            """
+            Iterates over the wall posts page by page (wall.get with offset), keeping one page in memory
+            :param owner_id: REQUIRED. The ID of the user or community. The community ID must start with a "-" (str)
+            :param filter_: Like in get
+            :param extended: Like in get
+            :param page_size: Posts per request, maximum 100
+            :param until: Stop at the first post published before this date (datetime)
+            :param until_id: Stop at the first post with id <= until_id, e.g. the last post seen by a previous run (int)
+            :param stop: Stop at the first post for which stop(post) is True
+            :return: Generator of posts. Raises VkError if a request fails
+            """
+
+            paginator = Paginator(page_size, until, until_id, stop)
+            while True:
+                result = self.get(owner_id=owner_id, count=page_size, filter_=filter_, extended=extended,
+                                  offset=paginator.offset)
+                items, last = paginator.page(result)
+                yield from items
+                if last:
+                    return
+
+        def iter_comments(self, owner_id: str = None, post_id: str = None, sort: str = 'desc', need_likes: bool = False,
+                          extended: bool = False, comment_id: str = None, page_size: int = 100, until: datetime = None,
+                          until_id: int = None, stop=None):
+
+            """
+            Iterates over the comments of a post page by page (wall.getComments with offset)
+            :param owner_id: REQUIRED. The ID of the user or community. The community ID must start with a "-" (str)
+            :param post_id: REQUIRED. Post ID (str)
+            :param sort: Like in get_comments, newest first ('desc') by default
+            :param need_likes: Like in get_comments
+            :param extended: Like in get_comments
+            :param comment_id: Like in get_comments
+            :param page_size: Comments per request, maximum 100
+            :param until: Only comments written since this date (datetime); with 'desc' the walk stops at the first
+                older one, with 'asc' older ones are skipped
+            :param until_id: Only comments with id > until_id (int), like `until`
+            :param stop: Stop at the first comment for which stop(comment) is True
+            :return: Generator of comments. Raises VkError if a request fails
+            """
+
+            paginator = Paginator(page_size, until, until_id, stop, ascending=sort == 'asc')
+            while True:
+                result = self.get_comments(owner_id=owner_id, post_id=post_id, need_likes=need_likes, count=page_size,
+                                           sort=sort, extended=extended, comment_id=comment_id,
+                                           offset=paginator.offset)
+                items, last = paginator.page(result)
+                yield from items
+                if last:
+                    return
+
+        def iter_reposts(self, owner_id: str = None, post_id: str = None, page_size: int = 100,
+                         until: datetime = None, until_id: int = None, stop=None):
+
+            """
+            Iterates over the reposts of a post page by page (wall.getReposts with offset)
+            :param owner_id: REQUIRED. The ID of the user or community. The community ID must start with a "-" (str)
+            :param post_id: REQUIRED. Post ID (str)
+            :param page_size: Reposts per request, maximum 100
+            :param until: Stop at the first repost made before this date (datetime)
+            :param until_id: Stop at the first repost with id <= until_id (int)
+            :param stop: Stop at the first repost for which stop(repost) is True
+            :return: Generator of reposts. Raises VkError if a request fails
+            """
+
+            paginator = Paginator(page_size, until, until_id, stop)
+            while True:
+                result = self.get_reposts(owner_id=owner_id, post_id=post_id, count=page_size, offset=paginator.offset)
+                items, last = paginator.page(result)
+                yield from items
+                if last:
+                    return
+
+        @vk_method
         def parse_attached_link(self, links: str | list = None, extended: bool = False, name_case: str = None,) -> dict:
 
             """
@@ -1135,13 +1576,11 @@ class ApiVk:
             if isinstance(links, str):
                 links = [links]
 
-            response = vk_session().post(
-                'wall.getReposts',
-                params={
-                    'links': links,
-                    'extended': extended,
-                    'name_case': name_case,
-                }).json()
+            response = yield 'wall.parseAttachedLink', {
+                'links': links,
+                'extended': extended,
+                'name_case': name_case,
+            }
 
             if 'error' in response:
                 return {
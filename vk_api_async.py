@@ -0,0 +1,387 @@
+
+from functools import lru_cache, wraps
+
+import aiohttp
+import asyncio
+import json
+import os
+import dotenv
+
+from loguru import logger
+from datetime import datetime
+from vk_api import (ApiVk, Credentials, Paginator, VkError, VK_API_URL, VK_AUTH_CODES, VK_TOKEN_TYPE_CODES,
+                    VK_MAX_POST_IDS, VK_PARALLEL_REQUESTS, vk_cache, vk_limiter, vk_token_pool, vk_error_code,
+                    vk_limit_families, vk_retryable, method_family, chunked, post_ids)
+
+dotenv.load_dotenv()
+
+VK_POOL_LIMIT = int(os.getenv('VK_POOL_LIMIT', 100))
+VK_POOL_LIMIT_PER_HOST = int(os.getenv('VK_POOL_LIMIT_PER_HOST', 30))
+VK_KEEPALIVE_TIMEOUT = float(os.getenv('VK_KEEPALIVE_TIMEOUT', 30))
+VK_REQUEST_TIMEOUT = float(os.getenv('VK_REQUEST_TIMEOUT', 30))
+VK_EXECUTE_LIMIT = 25
+VK_BATCH_WINDOW_MS = float(os.getenv('VK_BATCH_WINDOW_MS', 20))
+
+
+@lru_cache
+def async_vk_session():
+    return AsyncVkSession()
+
+
+def encode_params(params: dict) -> list[tuple[str, str]]:
+
+    """
+    Encodes params the way requests does for VkSession: None values are dropped, lists become repeated keys and
+    everything else is sent as str()
+    """
+
+    encoded = []
+    for key, value in params.items():
+        if value is None:
+            continue
+        for item in value if isinstance(value, (list, tuple)) else [value]:
+            encoded.append((key, str(item)))
+    return encoded
+
+
+def execute_code(calls: list[tuple[str, dict]]) -> str:
+
+    """
+    Compiles API calls into one VKScript program for the `execute` method, returning the results as an array
+    """
+
+    return 'return [' + ','.join(
+        f'API.{method}({json.dumps(execute_args(params), ensure_ascii=False)})' for method, params in calls
+    ) + '];'
+
+
+def execute_args(params: dict) -> dict:
+    return {
+        key: ','.join(map(str, value)) if isinstance(value, (list, tuple)) else str(value)
+        for key, value in params.items() if value is not None
+    }
+
+
+def split_execute_response(response: dict, count: int) -> list[dict]:
+
+    """
+    Splits an `execute` response into one response per call. A failed call returns false in the results array and
+    its error comes, in order, in execute_errors. If the execute call itself failed every call gets its error.
+    """
+
+    if 'error' in response:
+        return [response] * count
+
+    errors = iter(response.get('execute_errors') or [])
+    results = []
+    for value in response.get('response') or [False] * count:
+        error = next(errors, None) if value is False else None
+        results.append({'error': error} if error else {'response': value})
+    return results
+
+
+async def run_async(generator, session):
+    try:
+        request = next(generator)
+        while True:
+            if isinstance(request, list):
+                request = generator.send(await run_parallel(request, session))
+            else:
+                method, params = request
+                request = generator.send(await send_async(method, params, session))
+    except StopIteration as e:
+        return e.value
+
+
+async def send_async(method: str, params: dict, session) -> dict:
+    return await vk_cache.fetch_async(method, params, lambda: session.post(method, params=params))
+
+
+async def run_parallel(calls: list[tuple[str, dict]], session) -> list[dict]:
+    semaphore = asyncio.Semaphore(VK_PARALLEL_REQUESTS)
+
+    async def post(method, params):
+        async with semaphore:
+            return await send_async(method, params, session)
+
+    return await asyncio.gather(*(post(method, params) for method, params in calls))
+
+
+def async_vk_method(method):
+    generator = method.generator
+
+    @wraps(generator)
+    async def wrapper(self, *args, **kwargs):
+        return await run_async(generator(self, *args, **kwargs), self.session)
+
+    return wrapper
+
+
+async def paginate(fetch, paginator: Paginator, prefetch: bool = True):
+
+    """
+    Async counterpart of the ApiVk.Wall iterators: `fetch(offset)` returns the coroutine of one page. With `prefetch`
+    the next page is requested while the caller is still consuming the current one.
+    """
+
+    next_page = None
+    try:
+        result = await fetch(paginator.offset)
+        while True:
+            items, last = paginator.page(result)
+            if not last and prefetch:
+                next_page = asyncio.create_task(fetch(paginator.offset))
+
+            for item in items:
+                yield item
+            if last:
+                return
+
+            if next_page is not None:
+                result, next_page = await next_page, None
+            else:
+                result = await fetch(paginator.offset)
+    finally:
+        if next_page is not None:
+            next_page.cancel()
+
+
+class AsyncVkSession:
+
+    """
+    aiohttp counterpart of VkSession: one keep-alive connection pool shared by every call, with the same token pool,
+    rate limiting and retries (vk_token_pool and vk_limiter are shared with the blocking session).
+    :param limit: maximum number of open connections
+    :param limit_per_host: maximum number of open connections to the API host
+    :param keepalive_timeout: seconds an idle connection is kept open
+    :param timeout: total timeout of one request in seconds
+    """
+
+    def __init__(self, limit: int = VK_POOL_LIMIT, limit_per_host: int = VK_POOL_LIMIT_PER_HOST,
+                 keepalive_timeout: float = VK_KEEPALIVE_TIMEOUT, timeout: float = VK_REQUEST_TIMEOUT):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+
+        self._credentials = Credentials()
+        self._tokens = vk_token_pool()
+        self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.limit,
+                    limit_per_host=self.limit_per_host,
+                    keepalive_timeout=self.keepalive_timeout
+                ),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    async def post(self, method: str, params: dict = None, data: dict = None, token: str = None) -> dict:
+        params = (params or {}) | self._credentials.params
+        family = method_family(method)
+        attempt = 0
+
+        while True:
+            current = token or self._tokens.acquire(method)
+
+            try:
+                for bucket in vk_limit_families(family):
+                    await vk_limiter.wait_async(current, bucket)
+                request_params = encode_params(params | {'access_token': current})
+                async with self.session.post(VK_API_URL + method, params=request_params, data=data) as response:
+                    result = await response.json(content_type=None)
+            finally:
+                if token is None:
+                    self._tokens.release(current)
+
+            code = vk_error_code(result)
+            if code in VK_AUTH_CODES and self._tokens.quarantine(current, code) and token is None:
+                continue
+            if code in VK_TOKEN_TYPE_CODES:
+                logger.error(f'VK error {code} on {method}: not available with a {self._tokens.types[current]} token '
+                             f'(VK_TOKEN_TYPES)')
+
+            delay = vk_limiter.retry_delay(attempt) if vk_retryable(method, code) else None
+            if delay is None:
+                return result
+
+            logger.warning(f'VK error {code} on {method}, retry {attempt + 1} in {delay:.2f}s')
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+            logger.info('Async VK session closed')
+
+
+class BatchingVkSession:
+
+    """
+    Drop-in replacement for AsyncVkSession that collects the calls made within `window_ms` and sends them as one
+    `execute` request of up to 25 calls; every caller gets its own response (or error) back. Calls with `data` or a
+    pinned `token` (uploads, group-token methods) cannot go into `execute` and are sent on their own; `session` is the
+    aiohttp pool of the wrapped AsyncVkSession, for raw requests like the long poll and the upload servers.
+    Use it for bulk jobs: AsyncApiVk(session=BatchingVkSession()).
+    :param session: AsyncVkSession that sends the requests (the shared async_vk_session() by default)
+    :param window_ms: how long to wait for more calls before sending a batch
+    :param max_calls: calls per execute request (VK allows up to 25)
+    """
+
+    def __init__(self, session: AsyncVkSession = None, window_ms: float = VK_BATCH_WINDOW_MS,
+                 max_calls: int = VK_EXECUTE_LIMIT):
+        self.vk_session = session or async_vk_session()
+        self.window = window_ms / 1000
+        self.max_calls = min(max_calls, VK_EXECUTE_LIMIT)
+
+        self._pending: list[tuple[str, dict, asyncio.Future]] = []
+        self._timer = None
+        self._tasks = set()
+
+        self.calls = 0
+        self.requests = 0
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        return self.vk_session.session
+
+    async def post(self, method: str, params: dict = None, data: dict = None, token: str = None) -> dict:
+        if data is not None or token is not None:
+            self.calls += 1
+            self.requests += 1
+            return await self.vk_session.post(method, params, data=data, token=token)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((method, params or {}, future))
+        self.calls += 1
+
+        if len(self._pending) >= self.max_calls:
+            self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self.flush)
+
+        return await future
+
+    def flush(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._pending:
+            batch, self._pending = self._pending[:self.max_calls], self._pending[self.max_calls:]
+            task = asyncio.create_task(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: list[tuple[str, dict, asyncio.Future]]):
+        self.requests += 1
+
+        try:
+            if len(batch) == 1:
+                method, params, _ = batch[0]
+                results = [await self.vk_session.post(method, params)]
+            else:
+                code = execute_code([(method, params) for method, params, _ in batch])
+                response = await self.vk_session.post('execute', data={'code': code})
+                results = split_execute_response(response, len(batch))
+
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def close(self):
+        self.flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        logger.info(f'Batching VK session closed. Stats: {self.stats}')
+
+    @property
+    def stats(self) -> dict:
+        return {'calls': self.calls, 'requests': self.requests}
+
+
+class AsyncApiVk:
+
+    """
+    Async version of ApiVk with the same methods; every call is a coroutine sharing the pool of `session`.
+    :param token: Permanent or temporary application token
+    :param session: AsyncVkSession to use (the shared async_vk_session() by default)
+    """
+
+    def __init__(self, token=None, session: AsyncVkSession = None):
+        self.token = token
+        self.session = session or async_vk_session()
+
+    def wall(self):
+        return AsyncApiVk.Wall(self.session)
+
+    add = async_vk_method(ApiVk.add)
+
+    class Wall(ApiVk.Wall):
+
+        def __init__(self, session: AsyncVkSession = None):
+            self.session = session or async_vk_session()
+
+        def iter_posts(self, owner_id: str = None, filter_: str = 'all', extended: bool = False, page_size: int = 100,
+                       until: datetime = None, until_id: int = None, stop=None, prefetch: bool = True):
+            return paginate(
+                lambda offset: self.get(owner_id=owner_id, count=page_size, filter_=filter_, extended=extended,
+                                        offset=offset),
+                Paginator(page_size, until, until_id, stop), prefetch
+            )
+
+        def iter_comments(self, owner_id: str = None, post_id: str = None, sort: str = 'desc', need_likes: bool = False,
+                          extended: bool = False, comment_id: str = None, page_size: int = 100, until: datetime = None,
+                          until_id: int = None, stop=None, prefetch: bool = True):
+            return paginate(
+                lambda offset: self.get_comments(owner_id=owner_id, post_id=post_id, need_likes=need_likes,
+                                                 count=page_size, sort=sort, extended=extended, comment_id=comment_id,
+                                                 offset=offset),
+                Paginator(page_size, until, until_id, stop, ascending=sort == 'asc'), prefetch
+            )
+
+        def iter_reposts(self, owner_id: str = None, post_id: str = None, page_size: int = 100,
+                         until: datetime = None, until_id: int = None, stop=None, prefetch: bool = True):
+            return paginate(
+                lambda offset: self.get_reposts(owner_id=owner_id, post_id=post_id, count=page_size, offset=offset),
+                Paginator(page_size, until, until_id, stop), prefetch
+            )
+
+        async def iter_by_ids(self, posts_ids, extended: bool = False, copy_history_depth: int = None,
+                              chunk_size: int = VK_MAX_POST_IDS * VK_PARALLEL_REQUESTS):
+            seen = set()
+            for chunk in chunked(posts_ids, chunk_size):
+                chunk = [post_id for post_id in post_ids(chunk) if post_id not in seen]
+                seen.update(chunk)
+                if not chunk:
+                    continue
+
+                result = await self.get_by_ids(posts_ids=chunk, extended=extended,
+                                               copy_history_depth=copy_history_depth)
+                if result.get('result') != 'success':
+                    raise VkError(result.get('data'))
+                data = result.get('data')
+                for post in data.get('items', []) if isinstance(data, dict) else data:
+                    yield post
+
+
+for name, member in list(vars(ApiVk.Wall).items()):
+    if hasattr(member, 'generator'):
+        setattr(AsyncApiVk.Wall, name, async_vk_method(member))
+
+
+__all__ = ['AsyncApiVk', 'AsyncVkSession', 'BatchingVkSession', 'async_vk_session', 'encode_params', 'execute_code',
+           'paginate', 'split_execute_response']
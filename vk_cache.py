@@ -0,0 +1,217 @@
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+# seconds a successful response of a read method is kept
+DEFAULT_TTLS = {
+    'wall.get': 60,
+    'wall.getById': 60,
+    'wall.getComment': 60,
+    'wall.parseAttachedLink': 3600,
+}
+
+POST_WRITES = {'wall.edit', 'wall.delete', 'wall.restore', 'wall.pin', 'wall.unpin'}
+COMMENT_WRITES = {'wall.editComment', 'wall.deleteComment', 'wall.restoreComment'}
+
+
+def cache_key(method: str, params: dict) -> tuple:
+    return method, tuple(sorted(
+        (key, ','.join(map(str, value)) if isinstance(value, (list, tuple)) else str(value))
+        for key, value in params.items() if value is not None
+    ))
+
+
+def cache_tags(method: str, params: dict) -> set[tuple]:
+
+    """
+    What a request reads or changes: ('wall', owner_id), ('post', owner_id_post_id) or
+    ('comment', owner_id, comment_id). A write invalidates every cached read sharing a tag with it.
+    """
+
+    owner_id = str(params.get('owner_id'))
+
+    if method in ('wall.get', 'wall.post'):
+        return {('wall', owner_id)}
+    elif method == 'wall.getById':
+        return {('post', post_id) for post_id in str(params.get('posts', '')).split(',')}
+    elif method in POST_WRITES:
+        return {('wall', owner_id), ('post', f'{owner_id}_{params.get("post_id")}')}
+    elif method == 'wall.getComment' or method in COMMENT_WRITES:
+        return {('comment', owner_id, str(params.get('comment_id')))}
+    return set()
+
+
+class ResponseCache:
+
+    """
+    Opt-in TTL + LRU cache of VK responses, keyed on the method and its params. Only the methods of `ttls` are
+    cached and only successful responses are stored. Concurrent identical requests (threads or tasks) share one
+    request to VK. Successful writes (wall.post, wall.edit, wall.delete, wall.editComment...) drop the cached reads of
+    the same wall, post or comment.
+    :param max_size: maximum number of cached responses, 0 turns the cache off
+    :param ttls: seconds to keep the response, by VK method
+    """
+
+    def __init__(self, max_size: int = 0, ttls: dict[str, float] = None):
+        self.max_size = max_size
+        self.ttls = DEFAULT_TTLS | (ttls or {})
+
+        self._entries: OrderedDict[tuple, tuple[float, dict, set]] = OrderedDict()
+        self._tags: dict[tuple, set[tuple]] = {}
+        self._flights: dict[tuple, Future] = {}
+        self._async_flights: dict[tuple, asyncio.Future] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.invalidated = 0
+
+    def cacheable(self, method: str) -> bool:
+        return self.max_size > 0 and method in self.ttls
+
+    def get(self, key: tuple) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: tuple, response: dict, tags: set[tuple]):
+        if 'error' in response:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttls[key[0]], response, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: tuple):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def invalidate(self, method: str, params: dict):
+        with self._lock:
+            keys = set().union(*(self._tags.get(tag, set()) for tag in cache_tags(method, params)))
+            for key in keys:
+                self._remove(key)
+            self.invalidated += len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def fetch(self, method: str, params: dict, send) -> dict:
+
+        """
+        Returns the cached response of the request or the one of send(), called once however many threads ask
+        for the same request at the same time
+        """
+
+        if not self.cacheable(method):
+            return self._after_write(method, params, send())
+
+        key = cache_key(method, params)
+        response = self.get(key)
+        if response is not None:
+            return response
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Future()
+                self.misses += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            return flight.result()
+
+        try:
+            response = send()
+            self.set(key, response, cache_tags(method, params))
+            flight.set_result(response)
+            return response
+        except Exception as e:
+            flight.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+
+    async def fetch_async(self, method: str, params: dict, send) -> dict:
+
+        """
+        fetch for coroutines: `send` is a coroutine function
+        """
+
+        if not self.cacheable(method):
+            return self._after_write(method, params, await send())
+
+        key = cache_key(method, params)
+        response = self.get(key)
+        if response is not None:
+            return response
+
+        flight = self._async_flights.get(key)
+        if flight is not None:
+            self.shared += 1
+            return await asyncio.shield(flight)
+
+        flight = self._async_flights[key] = asyncio.get_running_loop().create_future()
+        self.misses += 1
+        try:
+            response = await send()
+            self.set(key, response, cache_tags(method, params))
+            flight.set_result(response)
+            return response
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except Exception as e:
+            flight.set_exception(e)
+            flight.exception()
+            raise
+        finally:
+            self._async_flights.pop(key, None)
+
+    def _after_write(self, method: str, params: dict, response: dict) -> dict:
+        if self._entries and method not in self.ttls and 'error' not in response and cache_tags(method, params):
+            self.invalidate(method, params)
+        return response
+
+    @property
+    def stats(self) -> dict:
+        requests = self.hits + self.misses + self.shared
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'shared': self.shared,
+            'invalidated': self.invalidated,
+            'hit_rate': round((self.hits + self.shared) / requests, 3) if requests else 0.0,
+        }
+
+
+__all__ = ['ResponseCache', 'cache_key', 'cache_tags']
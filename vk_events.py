@@ -0,0 +1,266 @@
+
+import asyncio
+import json
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import aiohttp
+import dotenv
+from aiohttp import web
+from loguru import logger
+
+from vk_api_async import AsyncVkSession, async_vk_session
+
+dotenv.load_dotenv()
+
+VK_LONGPOLL_WAIT = int(os.getenv('VK_LONGPOLL_WAIT', 25))
+VK_LONGPOLL_STATE = os.getenv('VK_LONGPOLL_STATE', 'vk_longpoll.json')
+VK_CALLBACK_CONFIRMATION = os.getenv('VK_CALLBACK_CONFIRMATION', '')
+VK_CALLBACK_SECRET = os.getenv('VK_CALLBACK_SECRET', '')
+VK_EVENT_QUEUE_SIZE = int(os.getenv('VK_EVENT_QUEUE_SIZE', 10000))
+
+WALL_EVENTS = {'wall_post_new', 'wall_repost', 'wall_reply_new', 'wall_reply_edit', 'wall_reply_restore',
+               'wall_reply_delete'}
+
+
+@dataclass(frozen=True)
+class VkEvent:
+
+    """
+    One Bots Long Poll / Callback API event, e.g. type='wall_reply_new' with the comment in `object`
+    """
+
+    type: str
+    group_id: int
+    event_id: str = ''
+    object: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_update(cls, update: dict) -> 'VkEvent':
+        return cls(
+            type=update.get('type', ''),
+            group_id=update.get('group_id', 0),
+            event_id=update.get('event_id', ''),
+            object=update.get('object') or {},
+        )
+
+
+class LongPollState:
+
+    """
+    `ts` of every group saved in a JSON file, so a restarted consumer continues from the last handled event
+    """
+
+    def __init__(self, path: str = VK_LONGPOLL_STATE):
+        self.path = Path(path)
+
+    def load(self, group_id: int) -> str | None:
+        if not self.path.exists():
+            return None
+        return json.loads(self.path.read_text()).get(str(group_id))
+
+    def save(self, group_id: int, ts: str):
+        state = json.loads(self.path.read_text()) if self.path.exists() else {}
+        state[str(group_id)] = ts
+        self.path.write_text(json.dumps(state))
+
+
+class LongPollConsumer:
+
+    """
+    Bots Long Poll consumer: asks groups.getLongPollServer for a server and puts every event it returns into `queue`
+    as VkEvent. A lost key or ts (failed 1, 2, 3) and network errors are recovered by reconnecting with backoff.
+    `ts` is saved once the events of an answer are acknowledged: call queue.task_done() for every handled event
+    (`async for event in consumer` does it when the next event is asked for), so a crash replays unhandled events
+    instead of skipping them.
+    groups.getLongPollServer needs a group token (GROUP_TOKENS_VK).
+    :param group_id: Community id (without "-")
+    :param queue: asyncio.Queue the events go to (a new one by default)
+    :param session: AsyncVkSession for groups.getLongPollServer (the shared async_vk_session() by default)
+    :param wait: seconds the server holds a request waiting for events, maximum 90
+    :param state_path: JSON file `ts` is saved to, None to always start from the current events
+    """
+
+    def __init__(self, group_id: int, queue: asyncio.Queue = None, session: AsyncVkSession = None,
+                 wait: int = VK_LONGPOLL_WAIT, state_path: str | None = VK_LONGPOLL_STATE):
+        self.group_id = int(str(group_id).lstrip('-'))
+        self.queue = queue or asyncio.Queue(VK_EVENT_QUEUE_SIZE)
+        self.session = session or async_vk_session()
+        self.wait = wait
+        self.state = LongPollState(state_path) if state_path else None
+
+        self.server = None
+        self.key = None
+        self.ts = None
+        self._resumed = False
+        self._task = None
+
+        self.polls = 0
+        self.events = 0
+        self.reconnects = 0
+
+    async def connect(self):
+        response = await self.session.post('groups.getLongPollServer', params={'group_id': self.group_id})
+        if 'error' in response:
+            raise ConnectionError(f'Code: {response["error"].get("error_code")}. {response["error"].get("error_msg")}')
+
+        server = response['response']
+        self.server, self.key = server['server'], server['key']
+        if self.ts is None:
+            saved = self.state.load(self.group_id) if self.state and not self._resumed else None
+            self.ts = saved or server['ts']
+        self._resumed = True
+
+    async def poll(self) -> list[VkEvent] | None:
+
+        """
+        One long poll request: returns the events that came after `ts` (possibly none) and moves `ts` on, or None
+        when the key or the history expired (failed 2, 3) and the server has to be asked again.
+        The saved `ts` is only used by the first connect; after failed 3 the server's current one is taken.
+        """
+
+        params = {'act': 'a_check', 'key': self.key, 'ts': self.ts, 'wait': self.wait}
+        async with self.session.session.get(self.server, params=params,
+                                            timeout=aiohttp.ClientTimeout(total=self.wait + 10)) as response:
+            answer = await response.json(content_type=None)
+        self.polls += 1
+
+        failed = answer.get('failed')
+        if failed == 1:
+            self.ts = answer['ts']
+        elif failed:
+            if failed == 3:
+                self.ts = None
+            self.server = None
+            self.reconnects += 1
+            return None
+
+        events = [VkEvent.from_update(update) for update in answer.get('updates', [])]
+        self.ts = answer.get('ts', self.ts)
+        return events
+
+    async def _run(self):
+        delay = 1
+        while True:
+            try:
+                if self.server is None:
+                    await self.connect()
+
+                events = await self.poll()
+                if events is None:
+                    logger.warning(f'VK long poll of group {self.group_id} expired, reconnect in {delay}s')
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 60)
+                    continue
+
+                for event in events:
+                    await self.queue.put(event)
+                    self.events += 1
+                if self.state:
+                    if events:
+                        await self.queue.join()
+                    self.state.save(self.group_id, self.ts)
+                delay = 1
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f'VK long poll of group {self.group_id} failed, reconnect in {delay}s: {e}')
+                self.server = None
+                self.reconnects += 1
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        logger.info(f'VK long poll of group {self.group_id} started')
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        logger.info(f'VK long poll of group {self.group_id} stopped. Stats: {self.stats}')
+
+    async def __aiter__(self):
+        while True:
+            event = await self.queue.get()
+            try:
+                yield event
+            finally:
+                self.queue.task_done()
+
+    @property
+    def stats(self) -> dict:
+        return {'polls': self.polls, 'events': self.events, 'reconnects': self.reconnects,
+                'queue_depth': self.queue.qsize()}
+
+
+class CallbackReceiver:
+
+    """
+    Callback API receiver: an aiohttp handler that answers VK's confirmation request, checks the secret key and puts
+    the events into `queue` as VkEvent. VK re-sends an event until it gets "ok", so repeated event_ids are skipped
+    (events without an event_id are always passed on).
+    Mount it with receiver.app() or app.router.add_post(path, receiver.handle).
+    :param queue: asyncio.Queue the events go to (a new one by default)
+    :param confirmation: string VK expects in answer to the confirmation event
+    :param secret: secret key set in the community Callback API settings
+    :param remember: how many recent event_ids are kept to skip repeats
+    """
+
+    def __init__(self, queue: asyncio.Queue = None, confirmation: str = VK_CALLBACK_CONFIRMATION,
+                 secret: str = VK_CALLBACK_SECRET, remember: int = 1000):
+        self.queue = queue or asyncio.Queue(VK_EVENT_QUEUE_SIZE)
+        self.confirmation = confirmation
+        self.secret = secret
+        self.remember = remember
+
+        self._seen: dict[str, None] = {}
+
+        self.events = 0
+        self.duplicates = 0
+        self.rejected = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        try:
+            update = await request.json()
+        except ValueError:
+            self.rejected += 1
+            return web.Response(status=400, text='bad request')
+
+        if self.secret and update.get('secret') != self.secret:
+            self.rejected += 1
+            return web.Response(status=403, text='forbidden')
+
+        if update.get('type') == 'confirmation':
+            return web.Response(text=self.confirmation)
+
+        event = VkEvent.from_update(update)
+        if event.event_id:
+            if event.event_id in self._seen:
+                self.duplicates += 1
+                return web.Response(text='ok')
+
+            self._seen[event.event_id] = None
+            if len(self._seen) > self.remember:
+                del self._seen[next(iter(self._seen))]
+
+        await self.queue.put(event)
+        self.events += 1
+        return web.Response(text='ok')
+
+    def app(self, path: str = '/vk/callback') -> web.Application:
+        app = web.Application()
+        app.router.add_post(path, self.handle)
+        return app
+
+    @property
+    def stats(self) -> dict:
+        return {'events': self.events, 'duplicates': self.duplicates, 'rejected': self.rejected,
+                'queue_depth': self.queue.qsize()}
+
+
+__all__ = ['VkEvent', 'LongPollState', 'LongPollConsumer', 'CallbackReceiver', 'WALL_EVENTS']
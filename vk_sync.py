@@ -0,0 +1,157 @@
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from datetime import datetime
+
+import dotenv
+from loguru import logger
+
+from vk_api import ApiVk
+
+dotenv.load_dotenv()
+
+VK_SYNC_DB = os.getenv('VK_SYNC_DB', 'vk_sync.sqlite3')
+# how long published posts are re-checked for edits and deletions
+VK_SYNC_RECHECK_HOURS = float(os.getenv('VK_SYNC_RECHECK_HOURS', 24))
+VK_SYNC_INTERVAL = float(os.getenv('VK_SYNC_INTERVAL', 60))
+
+SYNC_SCHEMA = """
+create table if not exists cursors (
+    owner_id text primary key,
+    last_id integer not null,
+    last_date integer not null
+);
+create table if not exists posts (
+    owner_id text not null,
+    post_id integer not null,
+    date integer not null,
+    hash text not null,
+    primary key (owner_id, post_id)
+);
+create index if not exists posts_date on posts (owner_id, date);
+"""
+
+
+@dataclass(frozen=True)
+class WallEvent:
+    kind: str  # created, edited or deleted
+    owner_id: str
+    post_id: int
+    post: dict | None = None
+
+
+def post_hash(post: dict) -> str:
+    content = {key: post.get(key) for key in ('text', 'attachments', 'copy_history', 'edited', 'is_pinned')}
+    return hashlib.sha1(json.dumps(content, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+class WallSync:
+
+    """
+    Incremental sync of VK walls. The newest seen post of every wall is kept in a SQLite file, so a sync downloads
+    only the posts published since the previous one; the posts of the last `recheck_window` seconds are re-read
+    with get_by_ids to notice edits and deletions. The first sync of a wall reads the posts of that window only.
+    :param path: SQLite file
+    :param recheck_window: seconds during which published posts are checked for edits and deletions
+    :param wall: ApiVk.Wall to read with
+    """
+
+    def __init__(self, path: str = VK_SYNC_DB, recheck_window: float = VK_SYNC_RECHECK_HOURS * 3600,
+                 wall: ApiVk.Wall = None):
+        self.recheck_window = recheck_window
+        self.wall = wall or ApiVk().Wall()
+
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SYNC_SCHEMA)
+
+    def cursor(self, owner_id: str) -> tuple[int, int] | None:
+        return self.db.execute('select last_id, last_date from cursors where owner_id = ?', (owner_id,)).fetchone()
+
+    def sync(self, owner_id: str):
+
+        """
+        Syncs one wall
+        :param owner_id: The ID of the user or community. The community ID must start with a "-" (str)
+        :return: Generator of WallEvent: created for new posts (oldest first), edited and deleted for the posts of
+            the re-check window. The cursor is saved once the generator is exhausted.
+        """
+
+        owner_id = str(owner_id)
+        since = int(time.time() - self.recheck_window)
+        cursor = self.cursor(owner_id)
+        last_id, last_date = cursor or (0, since)
+
+        # no post seen yet (first sync, or none in the window then): read by date, until_id=0 would walk the whole wall
+        if last_id:
+            new_posts = self.wall.iter_posts(owner_id=owner_id, until_id=last_id)
+        else:
+            new_posts = self.wall.iter_posts(owner_id=owner_id, until=datetime.fromtimestamp(last_date))
+        new_posts = [post for post in new_posts if post['id'] > last_id]
+
+        known = dict(self.db.execute(
+            'select post_id, hash from posts where owner_id = ? and date >= ?', (owner_id, since)
+        ).fetchall())
+        new_ids = {post['id'] for post in new_posts}
+        recheck = [post_id for post_id in known if post_id not in new_ids]
+
+        events = []
+        for post in sorted(new_posts, key=lambda post_: post_['id']):
+            events.append(WallEvent('created', owner_id, post['id'], post))
+
+        found = set()
+        for post in self.wall.iter_by_ids(f'{owner_id}_{post_id}' for post_id in recheck):
+            found.add(post['id'])
+            if post_hash(post) != known[post['id']]:
+                events.append(WallEvent('edited', owner_id, post['id'], post))
+
+        events.extend(WallEvent('deleted', owner_id, post_id) for post_id in recheck if post_id not in found)
+
+        for event in events:
+            yield event
+
+        self.save(owner_id, events, since, max([last_id, *new_ids]),
+                  max([last_date, *(post['date'] for post in new_posts)]))
+
+    def save(self, owner_id: str, events: list[WallEvent], since: int, last_id: int, last_date: int):
+        with self.db:
+            for event in events:
+                if event.kind == 'deleted':
+                    self.db.execute('delete from posts where owner_id = ? and post_id = ?', (owner_id, event.post_id))
+                else:
+                    self.db.execute(
+                        'insert or replace into posts (owner_id, post_id, date, hash) values (?, ?, ?, ?)',
+                        (owner_id, event.post_id, event.post['date'], post_hash(event.post))
+                    )
+            self.db.execute('delete from posts where owner_id = ? and date < ?', (owner_id, since))
+            self.db.execute(
+                'insert or replace into cursors (owner_id, last_id, last_date) values (?, ?, ?)',
+                (owner_id, last_id, last_date)
+            )
+
+        if events:
+            logger.info(f'Wall {owner_id} synced: {len(events)} changes, last post {last_id}')
+
+    def watch(self, owner_ids: list[str], interval: float = VK_SYNC_INTERVAL):
+
+        """
+        Syncs the walls every `interval` seconds forever, yielding their events
+        """
+
+        while True:
+            started = time.monotonic()
+            for owner_id in owner_ids:
+                try:
+                    yield from self.sync(owner_id)
+                except Exception as e:
+                    logger.error(f'Wall {owner_id} sync failed: {e}')
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+    def close(self):
+        self.db.close()
+
+
+__all__ = ['WallEvent', 'WallSync', 'post_hash']
@@ -0,0 +1,284 @@
+
+import asyncio
+import mimetypes
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+
+import aiohttp
+import dotenv
+import requests
+from loguru import logger
+from requests_toolbelt import MultipartEncoder
+
+from vk_api import ApiVk, vk_session, vk_token_pool
+from vk_api_async import AsyncApiVk, AsyncVkSession, async_vk_session
+
+dotenv.load_dotenv()
+
+VK_UPLOAD_CONCURRENCY = int(os.getenv('VK_UPLOAD_CONCURRENCY', 4))
+VK_UPLOAD_TIMEOUT = float(os.getenv('VK_UPLOAD_TIMEOUT', 120))
+# seconds an upload server URL is reused for the token it was issued to
+VK_UPLOAD_URL_TTL = float(os.getenv('VK_UPLOAD_URL_TTL', 600))
+
+
+@lru_cache
+def upload_session():
+
+    """
+    Plain pooled session for the upload servers: VkSession would add the access token to a foreign URL
+    """
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=VK_UPLOAD_CONCURRENCY, pool_maxsize=VK_UPLOAD_CONCURRENCY)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+@dataclass
+class UploadResult:
+    path: str
+    size: int = 0
+    seconds: float = 0.0
+    attachment: dict | None = None  # {'owner': owner_id, 'media': photo_id}, ready for Wall.post(photos=...)
+    error: str | None = None
+
+    @property
+    def throughput(self) -> float:
+
+        """
+        Megabytes per second of the whole upload (upload server + saveWallPhoto)
+        """
+
+        return self.size / 2 ** 20 / self.seconds if self.seconds else 0.0
+
+
+def vk_error(response: dict) -> str:
+    return f'Code: {response.get("error").get("error_code")}. {response.get("error").get("error_msg")}'
+
+
+def file_field(path: str, file) -> tuple:
+    return Path(path).name, file, mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+
+def log_results(results: list[UploadResult], seconds: float):
+    size = sum(result.size for result in results if result.attachment)
+    failed = sum(1 for result in results if result.error)
+    logger.info(f'Uploaded {len(results) - failed}/{len(results)} photos, {size / 2 ** 20:.1f} MiB in {seconds:.2f}s '
+                f'({size / 2 ** 20 / seconds if seconds else 0:.1f} MiB/s)')
+
+
+class PhotoUploader:
+
+    """
+    Wall photo upload pipeline: photos.getWallUploadServer -> multipart upload -> photos.saveWallPhoto.
+    Files are streamed from disk (MultipartEncoder), `concurrency` of them at a time; every file gets an
+    UploadResult with its attachment (or error) and timing.
+    Each file takes one user token of the pool for the whole sequence, as VK only saves a photo for the token its
+    upload server was issued to; upload server URLs are cached per token for `url_ttl` seconds.
+    :param group_id: Community id the photos are uploaded for (without "-")
+    :param concurrency: files uploaded at the same time
+    :param url_ttl: seconds an upload server URL is reused
+    """
+
+    def __init__(self, group_id: str, concurrency: int = VK_UPLOAD_CONCURRENCY, url_ttl: float = VK_UPLOAD_URL_TTL):
+        self.group_id = str(group_id).lstrip('-')
+        self.concurrency = concurrency
+        self.url_ttl = url_ttl
+
+        self._upload_urls: dict[str, tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def upload_url(self, token: str) -> str:
+        with self._lock:
+            upload_url, expires = self._upload_urls.get(token, (None, 0.0))
+        if upload_url is not None and expires > time.monotonic():
+            return upload_url
+
+        # requested outside the lock, so a slow answer for one token does not hold up the others
+        response = vk_session().post('photos.getWallUploadServer', params={'group_id': self.group_id},
+                                     token=token).json()
+        if 'error' in response:
+            raise ConnectionError(vk_error(response))
+        upload_url = response['response']['upload_url']
+        with self._lock:
+            self._upload_urls[token] = (upload_url, time.monotonic() + self.url_ttl)
+        return upload_url
+
+    def upload(self, path: str) -> UploadResult:
+        result = UploadResult(str(path))
+        started = time.perf_counter()
+        tokens, token = vk_token_pool(), None
+
+        try:
+            result.size = os.path.getsize(path)
+            token = tokens.acquire('photos.saveWallPhoto')
+            with open(path, 'rb') as file:
+                encoder = MultipartEncoder({'photo': file_field(path, file)})
+                uploaded = upload_session().post(self.upload_url(token), data=encoder, timeout=VK_UPLOAD_TIMEOUT,
+                                                 headers={'Content-Type': encoder.content_type}).json()
+
+            if not uploaded.get('photo') or uploaded.get('photo') == '[]':
+                result.error = f'Upload failed: {uploaded}'
+            else:
+                response = vk_session().post('photos.saveWallPhoto', params={
+                    'group_id': self.group_id,
+                    'server': uploaded.get('server'),
+                    'photo': uploaded.get('photo'),
+                    'hash': uploaded.get('hash'),
+                }, token=token).json()
+
+                if 'error' in response:
+                    result.error = vk_error(response)
+                else:
+                    photo = response['response'][0]
+                    result.attachment = {'owner': photo['owner_id'], 'media': photo['id']}
+
+        except Exception as e:
+            result.error = str(e)
+
+        finally:
+            if token is not None:
+                tokens.release(token)
+
+        result.seconds = time.perf_counter() - started
+        return result
+
+    def upload_many(self, paths: list[str]) -> list[UploadResult]:
+
+        """
+        Uploads the files concurrently, results in the order of `paths`
+        """
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max(1, min(len(paths), self.concurrency))) as executor:
+            results = list(executor.map(self.upload, paths))
+        log_results(results, time.perf_counter() - started)
+        return results
+
+    def post(self, paths: list[str], owner_id: str = None, **kwargs) -> dict:
+
+        """
+        Uploads the photos and posts them on the community wall with ApiVk.Wall.post
+        :param paths: Photo files
+        :param owner_id: Wall to post on, the community wall by default
+        :param kwargs: Other Wall.post parameters (message, from_group...)
+        :return: Like in Wall.post, with the UploadResult list in 'uploads'
+        """
+
+        results = self.upload_many(paths)
+        errors = [f'{result.path}: {result.error}' for result in results if result.error]
+        if errors:
+            return {'result': 'error', 'data': '; '.join(errors), 'uploads': results}
+
+        response = ApiVk().Wall().post(owner_id=owner_id or f'-{self.group_id}',
+                                       photos=[result.attachment for result in results], **kwargs)
+        return response | {'uploads': results}
+
+
+class AsyncPhotoUploader:
+
+    """
+    PhotoUploader for asyncio: the uploads share the aiohttp pool of `session` and file bodies are streamed by
+    aiohttp in chunks. Tokens and upload server URLs are handled like in PhotoUploader.
+    :param group_id: Community id the photos are uploaded for (without "-")
+    :param concurrency: files uploaded at the same time
+    :param session: AsyncVkSession to use (the shared async_vk_session() by default)
+    :param url_ttl: seconds an upload server URL is reused
+    """
+
+    def __init__(self, group_id: str, concurrency: int = VK_UPLOAD_CONCURRENCY, session: AsyncVkSession = None,
+                 url_ttl: float = VK_UPLOAD_URL_TTL):
+        self.group_id = str(group_id).lstrip('-')
+        self.concurrency = concurrency
+        self.session = session or async_vk_session()
+        self.url_ttl = url_ttl
+
+        self._upload_urls: dict[str, tuple[str, float]] = {}
+
+    async def upload_url(self, token: str) -> str:
+        upload_url, expires = self._upload_urls.get(token, (None, 0.0))
+        if upload_url is not None and expires > time.monotonic():
+            return upload_url
+
+        response = await self.session.post('photos.getWallUploadServer', params={'group_id': self.group_id},
+                                           token=token)
+        if 'error' in response:
+            raise ConnectionError(vk_error(response))
+        upload_url = response['response']['upload_url']
+        self._upload_urls[token] = (upload_url, time.monotonic() + self.url_ttl)
+        return upload_url
+
+    async def upload(self, path: str) -> UploadResult:
+        result = UploadResult(str(path))
+        started = time.perf_counter()
+        tokens, token = vk_token_pool(), None
+
+        try:
+            result.size = os.path.getsize(path)
+            token = tokens.acquire('photos.saveWallPhoto')
+            upload_url = await self.upload_url(token)
+            with open(path, 'rb') as file:
+                name, _, content_type = file_field(path, file)
+                form = aiohttp.FormData()
+                form.add_field('photo', file, filename=name, content_type=content_type)
+                timeout = aiohttp.ClientTimeout(total=VK_UPLOAD_TIMEOUT)
+                async with self.session.session.post(upload_url, data=form, timeout=timeout) as response:
+                    uploaded = await response.json(content_type=None)
+
+            if not uploaded.get('photo') or uploaded.get('photo') == '[]':
+                result.error = f'Upload failed: {uploaded}'
+            else:
+                response = await self.session.post('photos.saveWallPhoto', params={
+                    'group_id': self.group_id,
+                    'server': uploaded.get('server'),
+                    'photo': uploaded.get('photo'),
+                    'hash': uploaded.get('hash'),
+                }, token=token)
+
+                if 'error' in response:
+                    result.error = vk_error(response)
+                else:
+                    photo = response['response'][0]
+                    result.attachment = {'owner': photo['owner_id'], 'media': photo['id']}
+
+        except Exception as e:
+            result.error = str(e)
+
+        finally:
+            if token is not None:
+                tokens.release(token)
+
+        result.seconds = time.perf_counter() - started
+        return result
+
+    async def upload_many(self, paths: list[str]) -> list[UploadResult]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def upload(path):
+            async with semaphore:
+                return await self.upload(path)
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(upload(path) for path in paths))
+        log_results(results, time.perf_counter() - started)
+        return results
+
+    async def post(self, paths: list[str], owner_id: str = None, **kwargs) -> dict:
+        results = await self.upload_many(paths)
+        errors = [f'{result.path}: {result.error}' for result in results if result.error]
+        if errors:
+            return {'result': 'error', 'data': '; '.join(errors), 'uploads': results}
+
+        response = await AsyncApiVk(session=self.session).wall().post(
+            owner_id=owner_id or f'-{self.group_id}', photos=[result.attachment for result in results], **kwargs
+        )
+        return response | {'uploads': results}
+
+
+__all__ = ['UploadResult', 'PhotoUploader', 'AsyncPhotoUploader', 'upload_session']